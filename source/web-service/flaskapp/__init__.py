@@ -3,7 +3,9 @@ import logging.config
 from os import environ, getenv
 from flaskapp.logging_configuration import get_logging_config
 import json
+import os
 import requests
+import tempfile
 
 from datetime import datetime
 import sqlite3
@@ -14,6 +16,7 @@ from flask import Flask, Response
 from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_compress import Compress
+from sqlalchemy.exc import SQLAlchemyError
 
 from flask.logging import default_handler
 
@@ -22,17 +25,41 @@ from flaskapp.routes.activity import activity
 from flaskapp.routes.activity_entity import activity_entity
 from flaskapp.routes.records import records
 from flaskapp.routes.ingest import ingest
+from flaskapp.routes.batch import batch
+from flaskapp.routes.changes import changes
 from flaskapp.routes.health import health
 from flaskapp.routes.sparql import sparql
 from flaskapp.routes.yasgui import yasgui
 from flaskapp.routes.timegate import timegate
 from flaskapp.models import db
-from flaskapp.models.activity import Activity
+from flaskapp.models.activity import (
+    Activity,
+    ActivityStreamPage,
+    ActivityCount,
+    ActivityTimeSpan,
+    ActivityTypeMark,
+)
 from flaskapp.models.record import Record
 from flaskapp.models.container import LDPContainer, LDPContainerContents
+from flaskapp.models.rendering import Rendering
+from flaskapp.models.subaddress import SubIdentifier
+from flaskapp.models.entity_type import EntityType
+from flaskapp.models.statistics import Statistics
+from flaskapp.models.timemap import TimeMapPage
 from flaskapp import local_thesaurus
 from flaskapp.base_graph_utils import base_graph_filter, document_loader
 from flaskapp.ldp_id_generation import LDP_ID_GEN_OPTIONS
+from flaskapp.storage_utilities.version_retention import parse_thinning
+from flaskapp.graph_prefix_bindings import FORMATS
+from flaskapp.offload import OffloadError, OffloadTimeoutError
+from flaskapp.singleflight import SingleFlightTimeoutError
+from flaskapp.existence import init_existence_filter
+from flaskapp.errors import (
+    construct_error_response,
+    status_offload_saturated,
+    status_offload_timeout,
+    status_coalesce_timeout,
+)
 
 from gettysparqlpatterns import PatternSet, NoPatternsFoundError
 
@@ -309,9 +336,16 @@ def create_app():
 
         # set up a default RDF context cache?
         doccache_default_expiry = int(environ.get("RDF_CONTEXT_CACHE_EXPIRES", 30))
+        doc_cache = {}
         app.config["RDF_DOCLOADER"] = document_loader(
-            docCache={}, cache_expires=doccache_default_expiry
+            docCache=doc_cache, cache_expires=doccache_default_expiry
         )
+        # The loader itself can't be pickled, so keep the settings used to create it for
+        # any offload processes (see flaskapp.offload)
+        app.config["RDF_DOCLOADER_SETTINGS"] = {
+            "docCache": doc_cache,
+            "cache_expires": doccache_default_expiry,
+        }
 
         # Preload the cache?
         # See the base_graph_utils.document_loader for what structure to use for the cache object
@@ -326,17 +360,315 @@ def create_app():
                     cache_expires=doccache_default_expiry,
                     timeout=app.config["EXTERNALHTTPCALLS_TIMELIMIT"],
                 )
+                app.config["RDF_DOCLOADER_SETTINGS"] = {
+                    "docCache": doc_cache,
+                    "cache_expires": doccache_default_expiry,
+                    "timeout": app.config["EXTERNALHTTPCALLS_TIMELIMIT"],
+                }
             except (json.decoder.JSONDecodeError, requests.exceptions.Timeout) as e:
                 app.logger.error(
                     f"The data in ENV: 'RDF_CONTEXT_CACHE' could not be loaded! {str(e)}"
                 )
 
+    # Offload the CPU-bound RDF expansion and serialization to a small per-worker process pool?
+    # Mainly of use with the gevent worker class, where this work would otherwise block every
+    # other connection held by the worker.
+    app.config["OFFLOAD_RDF_PROCESSING"] = False
+    app.config["OFFLOAD_WORKERS"] = 2
+    app.config["OFFLOAD_QUEUE_SIZE"] = 8
+    app.config["OFFLOAD_TIMEOUT"] = 30
+    if environ.get("OFFLOAD_RDF_PROCESSING", "False").lower() == "true":
+        app.config["OFFLOAD_RDF_PROCESSING"] = True
+        for k in ["OFFLOAD_WORKERS", "OFFLOAD_QUEUE_SIZE", "OFFLOAD_TIMEOUT"]:
+            try:
+                app.config[k] = int(environ.get(k, app.config[k]))
+            except (ValueError, TypeError):
+                app.logger.error(
+                    f"Environment variable '{k}' is not an integer. Defaulting to {app.config[k]}."
+                )
+        app.logger.info(
+            f"RDF processing will be offloaded to {app.config['OFFLOAD_WORKERS']} processes per worker "
+            f"(queue size {app.config['OFFLOAD_QUEUE_SIZE']}, timeout {app.config['OFFLOAD_TIMEOUT']}s)"
+        )
+
+    # Pre-render these serializations (eg "json-ld,turtle,nt11") of records when they are ingested?
+    # See flaskapp.storage_utilities.rendering
+    app.config["PRERENDER_FORMATS"] = []
+    if environ.get("PRERENDER_FORMATS"):
+        # 'json-ld' is the prefixed JSON document, which doesn't need RDF processing
+        allowed_formats = {"json-ld"}
+        if app.config["PROCESS_RDF"] is True:
+            allowed_formats = set(FORMATS.values())
+        for shortformat in environ["PRERENDER_FORMATS"].split(","):
+            shortformat = shortformat.strip()
+            if shortformat in allowed_formats:
+                app.config["PRERENDER_FORMATS"].append(shortformat)
+            elif shortformat:
+                app.logger.error(
+                    f"'{shortformat}' in PRERENDER_FORMATS is not one of {sorted(allowed_formats)}. Ignoring."
+                )
+        app.logger.info(
+            f"Records will be pre-rendered as: {app.config['PRERENDER_FORMATS']}"
+        )
+
+    # Store gzip and brotli compressed copies of the pre-rendered serializations?
+    # COMPRESS_MIN_SIZE is shared with Flask-Compress, which compresses everything else on the fly
+    # if FLASK_GZIP_COMPRESSION is enabled.
+    app.config["PRECOMPRESS_RENDERINGS"] = (
+        environ.get("PRECOMPRESS_RENDERINGS", "False").lower() == "true"
+    )
+    try:
+        app.config["COMPRESS_MIN_SIZE"] = int(environ.get("COMPRESS_MIN_SIZE", 500))
+    except (ValueError, TypeError):
+        app.logger.error(
+            "Environment variable 'COMPRESS_MIN_SIZE' is not an integer. Defaulting to 500."
+        )
+        app.config["COMPRESS_MIN_SIZE"] = 500
+
+    # Coalesce identical, concurrent record requests within a worker? (see flaskapp.singleflight)
+    app.config["COALESCE_REQUESTS"] = (
+        environ.get("COALESCE_REQUESTS", "False").lower() == "true"
+    )
+    try:
+        app.config["COALESCE_TIMEOUT"] = int(environ.get("COALESCE_TIMEOUT", 30))
+    except (ValueError, TypeError):
+        app.logger.error(
+            "Environment variable 'COALESCE_TIMEOUT' is not an integer. Defaulting to 30."
+        )
+        app.config["COALESCE_TIMEOUT"] = 30
+
+    # Answer lookups of ids that do not exist from a shared Bloom filter? (see flaskapp.existence)
+    app.config["EXISTENCE_FILTER"] = (
+        environ.get("EXISTENCE_FILTER", "False").lower() == "true"
+    )
+    app.config["EXISTENCE_FILTER_PATH"] = environ.get(
+        "EXISTENCE_FILTER_PATH",
+        os.path.join(
+            tempfile.gettempdir(),
+            f"lod-gateway-{app.config['NAMESPACE'].replace('/', '-') or 'default'}.existence",
+        ),
+    )
+    try:
+        app.config["EXISTENCE_FILTER_FP_RATE"] = float(
+            environ.get("EXISTENCE_FILTER_FP_RATE", 0.01)
+        )
+        if not 0 < app.config["EXISTENCE_FILTER_FP_RATE"] < 1:
+            raise ValueError
+    except (ValueError, TypeError):
+        app.logger.error(
+            "Environment variable 'EXISTENCE_FILTER_FP_RATE' must be a number between 0 and 1. Defaulting to 0.01."
+        )
+        app.config["EXISTENCE_FILTER_FP_RATE"] = 0.01
+    try:
+        app.config["EXISTENCE_FILTER_REFRESH"] = int(
+            environ.get("EXISTENCE_FILTER_REFRESH", 5)
+        )
+    except (ValueError, TypeError):
+        app.logger.error(
+            "Environment variable 'EXISTENCE_FILTER_REFRESH' is not an integer. Defaulting to 5."
+        )
+        app.config["EXISTENCE_FILTER_REFRESH"] = 5
+    # Records created this many seconds before the latest one a refresh has seen are read again,
+    # in case their ingest committed after it
+    try:
+        app.config["EXISTENCE_FILTER_LOOKBACK"] = int(
+            environ.get("EXISTENCE_FILTER_LOOKBACK", 600)
+        )
+    except (ValueError, TypeError):
+        app.logger.error(
+            "Environment variable 'EXISTENCE_FILTER_LOOKBACK' is not an integer. Defaulting to 600."
+        )
+        app.config["EXISTENCE_FILTER_LOOKBACK"] = 600
+    try:
+        app.config["EXISTENCE_FILTER_NEGATIVE_TTL"] = int(
+            environ.get("EXISTENCE_FILTER_NEGATIVE_TTL", 30)
+        )
+    except (ValueError, TypeError):
+        app.logger.error(
+            "Environment variable 'EXISTENCE_FILTER_NEGATIVE_TTL' is not an integer. Defaulting to 30."
+        )
+        app.config["EXISTENCE_FILTER_NEGATIVE_TTL"] = 30
+
     # Setting the limit on number of records returned due to a glob browse request
     try:
         app.config["BROWSE_PAGE_SIZE"] = int(environ.get("BROWSE_PAGE_SIZE", 200))
     except (ValueError, TypeError) as e:
         app.config["BROWSE_PAGE_SIZE"] = 200
 
+    # How long a worker may use its count of the records matching a prefix listing ('entity_id*')
+    # before counting them again, in the background. 0 counts them for every page.
+    try:
+        app.config["PREFIX_COUNT_TTL"] = int(environ.get("PREFIX_COUNT_TTL", 300))
+    except (ValueError, TypeError):
+        app.logger.error(
+            "Environment variable 'PREFIX_COUNT_TTL' is not an integer. Defaulting to 300."
+        )
+        app.config["PREFIX_COUNT_TTL"] = 300
+
+    # Limits for batch record and revalidation requests (see flaskapp.routes.batch)
+    try:
+        app.config["BATCH_MAX_IDS"] = int(environ.get("BATCH_MAX_IDS", 1000))
+    except (ValueError, TypeError):
+        app.logger.error(
+            "Environment variable 'BATCH_MAX_IDS' is not an integer. Defaulting to 1000."
+        )
+        app.config["BATCH_MAX_IDS"] = 1000
+    try:
+        app.config["BATCH_QUERY_SIZE"] = int(environ.get("BATCH_QUERY_SIZE", 500))
+    except (ValueError, TypeError):
+        app.logger.error(
+            "Environment variable 'BATCH_QUERY_SIZE' is not an integer. Defaulting to 500."
+        )
+        app.config["BATCH_QUERY_SIZE"] = 500
+    try:
+        app.config["REVALIDATE_MAX_PAIRS"] = int(
+            environ.get("REVALIDATE_MAX_PAIRS", 1000000)
+        )
+    except (ValueError, TypeError):
+        app.logger.error(
+            "Environment variable 'REVALIDATE_MAX_PAIRS' is not an integer. Defaulting to 1000000."
+        )
+        app.config["REVALIDATE_MAX_PAIRS"] = 1000000
+
+    # The most changes that /changes will return at once
+    try:
+        app.config["CHANGES_MAX_LIMIT"] = int(environ.get("CHANGES_MAX_LIMIT", 10000))
+    except (ValueError, TypeError):
+        app.logger.error(
+            "Environment variable 'CHANGES_MAX_LIMIT' is not an integer. Defaulting to 10000."
+        )
+        app.config["CHANGES_MAX_LIMIT"] = 10000
+
+    # Waiting for new changes: the longest a /changes?wait= request may wait, how long a
+    # /changes/stream connection is held open, and how often the activities table is polled
+    # for new rows on DBs other than PostgreSQL (which notifies the workers instead)
+    app.config["CHANGES_MAX_WAIT"] = 60
+    app.config["CHANGES_STREAM_TIMEOUT"] = 300
+    app.config["CHANGES_POLL_INTERVAL"] = 2
+    for k in ["CHANGES_MAX_WAIT", "CHANGES_STREAM_TIMEOUT", "CHANGES_POLL_INTERVAL"]:
+        try:
+            app.config[k] = int(environ.get(k, app.config[k]))
+        except (ValueError, TypeError):
+            app.logger.error(
+                f"Environment variable '{k}' is not an integer. Defaulting to {app.config[k]}."
+            )
+
+    # Store each page of the activity stream once it is full, and serve that copy as-is, with
+    # an ETag and a Cache-Control max-age of ACTIVITY_PAGE_MAX_AGE seconds
+    app.config["ACTIVITY_PAGE_CACHE"] = False
+    if environ.get("ACTIVITY_PAGE_CACHE", "False").lower() == "true":
+        app.config["ACTIVITY_PAGE_CACHE"] = True
+    try:
+        app.config["ACTIVITY_PAGE_MAX_AGE"] = int(
+            environ.get("ACTIVITY_PAGE_MAX_AGE", 86400)
+        )
+    except (ValueError, TypeError):
+        app.logger.error(
+            "Environment variable 'ACTIVITY_PAGE_MAX_AGE' is not an integer. Defaulting to 86400."
+        )
+        app.config["ACTIVITY_PAGE_MAX_AGE"] = 86400
+    # A page is only stored once an activity after it is this many seconds old, so that no
+    # ingest still to commit can add to it (see flaskapp.storage_utilities.activity_pages)
+    try:
+        app.config["ACTIVITY_PAGE_GRACE"] = int(environ.get("ACTIVITY_PAGE_GRACE", 600))
+    except (ValueError, TypeError):
+        app.logger.error(
+            "Environment variable 'ACTIVITY_PAGE_GRACE' is not an integer. Defaulting to 600."
+        )
+        app.config["ACTIVITY_PAGE_GRACE"] = 600
+
+    # Keep running counts of the activities for the activity stream totals, rather than
+    # counting them on each request. Run `flask records activity-counts` once when enabling this
+    app.config["ACTIVITY_COUNTS"] = False
+    if environ.get("ACTIVITY_COUNTS", "False").lower() == "true":
+        app.config["ACTIVITY_COUNTS"] = True
+
+    # The most versions listed on one page of a TimeMap, and whether to store the rendered pages
+    try:
+        app.config["TIMEMAP_PAGE_SIZE"] = int(environ.get("TIMEMAP_PAGE_SIZE", 1000))
+    except (ValueError, TypeError):
+        app.logger.error(
+            "Environment variable 'TIMEMAP_PAGE_SIZE' is not an integer. Defaulting to 1000."
+        )
+        app.config["TIMEMAP_PAGE_SIZE"] = 1000
+    app.config["TIMEMAP_CACHE"] = False
+    if environ.get("TIMEMAP_CACHE", "False").lower() == "true":
+        app.config["TIMEMAP_CACHE"] = True
+
+    # Keep versions as JSON patches against the next newer version, with every
+    # VERSION_SNAPSHOT_INTERVAL-th one in full, and cache VERSION_CACHE_SIZE rebuilt versions
+    app.config["VERSION_DELTAS"] = False
+    if environ.get("VERSION_DELTAS", "False").lower() == "true":
+        app.config["VERSION_DELTAS"] = True
+    app.config["VERSION_SNAPSHOT_INTERVAL"] = 10
+    app.config["VERSION_CACHE_SIZE"] = 256
+    for k in ["VERSION_SNAPSHOT_INTERVAL", "VERSION_CACHE_SIZE"]:
+        try:
+            app.config[k] = int(environ.get(k, app.config[k]))
+        except (ValueError, TypeError):
+            app.logger.error(
+                f"Environment variable '{k}' is not an integer. Defaulting to {app.config[k]}."
+            )
+
+    # Retention rules for `flask records prune-versions`: keep only the latest
+    # VERSION_RETENTION_MAX versions of each record, none older than VERSION_RETENTION_MAX_AGE
+    # days (0 for no limit), and thin out the older ones by the VERSION_THINNING schedule,
+    # working through VERSION_PRUNE_BATCH_SIZE records at a time
+    app.config["VERSION_RETENTION_MAX"] = 0
+    app.config["VERSION_RETENTION_MAX_AGE"] = 0
+    app.config["VERSION_PRUNE_BATCH_SIZE"] = 500
+    for k in [
+        "VERSION_RETENTION_MAX",
+        "VERSION_RETENTION_MAX_AGE",
+        "VERSION_PRUNE_BATCH_SIZE",
+    ]:
+        try:
+            app.config[k] = int(environ.get(k, app.config[k]))
+        except (ValueError, TypeError):
+            app.logger.error(
+                f"Environment variable '{k}' is not an integer. Defaulting to {app.config[k]}."
+            )
+    # eg "7:daily,90:monthly" - see flaskapp.storage_utilities.version_retention
+    try:
+        app.config["VERSION_THINNING"] = parse_thinning(environ.get("VERSION_THINNING"))
+    except ValueError as e:
+        app.logger.error(
+            f"Environment variable 'VERSION_THINNING' is not a thinning schedule ({e}). Ignoring."
+        )
+        app.config["VERSION_THINNING"] = []
+
+    # Retention rules for `flask records compact-activities`: keep only the latest
+    # ACTIVITY_RETENTION_KEEP events of each record (and its oldest), and remove the activities
+    # of records deleted more than ACTIVITY_RETENTION_DELETED_DAYS days ago (0 for no limit),
+    # working through COMPACTION_BATCH_SIZE records at a time
+    app.config["ACTIVITY_RETENTION_KEEP"] = 0
+    app.config["ACTIVITY_RETENTION_DELETED_DAYS"] = 0
+    app.config["COMPACTION_BATCH_SIZE"] = 500
+    for k in [
+        "ACTIVITY_RETENTION_KEEP",
+        "ACTIVITY_RETENTION_DELETED_DAYS",
+        "COMPACTION_BATCH_SIZE",
+    ]:
+        try:
+            app.config[k] = int(environ.get(k, app.config[k]))
+        except (ValueError, TypeError):
+            app.logger.error(
+                f"Environment variable '{k}' is not an integer. Defaulting to {app.config[k]}."
+            )
+    # Keep only the last of a run of consecutive Update events of a record when compacting
+    app.config["ACTIVITY_COLLAPSE_UPDATES"] = False
+    if environ.get("ACTIVITY_COLLAPSE_UPDATES", "False").lower() == "true":
+        app.config["ACTIVITY_COLLAPSE_UPDATES"] = True
+
+    # How old the stored dashboard statistics may be before they are refreshed, in seconds
+    try:
+        app.config["DASHBOARD_STATS_TTL"] = int(environ.get("DASHBOARD_STATS_TTL", 300))
+    except (ValueError, TypeError):
+        app.logger.error(
+            "Environment variable 'DASHBOARD_STATS_TTL' is not an integer. Defaulting to 300."
+        )
+        app.config["DASHBOARD_STATS_TTL"] = 300
+
     app.config["JSON_AS_ASCII"] = False
     app.config["FLASK_GZIP_COMPRESSION"] = environ["FLASK_GZIP_COMPRESSION"]
     app.config["PREFIX_RECORD_IDS"] = getenv("PREFIX_RECORD_IDS", default="RECURSIVE")
@@ -383,6 +715,12 @@ def create_app():
                     f"Value for SUBADDRESSING_DEPTH could not be interpreted as an integer. Ignoring."
                 )
 
+    # Look subaddressed ids up in the 'sub_identifiers' table, maintained at ingest?
+    app.config["SUBADDRESSING_INDEX"] = (
+        app.config["SUBADDRESSING"] is True
+        and environ.get("SUBADDRESSING_INDEX", "False").lower() == "true"
+    )
+
     if app.config["FLASK_ENV"].lower() == "development":
         app.config["SQLALCHEMY_ECHO"] = True
 
@@ -417,6 +755,13 @@ def create_app():
                 app.config["RDF_BASE_GRAPH"], app.config["FULL_BASE_GRAPH"]
             )
 
+        if app.config["EXISTENCE_FILTER"] is True:
+            try:
+                init_existence_filter()
+            except (OSError, SQLAlchemyError) as e:
+                # Not fatal - workers retry when they first need the filter
+                app.logger.error(f"Could not build the existence filter: {e}")
+
         app.config["SERVER_CAPABILITIES"] = (
             ", ".join(
                 [
@@ -453,6 +798,8 @@ def create_app():
         app.register_blueprint(home_page, url_prefix=f"/{ns}")
         app.register_blueprint(activity, url_prefix=f"/{ns}")
         app.register_blueprint(activity_entity, url_prefix=f"/{ns}")
+        app.register_blueprint(batch, url_prefix=f"/{ns}")
+        app.register_blueprint(changes, url_prefix=f"/{ns}")
         app.register_blueprint(records, url_prefix=f"/{ns}")
         app.register_blueprint(ingest, url_prefix=f"/{ns}")
         app.register_blueprint(sparql, url_prefix=f"/{ns}")
@@ -469,6 +816,16 @@ def create_app():
             body = f"Welcome to the Getty's Linked Open Data Gateway Service at {now}"
             return app.make_response(body)
 
+        @app.errorhandler(OffloadError)
+        def offload_unavailable(e):
+            if isinstance(e, OffloadTimeoutError):
+                return construct_error_response(status_offload_timeout)
+            return construct_error_response(status_offload_saturated)
+
+        @app.errorhandler(SingleFlightTimeoutError)
+        def coalesce_timeout(e):
+            return construct_error_response(status_coalesce_timeout)
+
         @app.after_request
         def add_header(response):
             response.headers["Server"] = "LOD Gateway/2.3.0"
@@ -476,8 +833,8 @@ def create_app():
                 "SERVER_CAPABILITIES"
             ]
 
-            # Cache-control
-            response.headers["Cache-Control"] = "no-cache"
+            # Cache-control, unless the response has set its own
+            response.headers.setdefault("Cache-Control", "no-cache")
 
             return response
 
@@ -0,0 +1,186 @@
+import os
+import select
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, func, text
+
+from flaskapp.models import db
+from flaskapp.models.activity import Activity
+
+"""
+Watching for new activities
+---------------------------
+
+Requests that wait for new activity (a long-poll of /changes with `wait=`, or the
+/changes/stream event stream) do not each query the DB to find out if there is any. Instead,
+each worker has a single ActivityWatcher, on a single background thread, that keeps track of
+the highest committed activity id, and every waiting request sleeps on it until that passes
+their cursor. Under the gevent worker class the thread is a greenlet, and the waits are
+cooperative, so any number of requests can wait at once.
+
+On PostgreSQL, a transaction that adds activities sends a NOTIFY (on ACTIVITY_CHANNEL, with
+the highest new activity id) as it commits - the notification is only delivered if the
+commit succeeds - and the watcher LISTENs for them on its own connection. It also checks
+max(activities.id) whenever the connection has been quiet for _LISTEN_CHECK_SECONDS, which
+both tests the connection and picks up anything missed while reconnecting.
+
+On other DBs, the watcher polls max(activities.id) every CHANGES_POLL_INTERVAL seconds.
+
+Either way, activities committed by the worker itself wake its own waiters straight away.
+"""
+
+ACTIVITY_CHANNEL = "lod_gateway_activity"
+_LISTEN_CHECK_SECONDS = 30
+_PENDING_KEY = "new_activities"
+_COMMITTED_KEY = "committed_activity_id"
+
+_LOCK = threading.Lock()
+
+
+class ActivityWatcher:
+    """Tracks the highest committed activity id, and wakes the requests waiting on it"""
+
+    def __init__(self, app):
+        self.app = app
+        self.latest = None
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="activity-watcher", daemon=True
+        )
+        self.pid = os.getpid()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(timeout=5)
+
+    def publish(self, activity_id):
+        with self._condition:
+            if activity_id is not None and (
+                self.latest is None or activity_id > self.latest
+            ):
+                self.latest = activity_id
+                self._condition.notify_all()
+
+    def wait_for(self, since, timeout):
+        """Block until an activity with an id greater than since has been committed, or for
+        timeout seconds. Returns True if there is such an activity."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self.latest is None or self.latest <= since:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopped.is_set():
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _run(self):
+        interval = self.app.config["CHANGES_POLL_INTERVAL"]
+        while not self._stopped.is_set():
+            try:
+                if self.app.config["DB_DIALECT"] == "postgresql":
+                    self._listen()
+                else:
+                    self._poll()
+            except Exception as e:
+                self.app.logger.error(f"Activity watcher failed, retrying: {e}")
+            self._stopped.wait(interval)
+
+    def _poll(self):
+        interval = self.app.config["CHANGES_POLL_INTERVAL"]
+        with self.app.app_context():
+            while not self._stopped.is_set():
+                self.publish(db.session.query(func.max(Activity.id)).scalar())
+                # Hand the connection back to the pool between polls
+                db.session.remove()
+                self._stopped.wait(interval)
+
+    def _listen(self):
+        with self.app.app_context():
+            # A connection of its own, taken out of the pool for good
+            connection = db.engine.raw_connection()
+            connection.detach()
+        conn = connection.dbapi_connection
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute(f"LISTEN {ACTIVITY_CHANNEL}")
+            self.app.logger.info(f"Listening for new activities on {ACTIVITY_CHANNEL}")
+            check = True
+            while not self._stopped.is_set():
+                if check:
+                    cursor.execute(f"SELECT max(id) FROM {Activity.__tablename__}")
+                    self.publish(cursor.fetchone()[0])
+                ready, _, _ = select.select([conn], [], [], _LISTEN_CHECK_SECONDS)
+                check = not ready
+                if ready:
+                    conn.poll()
+                    latest = None
+                    while conn.notifies:
+                        notification = conn.notifies.pop(0)
+                        try:
+                            latest = max(latest or 0, int(notification.payload))
+                        except ValueError:
+                            check = True
+                    self.publish(latest)
+        finally:
+            conn.close()
+
+
+def get_activity_watcher():
+    """The watcher for this app in this worker process, started the first time it is asked for"""
+    watcher = current_app.extensions.get("activity_watcher")
+    if watcher is not None and watcher.pid == os.getpid():
+        return watcher
+
+    with _LOCK:
+        watcher = current_app.extensions.get("activity_watcher")
+        # The pid is checked so that a watcher is never carried across a fork
+        if watcher is None or watcher.pid != os.getpid():
+            watcher = ActivityWatcher(current_app._get_current_object())
+            current_app.extensions["activity_watcher"] = watcher
+            watcher.start()
+    return watcher
+
+
+def note_new_activity(activity):
+    """Mark the session as having added an activity, to be announced when it commits"""
+    db.session.info.setdefault(_PENDING_KEY, []).append(activity)
+
+
+@event.listens_for(db.session, "before_commit")
+def _notify_new_activities(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    # The activity ids are only known once they have been flushed
+    session.flush()
+    latest = max((a.id for a in pending if a.id is not None), default=None)
+    if latest is None:
+        return
+    session.info[_COMMITTED_KEY] = latest
+    if current_app.config.get("DB_DIALECT") == "postgresql":
+        # Sent on commit, and only if the commit succeeds
+        session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": ACTIVITY_CHANNEL, "payload": str(latest)},
+        )
+
+
+@event.listens_for(db.session, "after_commit")
+def _wake_local_waiters(session):
+    latest = session.info.pop(_COMMITTED_KEY, None)
+    watcher = current_app.extensions.get("activity_watcher")
+    if latest is not None and watcher is not None and watcher.pid == os.getpid():
+        watcher.publish(latest)
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def _forget_new_activities(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_COMMITTED_KEY, None)
@@ -0,0 +1,53 @@
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from flaskapp.models import db
+
+"""
+Background tasks
+----------------
+
+A single background thread per worker process, for work that should happen after a request
+has been answered - storing renderings, refreshing cached counts and so on. Tasks run one
+at a time, in the order they were submitted, each in its own app context.
+"""
+
+# The pid is kept so that an executor is never carried across a fork.
+_EXECUTOR = None
+_EXECUTOR_PID = None
+_LOCK = threading.Lock()
+
+
+def get_executor():
+    global _EXECUTOR, _EXECUTOR_PID
+
+    if _EXECUTOR is not None and _EXECUTOR_PID == os.getpid():
+        return _EXECUTOR
+
+    with _LOCK:
+        if _EXECUTOR is None or _EXECUTOR_PID != os.getpid():
+            _EXECUTOR = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="background"
+            )
+            _EXECUTOR_PID = os.getpid()
+    return _EXECUTOR
+
+
+def _run_in_app_context(app, func, *args):
+    with app.app_context():
+        try:
+            return func(*args)
+        except Exception as e:
+            app.logger.error(f"Background task {func.__name__} failed: {e}")
+            db.session.rollback()
+
+
+def submit(func, *args):
+    """Run func(*args) on this worker's background thread. Returns a Future."""
+    return get_executor().submit(
+        _run_in_app_context, current_app._get_current_object(), func, *args
+    )
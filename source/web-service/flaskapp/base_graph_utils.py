@@ -90,7 +90,7 @@ def document_loader(docCache, cache_expires=30, timeout=45):
 
 def base_graph_filter(basegraphobj, fqdn_id):
     try:
-        record = get_record(basegraphobj)
+        record = get_record(basegraphobj, use_existence_filter=True)
 
         if record and "record" in record and record["record"].data:
             # only change the named graph to be a FQDN
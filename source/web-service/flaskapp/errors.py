@@ -30,6 +30,22 @@ status_page_not_found = status_nt(404, "Page Not Found", "Page number out of bou
 
 status_pagenum_not_integer = status_nt(404, "Page Not Found", "Wrong page number")
 
+status_bad_page_token = status_nt(404, "Page Not Found", "Invalid 'after' page token")
+
+status_bad_timemap_cursor = status_nt(
+    404, "Page Not Found", "No such version to page the TimeMap from"
+)
+
+status_unsupported_encoding = status_nt(
+    415,
+    "Unsupported Media Type",
+    "The request body's Content-Encoding is not supported",
+)
+
+status_bad_since = status_nt(
+    400, "Bad Request", "'since' must be the cursor of a change (an activity id)"
+)
+
 status_GET_not_allowed = status_nt(
     405, "Forbidden Method", "For the requested URL only 'POST' method is allowed"
 )
@@ -40,6 +56,10 @@ status_id_missing = status_nt(422, "ID Missing", "ID for the JSON record not fou
 
 status_data_missing = status_nt(422, "Data Missing", "No input data found")
 
+status_batch_too_large = status_nt(
+    422, "Too Many Ids", "Too many ids were requested at once"
+)
+
 status_db_error = status_nt(
     500, "Data Base Error", "DB connection cannot be established"
 )
@@ -60,6 +80,18 @@ status_db_save_error = status_nt(
     503, "Service Unavailable", "Cannot perform database operation"
 )
 
+status_offload_saturated = status_nt(
+    503, "Service Unavailable", "Too many RDF processing requests queued"
+)
+
+status_offload_timeout = status_nt(
+    503, "Service Unavailable", "RDF processing did not complete in time"
+)
+
+status_coalesce_timeout = status_nt(
+    503, "Service Unavailable", "Timed out waiting for an identical request in progress"
+)
+
 
 class RDFDataError(ValueError):
     """Error representing a general problem treating some data as RDF"""
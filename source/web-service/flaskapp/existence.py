@@ -0,0 +1,385 @@
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import StaticPool
+
+from flaskapp.models import db
+from flaskapp.models.record import Record
+
+"""
+Existence filter
+----------------
+
+Requests for ids that do not exist (crawlers, stale links, subaddressing probes of every
+shorter prefix of a path) each cost a round trip to the DB just to learn that there is
+nothing there. When EXISTENCE_FILTER is enabled, a Bloom filter over records.entity_id
+answers most of those without touching the DB at all.
+
+The filter lives in a memory-mapped file (EXISTENCE_FILTER_PATH), so that all the workers
+on a host share a single copy. It is rebuilt from the records table at startup - unless
+another worker has just done so - into a new file that is swapped into place. Bits are only
+ever set, never cleared: ids added by an ingest that is later rolled back, or belonging to
+records that were deleted, just become false positives, which fall through to the DB.
+
+Records created by an ingest in this worker are added straight away. Records created
+anywhere else (another host, or a worker using an older copy of the file) are picked up by
+rereading, at most every EXISTENCE_FILTER_REFRESH seconds, every record created up to
+EXISTENCE_FILTER_LOOKBACK seconds before the latest one already seen. The rows are
+found by datetime_created rather than by id, as ids are handed out when a row is flushed
+rather than when it is committed: a long ingest elsewhere can commit rows with ids below
+ones this worker has already seen. So a worker that did not create a record reports it
+missing for at most EXISTENCE_FILTER_REFRESH seconds after it is committed - provided that
+its ingest committed within EXISTENCE_FILTER_LOOKBACK seconds of creating it, and
+the hosts' clocks agree to within that. One that took longer is only found once the filter
+is next rebuilt. The DB is read on a connection of its own, never in the transaction of the
+request that happened to trigger the refresh, and an ingest never refreshes or builds the
+filter itself.
+
+Ids that the filter lets through but that turn out not to be in the DB are remembered by each
+worker for EXISTENCE_FILTER_NEGATIVE_TTL seconds, or until any id is added to the filter.
+"""
+
+_MAGIC = b"LODEXIST"
+_FORMAT_VERSION = 2
+# magic, format version, number of hash functions, size in bits, capacity, latest
+# records.datetime_created scanned (as a timestamp), number of ids added since the build,
+# build timestamp
+_HEADER = struct.Struct("<8sIIQQdQd")
+_HEADER_SIZE = 64
+_WATERMARK_OFFSET = 32
+_ADDITIONS_OFFSET = 40
+
+# A file built this recently by another worker is reused rather than rebuilt at startup
+_STARTUP_REUSE_SECONDS = 300
+_BUILD_BATCH_SIZE = 10000
+_NEGATIVE_CACHE_SIZE = 10000
+
+
+class ExistenceFilter:
+    """A Bloom filter held in a shared, memory-mapped file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "r+b")
+        try:
+            self.inode = os.fstat(self._file.fileno()).st_ino
+            self._mm = mmap.mmap(self._file.fileno(), 0)
+        except (OSError, ValueError):
+            self._file.close()
+            raise
+
+        (
+            magic,
+            version,
+            self.k,
+            self.m,
+            self.capacity,
+            _,
+            _,
+            self.built_at,
+        ) = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or version != _FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not an existence filter file")
+
+    @staticmethod
+    def positions(key, k, m):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        h2 |= 1
+        return [(h1 + i * h2) % m for i in range(k)]
+
+    def might_contain(self, key):
+        mm = self._mm
+        for pos in self.positions(key, self.k, self.m):
+            if not mm[_HEADER_SIZE + (pos >> 3)] & (1 << (pos & 7)):
+                return False
+        return True
+
+    @property
+    def watermark(self):
+        return struct.unpack_from("<d", self._mm, _WATERMARK_OFFSET)[0]
+
+    @property
+    def additions(self):
+        return struct.unpack_from("<Q", self._mm, _ADDITIONS_OFFSET)[0]
+
+    def add(self, keys, watermark=None):
+        """Add the keys, and raise the latest scanned datetime_created to watermark if given.
+        Returns the number of keys that were not already in the filter."""
+        mm = self._mm
+        # Bits are set with a read-modify-write of a whole byte, so writers must take turns
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            added = 0
+            for key in keys:
+                changed = False
+                for pos in self.positions(key, self.k, self.m):
+                    offset = _HEADER_SIZE + (pos >> 3)
+                    bit = 1 << (pos & 7)
+                    if not mm[offset] & bit:
+                        mm[offset] |= bit
+                        changed = True
+                added += changed
+            if added:
+                struct.pack_into("<Q", mm, _ADDITIONS_OFFSET, self.additions + added)
+            if watermark is not None and watermark > self.watermark:
+                struct.pack_into("<d", mm, _WATERMARK_OFFSET, watermark)
+        finally:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        return added
+
+    def close(self):
+        try:
+            self._mm.close()
+        finally:
+            self._file.close()
+
+
+@contextmanager
+def _connection():
+    """A connection of its own, so that reading the records table neither waits on nor rolls
+    back the transaction of the request that asked"""
+    if isinstance(db.engine.pool, StaticPool):
+        # Everything shares the one connection (an in-memory sqlite DB), so there is no other
+        yield db.session.connection()
+    else:
+        with db.engine.connect() as connection:
+            yield connection
+
+
+def _timestamp(value):
+    # datetime_created is stored as UTC, and comes back naive from a TIMESTAMP column
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _iter_records(connection):
+    """(id, entity_id, datetime_created) for every record, in id order"""
+    since = 0
+    while True:
+        batch = connection.execute(
+            select(Record.id, Record.entity_id, Record.datetime_created)
+            .where(Record.id > since)
+            .order_by(Record.id)
+            .limit(_BUILD_BATCH_SIZE)
+        ).all()
+        if not batch:
+            return
+        yield from batch
+        since = batch[-1][0]
+
+
+def build_existence_filter(path, fp_rate):
+    """Build a new filter file from the records table, and swap it into place at path"""
+    with _connection() as connection:
+        _build_existence_filter(connection, path, fp_rate)
+
+
+def _build_existence_filter(connection, path, fp_rate):
+    total = connection.execute(select(db.func.count(Record.id))).scalar() or 0
+    # Leave room for the table to double before the false positive rate starts to climb
+    capacity = max(2 * total, 100000)
+    m = math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))
+    m = 8 * math.ceil(m / 8)
+    k = max(1, round(m / capacity * math.log(2)))
+
+    bits = bytearray(m // 8)
+    watermark = 0.0
+    for _, entity_id, created in _iter_records(connection):
+        for pos in ExistenceFilter.positions(entity_id, k, m):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        watermark = max(watermark, _timestamp(created))
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        header = _HEADER.pack(
+            _MAGIC, _FORMAT_VERSION, k, m, capacity, watermark, 0, time.time()
+        )
+        f.write(header.ljust(_HEADER_SIZE, b"\0"))
+        f.write(bits)
+    os.replace(tmp_path, path)
+
+    current_app.logger.info(
+        f"Built existence filter at {path} - {total} records, {m // 8} bytes, {k} hashes"
+    )
+
+
+def _open_existing(path):
+    try:
+        return ExistenceFilter(path)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def init_existence_filter(rebuild=False):
+    """Make sure there is an up to date filter file, building one if needed. Called at startup."""
+    path = current_app.config["EXISTENCE_FILTER_PATH"]
+    with open(f"{path}.lock", "a") as lock:
+        # Workers starting together queue up here, and all but the first reuse its file
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            existing = None if rebuild else _open_existing(path)
+            if existing is not None:
+                fresh = time.time() - existing.built_at < _STARTUP_REUSE_SECONDS
+                existing.close()
+                if fresh:
+                    return
+            build_existence_filter(path, current_app.config["EXISTENCE_FILTER_FP_RATE"])
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+# Per-process state, as the mapping itself cannot be carried across a fork
+_FILTER = None
+_FILTER_PID = None
+_LAST_REFRESH = 0.0
+_LOCK = threading.Lock()
+
+# entity_id -> (expiry time, filter additions count when the DB was checked)
+_NEGATIVE_CACHE = {}
+
+
+def reset_existence_filter():
+    """Drop this process's mapping and negative cache (eg after rebuilding the file)"""
+    global _FILTER, _FILTER_PID, _LAST_REFRESH
+    with _LOCK:
+        if _FILTER is not None and _FILTER_PID == os.getpid():
+            _FILTER.close()
+        _FILTER = _FILTER_PID = None
+        _LAST_REFRESH = 0.0
+        _NEGATIVE_CACHE.clear()
+
+
+def _refresh(existence_filter):
+    """Add any records created since the filter last looked, rereading the ones created
+    shortly before that in case they were committed after it"""
+    since = datetime.fromtimestamp(
+        existence_filter.watermark - current_app.config["EXISTENCE_FILTER_LOOKBACK"],
+        timezone.utc,
+    ).replace(tzinfo=None)
+    new_ids = []
+    watermark = None
+    with _connection() as connection:
+        for entity_id, created in connection.execute(
+            select(Record.entity_id, Record.datetime_created).where(
+                Record.datetime_created > since
+            )
+        ):
+            new_ids.append(entity_id)
+            watermark = max(watermark or 0.0, _timestamp(created))
+    if new_ids:
+        existence_filter.add(new_ids, watermark=watermark)
+
+
+def _open_filter():
+    """The filter for this process, mapping the file if it is there - but without building or
+    refreshing it, which would read the DB"""
+    global _FILTER, _FILTER_PID
+    with _LOCK:
+        if _FILTER is None or _FILTER_PID != os.getpid():
+            _FILTER = _open_existing(current_app.config["EXISTENCE_FILTER_PATH"])
+            _FILTER_PID = os.getpid()
+        return _FILTER
+
+
+def get_existence_filter():
+    """The filter for this process, or None if it is disabled or unavailable"""
+    global _FILTER, _FILTER_PID, _LAST_REFRESH
+
+    if current_app.config.get("EXISTENCE_FILTER") is not True:
+        return None
+
+    now = time.monotonic()
+    if (
+        _FILTER is not None
+        and _FILTER_PID == os.getpid()
+        and now - _LAST_REFRESH < current_app.config["EXISTENCE_FILTER_REFRESH"]
+    ):
+        return _FILTER
+
+    with _LOCK:
+        path = current_app.config["EXISTENCE_FILTER_PATH"]
+        try:
+            if _FILTER is not None and _FILTER_PID == os.getpid():
+                if os.stat(path).st_ino != _FILTER.inode:
+                    # Rebuilt by another worker - switch over to the new file
+                    _FILTER.close()
+                    _FILTER = None
+            else:
+                _FILTER = None
+
+            if _FILTER is None:
+                _FILTER = _open_existing(path)
+                if _FILTER is None:
+                    init_existence_filter()
+                    _FILTER = _open_existing(path)
+                _FILTER_PID = os.getpid()
+
+            if _FILTER is not None:
+                _refresh(_FILTER)
+                _LAST_REFRESH = now
+        except (OSError, SQLAlchemyError) as e:
+            current_app.logger.error(f"Existence filter is unavailable: {e}")
+            _FILTER = None
+            _LAST_REFRESH = now
+            return None
+
+    return _FILTER
+
+
+def might_exist(entity_id):
+    """False if there is definitely no record with this entity_id. True means 'ask the DB'."""
+    existence_filter = get_existence_filter()
+    if existence_filter is None:
+        return True
+
+    if not existence_filter.might_contain(entity_id):
+        return False
+
+    if (cached := _NEGATIVE_CACHE.get(entity_id)) is not None:
+        expires, additions = cached
+        if expires > time.monotonic() and additions == existence_filter.additions:
+            return False
+        _NEGATIVE_CACHE.pop(entity_id, None)
+    return True
+
+
+def remember_missing(entity_id):
+    """Record that the DB had no record for an id that got past the filter"""
+    existence_filter = get_existence_filter()
+    if existence_filter is None:
+        return
+    if len(_NEGATIVE_CACHE) >= _NEGATIVE_CACHE_SIZE:
+        _NEGATIVE_CACHE.clear()
+    _NEGATIVE_CACHE[entity_id] = (
+        time.monotonic() + current_app.config["EXISTENCE_FILTER_NEGATIVE_TTL"],
+        existence_filter.additions,
+    )
+
+
+def add_to_existence_filter(entity_ids):
+    """Add newly created records' ids to the filter. Called in the middle of an ingest, so it
+    never reads the DB - if there is no filter file yet, the build will find the records.
+    """
+    if current_app.config.get("EXISTENCE_FILTER") is not True:
+        return
+    if (existence_filter := _open_filter()) is not None:
+        try:
+            existence_filter.add(entity_ids)
+        except (OSError, ValueError) as e:
+            current_app.logger.error(f"Could not add to the existence filter: {e}")
+        for entity_id in entity_ids:
+            _NEGATIVE_CACHE.pop(entity_id, None)
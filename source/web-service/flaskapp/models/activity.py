@@ -1,4 +1,6 @@
 from flaskapp.models import db
+from sqlalchemy import UniqueConstraint
+from sqlalchemy.orm import deferred
 
 
 class Activity(db.Model):
@@ -11,3 +13,81 @@ class Activity(db.Model):
     )
     record = db.relationship("Record", backref=db.backref("activities", lazy=True))
     event = db.Column(db.String, nullable=False)
+    # The record's entity type, lowercased, so that the activity stream of each type can be
+    # read from the (entity_type, id) index without a join
+    entity_type = db.Column(db.String, nullable=True)
+
+    __table_args__ = (db.Index("ix_activities_entity_type_id", "entity_type", "id"),)
+
+
+class ActivityStreamPage(db.Model):
+    """A rendered page of the activity stream, stored once every item that can be on it exists.
+
+    A page covers the activities with ids first_id to last_id, so its content only changes
+    if some of those activities are removed - in which case it is deleted, to be rendered
+    again the next time it is asked for."""
+
+    __tablename__ = "activity_stream_pages"
+    __table_args__ = (
+        UniqueConstraint(
+            "base_url", "first_id", "last_id", name="activity_stream_pages_range"
+        ),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    # The activity stream's own URL, as the page's links are made from it
+    base_url = db.Column(db.String, nullable=False)
+    first_id = db.Column(db.Integer, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False)
+    etag = db.Column(db.String, nullable=False)
+    datetime_created = db.Column(db.TIMESTAMP, nullable=False)
+    data = deferred(db.Column(db.Text, nullable=False))
+
+
+class ActivityCount(db.Model):
+    """A running count of activities: of all of them (scope 'all'), of those for records of an
+    entity type (scope 'type', keyed by the lowercased type) or of those for one record (scope
+    'record', keyed by its entity_id). Kept up to date as activities are added and removed.
+    """
+
+    __tablename__ = "activity_counts"
+    __table_args__ = (
+        UniqueConstraint("scope", "key", name="activity_counts_scope_key"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String, nullable=False)
+    key = db.Column(db.String, nullable=False)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class ActivityTimeSpan(db.Model):
+    """The creation times of a span of activity ids (first_id to last_id), recorded once there
+    are activities beyond it. last_datetime is the latest time in this span or any earlier
+    one, so it never decreases from one span to the next and can be searched by its index.
+    """
+
+    __tablename__ = "activity_time_index"
+    __table_args__ = (
+        db.Index("ix_activity_time_index_last", "last_datetime", "first_id"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    first_id = db.Column(db.Integer, nullable=False, unique=True)
+    last_id = db.Column(db.Integer, nullable=False)
+    first_datetime = db.Column(db.TIMESTAMP, nullable=False)
+    last_datetime = db.Column(db.TIMESTAMP, nullable=False)
+
+
+class ActivityTypeMark(db.Model):
+    """The id of the activity at a position in the activity stream of one entity type (the
+    first activity of a page of it), recorded once every activity up to it has committed.
+    """
+
+    __tablename__ = "activity_type_index"
+    __table_args__ = (
+        UniqueConstraint(
+            "entity_type", "position", name="activity_type_index_position"
+        ),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    entity_type = db.Column(db.String, nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    activity_id = db.Column(db.Integer, nullable=False)
@@ -0,0 +1,12 @@
+from flaskapp.models import db
+
+
+class EntityType(db.Model):
+    """An entity type that records have been ingested with, and how many records of that type
+    currently exist (not counting deleted ones). Rows are only ever added, never removed.
+    """
+
+    __tablename__ = "entity_types"
+    id = db.Column(db.Integer, primary_key=True)
+    entity_type = db.Column(db.String, nullable=False, unique=True)
+    num_records = db.Column(db.BigInteger, nullable=False, default=0)
@@ -27,6 +27,14 @@ class Record(db.Model):
 
 Index("ix_records_record_id_and_type", Record.entity_id, Record.entity_type)
 
+# For bulk revalidation (see flaskapp.routes.batch)
+Index("ix_records_entity_id_checksum", Record.entity_id, Record.checksum)
+
+# For prefix listings (see flaskapp.storage_utilities.listing)
+Index("ix_records_entity_id_c", Record.entity_id.collate("C")).ddl_if(
+    dialect="postgresql"
+)
+
 
 class Version(db.Model):
     __tablename__ = "versions"
@@ -43,6 +51,9 @@ class Version(db.Model):
     datetime_deleted = db.Column(db.TIMESTAMP)
     data = deferred(db.Column(db.JSON))
     checksum = deferred(db.Column(db.String, nullable=True))
+    # Is 'data' a JSON patch against the next newer version? (see
+    # flaskapp.storage_utilities.version_deltas)
+    is_delta = db.Column(db.Boolean, nullable=True, default=False)
     record_id = db.Column(db.Integer, ForeignKey("records.id"))
     record = db.relationship(
         "Record",
@@ -0,0 +1,29 @@
+from flaskapp.models import db
+from sqlalchemy import ForeignKey, UniqueConstraint
+from sqlalchemy.orm import deferred
+
+
+class Rendering(db.Model):
+    """A pre-rendered serialization (eg turtle, or the prefixed JSON-LD) of a record's current
+    data, optionally with gzip and brotli compressed copies of it.
+
+    Renderings are only valid for the record checksum they were made from - any with a
+    checksum that no longer matches the record are stale and are pruned."""
+
+    __tablename__ = "renderings"
+    __table_args__ = (
+        UniqueConstraint(
+            "record_id", "checksum", "format", name="renderings_record_checksum_format"
+        ),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    record_id = db.Column(
+        db.Integer, ForeignKey("records.id", ondelete="CASCADE"), nullable=False
+    )
+    checksum = db.Column(db.String, nullable=False)
+    format = db.Column(db.String, nullable=False)
+    datetime_created = db.Column(db.TIMESTAMP, nullable=False)
+    data = deferred(db.Column(db.Text))
+    # Compressed copies of 'data', if it was large enough to be worth compressing
+    data_gzip = deferred(db.Column(db.LargeBinary))
+    data_br = deferred(db.Column(db.LargeBinary))
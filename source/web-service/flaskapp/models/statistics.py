@@ -0,0 +1,12 @@
+from flaskapp.models import db
+
+
+class Statistics(db.Model):
+    """A named set of summary statistics (eg for the dashboard), as a JSON document, and when
+    they were computed."""
+
+    __tablename__ = "statistics"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False, unique=True)
+    datetime_computed = db.Column(db.TIMESTAMP, nullable=False)
+    data = db.Column(db.Text, nullable=False)
@@ -0,0 +1,26 @@
+from flaskapp.models import db
+from sqlalchemy import ForeignKey, UniqueConstraint
+
+
+class SubIdentifier(db.Model):
+    """An id (or @id) embedded in a record's data below its top level, that could be requested
+    by subaddressing, with the path to the node that it identifies.
+
+    'path' is the list of keys and list indices from the top of the record's data to the node.
+    """
+
+    __tablename__ = "sub_identifiers"
+    __table_args__ = (
+        UniqueConstraint(
+            "entity_id", "record_id", name="sub_identifiers_entity_id_record"
+        ),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    entity_id = db.Column(db.String, nullable=False, index=True)
+    record_id = db.Column(
+        db.Integer,
+        ForeignKey("records.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    path = db.Column(db.JSON, nullable=False)
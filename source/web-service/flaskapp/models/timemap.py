@@ -0,0 +1,26 @@
+from flaskapp.models import db
+from sqlalchemy import ForeignKey, UniqueConstraint
+from sqlalchemy.orm import deferred
+
+
+class TimeMapPage(db.Model):
+    """A rendered page of a record's TimeMap, in one format (link-format or JSON), stored under
+    the page's own URI and the state of the record it was rendered from. Deleted whenever the
+    record or its versions change."""
+
+    __tablename__ = "timemap_pages"
+    __table_args__ = (
+        UniqueConstraint(
+            "record_id", "uri", "format", "state", name="timemap_pages_uri_format_state"
+        ),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    record_id = db.Column(
+        db.Integer, ForeignKey("records.id", ondelete="CASCADE"), nullable=False
+    )
+    uri = db.Column(db.String, nullable=False)
+    format = db.Column(db.String, nullable=False)
+    # See flaskapp.storage_utilities.timemaps.record_state
+    state = db.Column(db.String, nullable=False)
+    datetime_created = db.Column(db.TIMESTAMP, nullable=False)
+    data = deferred(db.Column(db.Text, nullable=False))
@@ -0,0 +1,183 @@
+import os
+import signal
+import threading
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+
+"""
+CPU-bound offloading
+--------------------
+
+PyLD expansion and rdflib serialization are pure-CPU calls. Under the gevent worker class
+they block the event loop, so a single turtle request for a very large record stalls every
+other connection held by that worker.
+
+When OFFLOAD_RDF_PROCESSING is enabled, each gunicorn worker lazily creates its own small
+process pool, and `run_cpu_bound` submits the work to it. The calling greenlet (or thread)
+waits on the future, which is cooperative under gevent's monkey-patching. The number of
+tasks a worker may have waiting or running is bounded by OFFLOAD_QUEUE_SIZE - once that is
+reached, callers get an OffloadSaturatedError straight away (HTTP 503) rather than queueing
+up behind work that will not finish in time. Every PyLD expansion goes this way, including
+those of the records in a batch ingest (graph_expand), as well as the serialization of
+responses.
+
+Each task is given a CPU time budget (OFFLOAD_TIMEOUT seconds) which is enforced inside the
+child process with a profiling interval timer. That timer only counts CPU time, so a task
+that is blocked (eg on a remote context fetch by the document loader) is also stopped by a
+real-time timer after twice that long, the same wall-clock limit the parent waits for.
+A task's queue slot is only freed once it has really finished in the child - a caller that
+gave up waiting on it does not free the slot early, as the child process is still busy.
+
+The PyLD document loader is a closure and cannot be pickled, so child processes build their
+own from the same (picklable) settings. Any `rdf_docloader` keyword argument given to
+`run_cpu_bound` is swapped for the child's loader.
+"""
+
+
+class OffloadError(RuntimeError):
+    """General purpose class for offloading errors"""
+
+
+class OffloadSaturatedError(OffloadError):
+    """The per-worker offload queue is full"""
+
+
+class OffloadTimeoutError(OffloadError):
+    """The offloaded task ran past its time budget"""
+
+
+# Per-process state. The pid is recorded so that a pool created before gunicorn forks
+# its workers is never shared with (or inherited by) a worker.
+_EXECUTOR = None
+_EXECUTOR_PID = None
+_SLOTS = None
+_LOCK = threading.Lock()
+
+# Set in the child processes by _init_child
+_CHILD_DOCLOADER = None
+
+
+def _init_child(docloader_settings):
+    global _CHILD_DOCLOADER
+    # Imported here so that the parent does not need the loader machinery to set the pool up
+    from flaskapp.base_graph_utils import document_loader
+
+    # Let the parent handle shutdown signals (eg gunicorn's graceful restarts)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if docloader_settings is not None:
+        _CHILD_DOCLOADER = document_loader(**docloader_settings)
+
+
+def _cpu_limit_exceeded(signum, frame):
+    raise OffloadTimeoutError("Offloaded task exceeded its CPU time limit")
+
+
+def _wall_limit_exceeded(signum, frame):
+    raise OffloadTimeoutError("Offloaded task exceeded its wall-clock time limit")
+
+
+def _run_task(func, args, kwargs, cpu_timeout):
+    # Runs in the child process
+    if "rdf_docloader" in kwargs:
+        kwargs["rdf_docloader"] = _CHILD_DOCLOADER
+
+    if cpu_timeout:
+        signal.signal(signal.SIGPROF, _cpu_limit_exceeded)
+        signal.setitimer(signal.ITIMER_PROF, cpu_timeout)
+        # As long as the parent waits for it, for time spent blocked rather than computing
+        signal.signal(signal.SIGALRM, _wall_limit_exceeded)
+        signal.setitimer(signal.ITIMER_REAL, cpu_timeout * 2)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        if cpu_timeout:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def get_executor():
+    global _EXECUTOR, _EXECUTOR_PID, _SLOTS
+
+    if _EXECUTOR is not None and _EXECUTOR_PID == os.getpid():
+        return _EXECUTOR
+
+    with _LOCK:
+        if _EXECUTOR is None or _EXECUTOR_PID != os.getpid():
+            current_app.logger.info(
+                f"Starting offload process pool for worker {os.getpid()} - "
+                f"{current_app.config['OFFLOAD_WORKERS']} processes, "
+                f"queue size {current_app.config['OFFLOAD_QUEUE_SIZE']}"
+            )
+            # 'spawn' gives a clean interpreter - forking a process with a running gevent hub
+            # or live DB connections is asking for trouble.
+            _EXECUTOR = ProcessPoolExecutor(
+                max_workers=current_app.config["OFFLOAD_WORKERS"],
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_child,
+                initargs=(current_app.config.get("RDF_DOCLOADER_SETTINGS"),),
+            )
+            _SLOTS = threading.BoundedSemaphore(
+                current_app.config["OFFLOAD_QUEUE_SIZE"]
+            )
+            _EXECUTOR_PID = os.getpid()
+    return _EXECUTOR
+
+
+def shutdown_executor():
+    global _EXECUTOR, _EXECUTOR_PID, _SLOTS
+    with _LOCK:
+        if _EXECUTOR is not None and _EXECUTOR_PID == os.getpid():
+            _EXECUTOR.shutdown(wait=False, cancel_futures=True)
+        _EXECUTOR = _EXECUTOR_PID = _SLOTS = None
+
+
+def run_cpu_bound(func, *args, **kwargs):
+    """Run func(*args, **kwargs), in the offload pool if OFFLOAD_RDF_PROCESSING is enabled.
+
+    func and its arguments must be picklable when offloading is enabled, apart from the
+    `rdf_docloader` keyword argument which is replaced in the child process."""
+    if current_app.config.get("OFFLOAD_RDF_PROCESSING") is not True:
+        return func(*args, **kwargs)
+
+    executor = get_executor()
+    slots = _SLOTS
+    timeout = current_app.config["OFFLOAD_TIMEOUT"]
+
+    if not slots.acquire(blocking=False):
+        current_app.logger.warning(
+            f"Offload queue is full ({current_app.config['OFFLOAD_QUEUE_SIZE']} tasks) - rejecting {func.__name__}"
+        )
+        raise OffloadSaturatedError("Offload queue is full")
+
+    try:
+        if "rdf_docloader" in kwargs:
+            kwargs["rdf_docloader"] = None
+        try:
+            future = executor.submit(_run_task, func, args, kwargs, timeout)
+        except BaseException:
+            slots.release()
+            raise
+        # The slot is held until the child has finished with the task (or it is cancelled
+        # before starting), not just until this caller stops waiting for it
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            # Give the child a little longer than its CPU budget, as it may also have had
+            # to wait for a free process
+            return future.result(timeout=timeout * 2 if timeout else None)
+        except FutureTimeoutError:
+            future.cancel()
+            current_app.logger.error(
+                f"Offloaded {func.__name__} did not complete within {timeout * 2}s"
+            )
+            raise OffloadTimeoutError(f"{func.__name__} did not complete in time")
+    except BrokenProcessPool as e:
+        # A child died (OOM killer, segfault...). Drop the pool so the next call rebuilds it.
+        current_app.logger.error(f"Offload process pool broke: {e}")
+        shutdown_executor()
+        raise OffloadError("Offload process pool is unavailable") from e
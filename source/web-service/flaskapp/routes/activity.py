@@ -5,13 +5,23 @@ from sqlalchemy.orm import joinedload
 from sqlalchemy.sql.functions import coalesce, max
 from sqlalchemy import func
 
-# date parsing
-import dateparser
-
 from flaskapp.models import db
 from flaskapp.models.activity import Activity
 from flaskapp.models.record import Record
-from flaskapp.utilities import format_datetime
+from flaskapp.utilities import format_datetime, parse_datetime
+from flaskapp.background import submit
+from flaskapp.storage_utilities.activity_counts import (
+    ALL,
+    counts_enabled,
+    get_activity_count,
+)
+from flaskapp.storage_utilities.activity_times import first_activity_since
+from flaskapp.storage_utilities.activity_pages import (
+    get_stored_page,
+    page_closed,
+    store_page,
+    page_etag,
+)
 from flaskapp.errors import (
     construct_error_response,
     status_record_not_found,
@@ -37,10 +47,7 @@ def redirect_to_page_using_datetime(target_datetime=None):
         )
 
     try:
-        datetime_obj = dateparser.parse(
-            target_datetime,
-            settings={"RETURN_AS_TIMEZONE_AWARE": True},
-        )
+        datetime_obj = parse_datetime(target_datetime)
         if datetime_obj is None:
             # response - bad request, unparsable date
             return (
@@ -56,18 +63,13 @@ def redirect_to_page_using_datetime(target_datetime=None):
             400,
         )
 
-    # Try to find the closest Activity id to suggested date
-    # The datetime is not indexed at the moment but could be eventually. This
-    # initial query will be slow until then!
-    if closest_log := (
-        Activity.query.filter(Activity.datetime_created >= datetime_obj)
-        .order_by(Activity.id)
-        .first()
-    ):
+    # Find the first Activity at or after the suggested date, from the time index
+    if (closest_id := first_activity_since(datetime_obj)) is not None:
         limit = current_app.config["ITEMS_PER_PAGE"]
-        page = (closest_log.id // limit) + 1
+        # Each page holds a range of ids, whether or not there are gaps in them
+        page = (closest_id - 1) // limit + 1
         current_app.logger.debug(
-            f"Redirecting to page {page} for Activity.id {closest_log.id} due to "
+            f"Redirecting to page {page} for Activity.id {closest_id} due to "
             f"datetime {target_datetime} - parsed as {datetime_obj}"
         )
         return redirect(url_for("activity.activity_stream_page", pagenum=page))
@@ -97,7 +99,10 @@ def activity_stream_collection():
         Response: A JSON-encoded OrderedCollection
     """
 
-    count = db.session.query(func.count(Activity.id)).scalar()
+    if counts_enabled():
+        count = get_activity_count(ALL)
+    else:
+        count = db.session.query(func.count(Activity.id)).scalar()
     total_pages = str(compute_total_pages())
 
     data = {
@@ -147,6 +152,12 @@ def activity_stream_page(pagenum):
         response = construct_error_response(status_page_not_found)
         return abort(response)
 
+    # Every page but the last is full, and will not change once it is closed (a page is only
+    # stored once it is, so a stored page needs no further check)
+    full = current_app.config["ACTIVITY_PAGE_CACHE"] and pagenum < total_pages
+    if full and (stored := get_stored_page(generate_url(), pagenum, limit)):
+        return closed_page_response(stored.data, stored.etag)
+
     data = {
         "@context": "https://www.w3.org/ns/activitystreams",
         "type": "OrderedCollectionPage",
@@ -179,9 +190,33 @@ def activity_stream_page(pagenum):
     else:
         data["orderedItems"] = []
 
+    if full and page_closed(pagenum, limit, current_app.config["ACTIVITY_PAGE_GRACE"]):
+        text = current_app.json.dumps(data)
+        etag = page_etag(text)
+        submit(
+            store_page,
+            generate_url(),
+            pagenum,
+            limit,
+            text,
+            etag,
+            len(data["orderedItems"]),
+        )
+        return closed_page_response(text, etag)
+
     return current_app.make_response(data)
 
 
+def closed_page_response(text, etag):
+    response = current_app.response_class(text, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = (
+        f"public, max-age={current_app.config['ACTIVITY_PAGE_MAX_AGE']}, immutable"
+    )
+    # A 304 Not Modified, if the client already has this ETag
+    return response.make_conditional(request)
+
+
 @activity.route("/activity-stream/<string:uuid>")
 def activity_stream_item(uuid):
     """Generate an ActivityStreams Create Response
@@ -247,13 +282,24 @@ def generate_item(activity):
     Returns:
         Dict: The generated data structure
     """
+    return activity_item(
+        activity.uuid,
+        activity.event,
+        activity.datetime_created,
+        activity.record.entity_id,
+        activity.record.entity_type,
+    )
+
+
+def activity_item(uuid, event, datetime_created, entity_id, entity_type):
+    """generate_item, from the column values rather than an Activity and its Record"""
     return {
-        "id": generate_url(sub=[str(activity.uuid)]),
-        "type": activity.event,
-        "created": format_datetime(activity.datetime_created),
-        "endTime": format_datetime(activity.datetime_created),
+        "id": generate_url(sub=[str(uuid)]),
+        "type": event,
+        "created": format_datetime(datetime_created),
+        "endTime": format_datetime(datetime_created),
         "object": {
-            "id": generate_url(base=True, sub=[str(activity.record.entity_id)]),
-            "type": activity.record.entity_type,
+            "id": generate_url(base=True, sub=[str(entity_id)]),
+            "type": entity_type,
         },
     }
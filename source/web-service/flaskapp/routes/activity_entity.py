@@ -7,6 +7,13 @@ from flaskapp.models import db
 from flaskapp.models.activity import Activity
 from flaskapp.models.record import Record
 from flaskapp.utilities import format_datetime
+from flaskapp.storage_utilities.entity_types import is_known_entity_type
+from flaskapp.storage_utilities.activity_type_index import page_start
+from flaskapp.storage_utilities.activity_counts import (
+    TYPE,
+    counts_enabled,
+    get_activity_count,
+)
 from flaskapp.errors import (
     construct_error_response,
     status_record_not_found,
@@ -16,9 +23,6 @@ from flaskapp.errors import (
 # Create a new "activity" route blueprint
 activity_entity = Blueprint("activity_entity", __name__)
 
-# Make the list of entity types global to populate it only once
-lod_entity_types = []
-
 
 ### Activity Stream Entity Routes ###
 
@@ -26,10 +30,7 @@ lod_entity_types = []
 @activity_entity.route("/activity-stream/type/<string:entity_type>")
 def activity_stream_entity_collection(entity_type):
     entity_type = entity_type.lower()
-    global lod_entity_types
-    if len(lod_entity_types) == 0:
-        lod_entity_types = get_distinct_entity_types()
-    if entity_type not in lod_entity_types:
+    if not is_known_entity_type(entity_type):
         response = construct_error_response(status_record_not_found)
         return abort(response)
 
@@ -127,45 +128,42 @@ def url_page(page_num, entity_type):
     return url_activity(entity_type) + "/page/" + str(page_num)
 
 
-def get_distinct_entity_types():
-    val = Record.query.distinct(Record.entity_type).all()
-    result = []
-    for v in val:
-        if v.entity_type:
-            result.append(v.entity_type.lower())
-    return result
-
-
 def get_count(entity_type):
-    count = (
-        Activity.query.with_entities(Activity.id)
-        .join(Record)
-        .filter(func.lower(Record.entity_type) == entity_type)
-    ).count()
+    if counts_enabled():
+        return get_activity_count(TYPE, entity_type)
 
-    return count
+    return (
+        db.session.query(func.count(Activity.id))
+        .filter(Activity.entity_type == entity_type)
+        .scalar()
+    )
 
 
 def get_entity_activities(entity_type, offset, limit):
-    activities = (
-        (
-            Activity.query.with_entities(
-                Activity.uuid,
-                Activity.event,
-                Activity.datetime_created,
-                Record.entity_id,
-                Record.entity_type,
-            )
-            .join(Record)
-            .filter(func.lower(Record.entity_type) == entity_type)
+    """The activities at offset to offset + limit in the activity stream of the type.
+
+    The first activity id of the page is looked up in the activity type index (see
+    flaskapp.storage_utilities.activity_type_index), and the page read forward from it by
+    keyset. Only the activities on the page are joined to their records."""
+    first_id = page_start(entity_type, offset, limit)
+    if first_id is None:
+        return []
+
+    return (
+        db.session.query(
+            Activity.uuid,
+            Activity.event,
+            Activity.datetime_created,
+            Record.entity_id,
+            Record.entity_type,
         )
+        .join(Record, Record.id == Activity.record_id)
+        .filter(Activity.entity_type == entity_type, Activity.id >= first_id)
         .order_by(Activity.id)
         .limit(limit)
-        .offset(offset)
+        .all()
     )
 
-    return activities
-
 
 def generate_item(activity):
     return {
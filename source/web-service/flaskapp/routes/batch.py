@@ -0,0 +1,254 @@
+import gzip
+import io
+import json
+
+from flask import Blueprint, current_app, request, abort, stream_with_context
+from sqlalchemy import cast, Text
+
+from flaskapp.models import db
+from flaskapp.models.record import Record
+from flaskapp.storage_utilities.rendering import prefixed_record_data
+from flaskapp.routes.records import trueset
+from flaskapp.utilities import etag_checksum
+from flaskapp.errors import (
+    construct_error_response,
+    status_data_missing,
+    status_batch_too_large,
+    status_record_not_found,
+    status_unsupported_encoding,
+    status_wrong_syntax,
+)
+
+"""
+Batch record retrieval
+----------------------
+
+`POST /records/batch` with a JSON list of entity ids (or {"ids": [...]}, or one id per line)
+and `GET /records/batch?ids=a,b,c` return the current data of each record, in the order
+requested, fetching BATCH_QUERY_SIZE records per DB query.
+
+Each record is given exactly as a plain GET of it would give it as JSON-LD, with ids
+prefixed in the same way (or not, with `relativeid=true`). An id with no current record
+gets an error object in its place, as in the body of a 404 response, with an "id" added.
+
+The response is a JSON array, or NDJSON (one document per line) if the request asks for
+`application/x-ndjson` in its Accept header or with `format=ndjson`. Either way, it is
+streamed out as the records are fetched.
+
+`POST /records/revalidate` lets a mirror check many cached records at once. The body is
+NDJSON (optionally gzip compressed, with a 'Content-Encoding: gzip' header), each line being
+{"id": ..., "etag": ...} or [id, etag], and the NDJSON response lists only the ids whose
+records have changed, with their current etag ({"id": ..., "etag": ...}), or that have been
+deleted ({"id": ..., "deleted": true}). The body is read and answered in chunks of
+REVALIDATE_CHUNK_SIZE ids, each checked with one query of the (entity_id, checksum) index.
+"""
+
+# Create a new "batch" route blueprint
+batch = Blueprint("batch", __name__)
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+REVALIDATE_CHUNK_SIZE = 1000
+
+
+def requested_ids():
+    """The list of ids asked for, from the query string or the request body"""
+    if request.method == "GET":
+        return [
+            x.strip() for value in request.args.getlist("ids") for x in value.split(",")
+        ]
+
+    body = request.get_data(as_text=True)
+    try:
+        ids = json.loads(body)
+    except json.decoder.JSONDecodeError:
+        # One id per line
+        return [x.strip() for x in body.splitlines()]
+
+    if isinstance(ids, dict):
+        ids = ids.get("ids")
+    if isinstance(ids, list) and all(isinstance(x, str) for x in ids):
+        return ids
+    return []
+
+
+def not_found_marker(entity_id):
+    # As the body of construct_error_response, without logging each one as an error
+    return {
+        "id": entity_id,
+        "errors": [
+            {
+                "status": status_record_not_found.code,
+                "title": status_record_not_found.title,
+                "detail": status_record_not_found.detail,
+            }
+        ],
+    }
+
+
+def fetch_documents(ids, relative):
+    """Yield the JSON text for each id in turn"""
+    query_size = current_app.config["BATCH_QUERY_SIZE"]
+    for start in range(0, len(ids), query_size):
+        chunk = ids[start : start + query_size]
+        # Fetch the data as the JSON text held in the DB - it is only decoded if the ids
+        # need prefixing
+        found = {
+            entity_id: text
+            for entity_id, text in db.session.query(
+                Record.entity_id, cast(Record.data, Text)
+            ).filter(Record.entity_id.in_(set(chunk)))
+            if text is not None and text != "null"
+        }
+
+        for entity_id in chunk:
+            if (text := found.get(entity_id)) is None:
+                yield current_app.json.dumps(not_found_marker(entity_id))
+            elif relative:
+                yield text
+            else:
+                yield current_app.json.dumps(prefixed_record_data(json.loads(text)))
+
+
+@batch.route("/records/batch", methods=["GET", "POST"])
+def batch_records():
+    ids = [x for x in requested_ids() if x]
+    if not ids:
+        abort(construct_error_response(status_data_missing))
+    if len(ids) > current_app.config["BATCH_MAX_IDS"]:
+        abort(
+            construct_error_response(
+                status_batch_too_large,
+                detail=f"No more than {current_app.config['BATCH_MAX_IDS']} ids can be requested at once",
+            )
+        )
+
+    relative = (
+        request.values.get("relativeid", "").lower() in trueset
+        or current_app.config["PREFIX_RECORD_IDS"] == "NONE"
+    )
+    ndjson = (
+        request.args.get("format", "").lower() == "ndjson"
+        or request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+        == NDJSON_MIMETYPE
+    )
+    current_app.logger.info(
+        f"Batch request for {len(ids)} records ({'NDJSON' if ndjson else 'JSON'})"
+    )
+
+    def generate():
+        documents = fetch_documents(ids, relative)
+        if ndjson:
+            for document in documents:
+                yield document + "\n"
+            return
+
+        yield "["
+        for idx, document in enumerate(documents):
+            yield document if idx == 0 else "," + document
+        yield "]"
+
+    return current_app.response_class(
+        stream_with_context(generate()),
+        mimetype=NDJSON_MIMETYPE if ndjson else "application/json",
+    )
+
+
+def revalidation_pairs(lines):
+    """(line number, id, relative id, etag) from NDJSON lines of {"id": ..., "etag": ...} or
+    [id, etag]. Raises ValueError (with the line number) for a line that is neither."""
+    idPrefix = current_app.config["idPrefix"]
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.decoder.JSONDecodeError:
+            raise ValueError(line_number)
+
+        if isinstance(item, dict):
+            entity_id, etag = item.get("id"), item.get("etag", item.get("checksum"))
+        elif isinstance(item, list) and len(item) == 2:
+            entity_id, etag = item
+        else:
+            raise ValueError(line_number)
+        if not isinstance(entity_id, str) or not isinstance(etag, (str, type(None))):
+            raise ValueError(line_number)
+
+        # Accept the full URIs that mirrors may have stored, as well as relative ids
+        relative_id = entity_id.removeprefix(f"{idPrefix}/")
+        if etag is not None:
+            # As it was sent, maybe for a compressed copy (eg W/"<checksum>:gzip")
+            etag = etag_checksum(etag)
+        yield line_number, entity_id, relative_id, etag
+
+
+def body_lines():
+    """The lines of the request body, as they are read, decompressing it if need be"""
+    stream = request.stream
+    if request.content_encoding == "gzip":
+        stream = gzip.GzipFile(fileobj=stream)
+    elif request.content_encoding not in (None, "identity"):
+        abort(construct_error_response(status_unsupported_encoding))
+    return io.TextIOWrapper(stream, encoding="utf-8")
+
+
+@batch.route("/records/revalidate", methods=["POST"])
+def revalidate_records():
+    """Compare a mirror's (id, etag) pairs with the current records, and return only those
+    that have changed (with their new etag) or have been deleted"""
+    max_pairs = current_app.config["REVALIDATE_MAX_PAIRS"]
+    lines = body_lines()
+
+    def compare(chunk):
+        current = dict(
+            db.session.query(Record.entity_id, Record.checksum).filter(
+                Record.entity_id.in_({relative_id for _, relative_id, _ in chunk})
+            )
+        )
+        for entity_id, relative_id, etag in chunk:
+            checksum = current.get(relative_id)
+            if checksum is None:
+                # Deleted, or never existed
+                yield {"id": entity_id, "deleted": True}
+            elif checksum != etag:
+                yield {"id": entity_id, "etag": checksum}
+
+    def generate():
+        chunk = []
+        checked = 0
+        try:
+            for line_number, *pair in revalidation_pairs(lines):
+                checked += 1
+                if checked > max_pairs:
+                    raise OverflowError(line_number)
+                chunk.append(pair)
+                if len(chunk) >= REVALIDATE_CHUNK_SIZE:
+                    for item in compare(chunk):
+                        yield current_app.json.dumps(item) + "\n"
+                    chunk = []
+        except (ValueError, OverflowError, OSError, EOFError) as e:
+            # The response has already started, so the error can only be reported in it
+            status = (
+                status_batch_too_large
+                if isinstance(e, OverflowError)
+                else status_wrong_syntax
+            )
+            current_app.logger.error(f"Revalidation request failed: {status.title} {e}")
+            error = {
+                "status": status.code,
+                "title": status.title,
+                "detail": status.detail,
+            }
+            if e.args and isinstance(e.args[0], int):
+                error["source"] = {"line number": e.args[0]}
+            yield current_app.json.dumps({"errors": [error]}) + "\n"
+            return
+
+        for item in compare(chunk):
+            yield current_app.json.dumps(item) + "\n"
+        current_app.logger.info(f"Revalidated {checked} records")
+
+    return current_app.response_class(
+        stream_with_context(generate()), mimetype=NDJSON_MIMETYPE
+    )
@@ -0,0 +1,196 @@
+import json
+import time
+
+from flask import Blueprint, current_app, request, abort, stream_with_context
+from sqlalchemy import cast, func, Text
+
+from flaskapp.models import db
+from flaskapp.models.activity import Activity
+from flaskapp.models.record import Record
+from flaskapp.routes.activity import activity_item
+from flaskapp.activity_watch import get_activity_watcher
+from flaskapp.routes.records import trueset
+from flaskapp.storage_utilities.rendering import prefixed_record_data
+from flaskapp.errors import construct_error_response, status_bad_since
+
+"""
+Change feed
+-----------
+
+`GET /changes?since=<cursor>&limit=<n>` streams (as NDJSON) the activity stream entries after
+the cursor, oldest first, each with the current data of the record it refers to, so that a
+consumer does not have to fetch each record in turn. Each line is:
+
+    {"cursor": "...", "activity": {...activity stream item...}, "record": {...}}
+
+where "record" has its ids prefixed just as a GET of the record would (or not, with
+`relativeid=true`), or is null with "deleted": true if the record has since been deleted.
+To carry on from where a response ended (or was cut off), ask for `since=` the cursor of the
+last line that was processed. An empty response means that the consumer is up to date.
+
+The rows are read from the DB with a server-side cursor, CHANGES_FETCH_SIZE at a time.
+
+Rather than polling, a consumer can wait for changes in one of two ways:
+
+* `GET /changes?since=<cursor>&wait=<seconds>` is a long-poll: if there is nothing after
+  the cursor, the response is held back until there is, or for up to `wait` seconds
+  (capped at CHANGES_MAX_WAIT), and is then answered as above.
+* `GET /changes/stream` is a Server-Sent Events stream, sending each change as an event,
+  with the cursor as its id and the NDJSON line as its data, as soon as it is committed. It
+  starts after the cursor in the Last-Event-ID header (as sent by a reconnecting
+  EventSource), or `since=`, or else from now. The stream is ended after
+  CHANGES_STREAM_TIMEOUT seconds, for the client to reconnect, and a comment is sent every
+  CHANGES_HEARTBEAT seconds while it is quiet so that idle connections are not dropped.
+
+Neither holds a DB connection while waiting - see flaskapp.activity_watch. Each stream
+keeps a worker connection open though, so they are best served by the gevent worker class.
+"""
+
+# Create a new "changes" route blueprint
+changes = Blueprint("changes", __name__)
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+CHANGES_FETCH_SIZE = 500
+CHANGES_HEARTBEAT = 15
+# How long an EventSource should wait before reconnecting, in milliseconds
+CHANGES_RETRY = 1000
+
+
+def change_line(
+    activity_id, uuid, event, created, entity_id, entity_type, text, relative
+):
+    line = {
+        "cursor": str(activity_id),
+        "activity": activity_item(uuid, event, created, entity_id, entity_type),
+    }
+    if text is None or text == "null":
+        line["record"] = None
+        line["deleted"] = True
+        return current_app.json.dumps(line)
+
+    if relative:
+        # Splice the stored JSON text in, rather than decoding and re-encoding it
+        return f'{current_app.json.dumps(line)[:-1]}, "record": {text}}}'
+
+    line["record"] = prefixed_record_data(json.loads(text))
+    return current_app.json.dumps(line)
+
+
+def parse_cursor(value):
+    try:
+        cursor = int(value)
+        if cursor < 0:
+            raise ValueError
+    except (ValueError, TypeError):
+        abort(construct_error_response(status_bad_since))
+    return cursor
+
+
+def relative_ids():
+    return (
+        request.values.get("relativeid", "").lower() in trueset
+        or current_app.config["PREFIX_RECORD_IDS"] == "NONE"
+    )
+
+
+def change_rows(since, limit):
+    return (
+        db.session.query(
+            Activity.id,
+            Activity.uuid,
+            Activity.event,
+            Activity.datetime_created,
+            Record.entity_id,
+            Record.entity_type,
+            cast(Record.data, Text),
+        )
+        .join(Record, Record.id == Activity.record_id)
+        .filter(Activity.id > since)
+        .order_by(Activity.id)
+        .limit(limit)
+    )
+
+
+@changes.route("/changes")
+def change_feed():
+    since = parse_cursor(request.args.get("since", "0"))
+
+    max_limit = current_app.config["CHANGES_MAX_LIMIT"]
+    try:
+        limit = min(int(request.args.get("limit", max_limit)), max_limit)
+    except (ValueError, TypeError):
+        limit = max_limit
+
+    relative = relative_ids()
+
+    try:
+        wait = min(
+            float(request.args.get("wait", 0)), current_app.config["CHANGES_MAX_WAIT"]
+        )
+    except (ValueError, TypeError):
+        wait = 0
+    if wait > 0:
+        # Returns as soon as there is anything after the cursor, which is then fetched below
+        get_activity_watcher().wait_for(since, wait)
+
+    rows = change_rows(since, limit).yield_per(CHANGES_FETCH_SIZE)
+
+    def generate():
+        for row in rows:
+            yield change_line(*row, relative) + "\n"
+
+    return current_app.response_class(
+        stream_with_context(generate()), mimetype=NDJSON_MIMETYPE
+    )
+
+
+@changes.route("/changes/stream")
+def change_stream():
+    relative = relative_ids()
+    if (last_event_id := request.headers.get("Last-Event-ID")) is not None:
+        since = parse_cursor(last_event_id)
+    elif (since := request.args.get("since")) is not None:
+        since = parse_cursor(since)
+    else:
+        since = db.session.query(func.max(Activity.id)).scalar() or 0
+    # No connection is needed until there is something to send
+    db.session.close()
+
+    watcher = get_activity_watcher()
+    page_size = current_app.config["CHANGES_MAX_LIMIT"]
+    timeout = current_app.config["CHANGES_STREAM_TIMEOUT"]
+
+    def generate():
+        deadline = time.monotonic() + timeout
+        cursor = waiting_from = since
+        yield f"retry: {CHANGES_RETRY}\n\n"
+
+        fetch = True
+        while True:
+            if fetch:
+                seen = watcher.latest or 0
+                rows = change_rows(cursor, page_size).all()
+                db.session.close()
+                for row in rows:
+                    cursor = row[0]
+                    yield f"id: {cursor}\ndata: {change_line(*row, relative)}\n\n"
+                if len(rows) == page_size:
+                    continue
+                # Past any ids that are not there (rolled back, or their records purged),
+                # so as not to wake straight up for them again
+                waiting_from = max(cursor, seen)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            fetch = watcher.wait_for(waiting_from, min(CHANGES_HEARTBEAT, remaining))
+            if not fetch:
+                yield ": keep-alive\n\n"
+
+    response = current_app.response_class(
+        stream_with_context(generate()), mimetype="text/event-stream"
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop nginx and the like from buffering the events
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
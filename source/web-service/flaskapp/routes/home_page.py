@@ -12,18 +12,15 @@ from urllib import parse
 from datetime import datetime
 
 from flaskapp.routes.activity_entity import url_base
-from flaskapp.models.record import Record
-from flaskapp.models.activity import Activity
-from sqlalchemy import func, desc, exc
-from sqlalchemy.sql.functions import coalesce, max
+from sqlalchemy import exc
 from flaskapp.models import db
 from flaskapp.models.container import NoLDPContainerFoundError
+from flaskapp.storage_utilities.statistics import get_dashboard_stats
 from flaskapp.storage_utilities.container import (
-    get_page_for_container,
-    generate_paging_link_headers,
     get_full_container_page_representation,
 )
 from flaskapp.conneg import determine_requested_format_and_profile, reformat_rdf
+from flaskapp.offload import run_cpu_bound
 from flaskapp.utilities import wants_html
 from flaskapp.errors import construct_error_response, status_container_not_found
 
@@ -77,7 +74,8 @@ def root_container():
         if not shortformat:
             shortformat = "json-ld"
 
-        data = reformat_rdf(
+        data = run_cpu_bound(
+            reformat_rdf,
             data,
             shortformat=shortformat,
             use_pyld=current_app.config["USE_PYLD_REFORMAT"],
@@ -99,6 +97,14 @@ def root_container():
 
 @home_page.route("/dashboard", methods=["GET"])
 def get_home_page():
+    # The figures are stored, and refreshed in the background once they are out of date
+    try:
+        stats, stats_as_of = get_dashboard_stats()
+    except exc.SQLAlchemyError:
+        # this covers the case when DB exists but tables not yet created
+        db.session.rollback()
+        stats, stats_as_of = None, None
+
     if not wants_html(request):
         return (
             jsonify(
@@ -126,21 +132,19 @@ def get_home_page():
                     "chk_ldp_api": (
                         True if current_app.config.get("LDP_API") else False
                     ),
+                    "stats": stats,
+                    "stats_as_of": (stats_as_of.isoformat() if stats_as_of else None),
                 }
             ),
             200,
         )
-    # Else, provide the HTML version that requires of all the heavy DB queries
+    # Else, provide the HTML version
     context = {}
     base_url = url_base()
     items_per_page = (int)(current_app.config["ITEMS_PER_PAGE"])
 
-    # this also covers the case when DB exists but tables not yet created
     # 'total_num_records' is a string - can be 1.4K, 2.3M, etc.
-    try:
-        total_num_records = get_total_num_records()
-    except exc.SQLAlchemyError:
-        total_num_records = "0"
+    total_num_records = num_rec_to_str(stats["num_records"]) if stats else "0"
 
     # database is empty, create simplified context
     if total_num_records == "0":
@@ -158,16 +162,14 @@ def get_home_page():
             "chk_subaddressing": (
                 "checked" if current_app.config.get("SUBADDRESSING") else ""
             ),
+            "stats_as_of": format_short_date(stats_as_of, "%m/%d/%y %H:%M UTC"),
         }
         return render_template("home_page.html", **context)
 
     # entities
-    entities = []
-    entity_types = get_distinct_entity_types()
-
-    for entity_type in entity_types:
-        ent_obj = get_entity(entity_type, base_url, items_per_page)
-        entities.append(ent_obj)
+    entities = [
+        get_entity(entity, base_url, items_per_page) for entity in stats["entities"]
+    ]
 
     # link bank
     link_bank = None
@@ -178,57 +180,24 @@ def get_home_page():
     context = {
         "lod_name": current_app.config.get("AS_DESC"),
         "lod_version": get_version(),
-        "as_last_page": get_total_pages(items_per_page),
+        "as_last_page": stats["as_last_page"],
         "num_records": total_num_records,
-        "num_changes": get_total_num_changes(),
+        "num_changes": num_rec_to_str(stats["num_changes"]),
         "chk_sparql": "checked" if current_app.config.get("PROCESS_RDF") else "",
         "chk_memento": "checked" if current_app.config.get("KEEP_LAST_VERSION") else "",
         "chk_subaddressing": (
             "checked" if current_app.config.get("SUBADDRESSING") else ""
         ),
-        "last_change": get_last_modified_date(),
+        "last_change": format_short_date(stats["last_change"]) or "No activities",
         "entities": entities,
         "num_entities": len(entities),
         "link_bank": link_bank,
+        "stats_as_of": format_short_date(stats_as_of, "%m/%d/%y %H:%M UTC"),
     }
 
     return render_template("home_page.html", **context)
 
 
-# Data access functions ------------------------------------
-# Global --------------------
-def get_total_pages(items_per_page):
-    last = db.session.query(coalesce(max(Activity.id), 0).label("num")).one()
-
-    return ceil(last.num / items_per_page)
-
-
-def get_total_num_records():
-    num_rec = db.session.query(Record).filter(Record.datetime_deleted == None).count()
-
-    return num_rec_to_str(num_rec)
-
-
-def get_total_num_changes():
-    num_rec = db.session.query(Activity).count()
-
-    return num_rec_to_str(num_rec)
-
-
-def get_last_modified_date():
-    # much faster than taking directly max('datetime_created')
-    if last_id := Activity.id == db.session.query(func.max(Activity.id)).first():
-        if res := (
-            db.session.query(Activity.datetime_created)
-            .filter(Activity.id == last_id[0])
-            .first()
-        ):
-            return datetime.strftime(res[0], "%m/%d/%y")
-
-    # Empty Activity stream
-    return "No activities"
-
-
 def get_version():
     try:
         with open("version.txt") as f:
@@ -238,21 +207,19 @@ def get_version():
 
 
 # Entities ----------------------------
-def get_entity(entity_type, base_url, items_per_page):
-    num_changes = get_num_changes_entity(entity_type)
-    num_changes_str = num_rec_to_str(num_changes)
+def get_entity(entity, base_url, items_per_page):
+    """The template context for an entity type, from its stored statistics"""
     ent_obj = {}
-    ent_obj["entity_name"] = entity_type
-    ent_obj["num_records"] = num_rec_to_str(get_num_records_entity(entity_type))
-    ent_obj["num_changes"] = num_changes_str
-    ent_obj["last_updated"] = get_last_modified_date_entity(entity_type)
-    total_pages = ceil(num_changes / items_per_page)
-    ent_obj["as_last_page"] = str(total_pages)
-    rec_id, last_rec, last_date = get_most_recent_changed_record(entity_type)
+    ent_obj["entity_name"] = entity["entity_name"]
+    ent_obj["num_records"] = num_rec_to_str(entity["num_records"])
+    ent_obj["num_changes"] = num_rec_to_str(entity["num_changes"])
+    ent_obj["last_updated"] = format_short_date(entity["last_updated"])
+    ent_obj["as_last_page"] = str(ceil(entity["num_changes"] / items_per_page))
+    last_rec = entity["most_recent_rec"] or "None"
     ent_obj["most_recent_rec_url"] = f"{base_url}/{last_rec}"
     ent_obj["most_recent_rec"] = last_rec
-    ent_obj["most_recent_date"] = datetime.strftime(last_date, "%m/%d/%y")
-    ent_obj["most_recent_num_changes"] = get_num_changes_record_entity(rec_id)
+    ent_obj["most_recent_date"] = format_short_date(entity["most_recent_date"]) or "N/A"
+    ent_obj["most_recent_num_changes"] = entity["most_recent_num_changes"]
     ent_obj["most_recent_as"] = ent_obj["most_recent_rec"] + "/activity-stream"
     ent_obj["num_pages_most_recent_as"] = ceil(
         ent_obj["most_recent_num_changes"] / items_per_page
@@ -262,88 +229,6 @@ def get_entity(entity_type, base_url, items_per_page):
     return ent_obj
 
 
-def get_distinct_entity_types():
-    # this is much faster than 'distinct'
-    result = []
-    ent_types = (
-        db.session.query(Record.entity_type, func.count(Record.entity_type))
-        .filter(Record.datetime_deleted == None)
-        .group_by(Record.entity_type)
-        .order_by(desc(func.count(Record.entity_type)))
-        .all()
-    )
-    for ent in ent_types:
-        if ent and ent[1] > 0:
-            result.append(ent[0])
-
-    return result
-
-
-def get_num_records_entity(entity_type):
-    num_rec = (
-        db.session.query(Record)
-        .filter(Record.entity_type == entity_type)
-        .filter(Record.datetime_deleted == None)
-        .count()
-    )
-
-    return num_rec
-
-
-def get_num_changes_entity(entity_type):
-    num_rec = (
-        Activity.query.with_entities(Activity.id)
-        .join(Record)
-        .filter(Record.entity_type == entity_type)
-    ).count()
-
-    return num_rec
-
-
-def get_last_modified_date_entity(entity_type):
-    res = (
-        db.session.query(func.max(Activity.datetime_created))
-        .join(Record)
-        .filter(Record.entity_type == entity_type)
-        .first()
-    )[0]
-    if res is not None:
-        return datetime.strftime(res, "%m/%d/%y")
-
-
-def get_most_recent_changed_record(entity_type):
-    res = (
-        db.session.query(
-            Record.id,
-            Record.entity_id,
-            Record.datetime_updated,
-        )
-        .filter(Record.entity_type == entity_type)
-        .filter(Record.datetime_deleted == None)
-        .order_by(Record.datetime_updated.desc())
-        .first()
-    )
-    if res is not None:
-        rec_id = res[0]
-        entity_id = res[1]
-        last_dt = res[2]
-
-        return (rec_id, entity_id, last_dt)
-    else:
-        return ("None", "None", "N/A")
-
-
-def get_num_changes_record_entity(rec_id):
-    num_changes = (
-        db.session.query(Activity.datetime_created)
-        .join(Record)
-        .filter(Record.id == rec_id)
-        .count()
-    )
-
-    return num_changes
-
-
 def get_most_recent_sparql(base_url, entity_id):
     url = base_url + "/sparql-ui#"
     graph = parse.quote(base_url + "/" + entity_id)
@@ -366,6 +251,15 @@ def get_most_recent_sparql(base_url, entity_id):
 
 
 # Helpers ----------------------------
+def format_short_date(value, fmt="%m/%d/%y"):
+    """Format a datetime, or an ISO 8601 string of one, for the dashboard"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return datetime.strftime(value, fmt)
+
+
 def num_rec_to_str(num_rec):
     num_rec_str = str(num_rec)
     if num_rec > 1_000:
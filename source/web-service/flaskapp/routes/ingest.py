@@ -32,6 +32,7 @@ from flaskapp.storage_utilities.graph import (
     RetryAfterError,
 )
 from flaskapp.storage_utilities.container import assert_containers
+from flaskapp.storage_utilities.rendering import schedule_prerender
 
 from flaskapp.errors import (
     status_nt,
@@ -124,6 +125,8 @@ def process_record_set(record_list, query_endpoint=None, update_endpoint=None):
     result_dict = {}
     idx_to_process_further = []
     ids_to_refresh = []
+    # primary keys of the records that have changed, for pre-rendering
+    records_changed = []
 
     current_app.logger.debug(f"Processing {len(record_list)} records for updates")
     with db.session.no_autoflush:
@@ -166,6 +169,7 @@ def process_record_set(record_list, query_endpoint=None, update_endpoint=None):
 
                     # add the list index to the list of updates to process through the graph store
                     idx_to_process_further.append(idx)
+                    records_changed.append(prim_key)
 
                 elif crud_event == Event.Refresh:
                     # add the list index to the list of updates to process through the graph store
@@ -248,6 +252,9 @@ def process_record_set(record_list, query_endpoint=None, update_endpoint=None):
 
         # Everything went fine - commit the transaction
         db.session.commit()
+
+        if current_app.config["PRERENDER_FORMATS"] and records_changed:
+            schedule_prerender(records_changed)
         return result_dict
 
 
@@ -433,8 +440,6 @@ def process_graphstore_record_set(
 
         idmap = {}
 
-        proc = None  # jsonld.JsonLdProcessor()
-
         # expand all graphs, and collect list of graph_uris for deletion
         for record in record_list:
             data = json.loads(record)
@@ -458,7 +463,7 @@ def process_graphstore_record_set(
                 records_to_delete.append(graph_uri)
             else:
                 # Graph is to be updated/created in the triplestore index. Expand to RDF ntriples:
-                serialized_nt_cache[graph_uri] = graph_expand(data, proc)
+                serialized_nt_cache[graph_uri] = graph_expand(data)
 
                 # invalid JSON-LD?
                 if (
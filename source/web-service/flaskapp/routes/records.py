@@ -2,8 +2,6 @@ import click
 import math
 import json
 
-# RFC1128 dates, yuck
-import dateparser
 import pytz
 import time
 
@@ -11,7 +9,7 @@ from email.utils import formatdate
 
 from flask import Blueprint, current_app, abort, request, jsonify, url_for, redirect
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-from sqlalchemy.orm import load_only, defer
+from sqlalchemy.orm import defer
 from sqlalchemy import func, exc
 
 from urllib.parse import urljoin
@@ -23,13 +21,14 @@ from flaskapp.models.container import NoLDPContainerFoundError
 from flaskapp.utilities import (
     Event,
     format_datetime,
-    containerRecursiveCallback,
-    idPrefixer,
-    triples_to_quads,
+    parse_datetime,
+    compile_id_prefixer,
+    etag_checksum,
     segment_entity_id,
 )
 from flaskapp.storage_utilities.record import (
     get_record,
+    get_stored_json_text,
     record_delete,
     record_create,
     process_activity,
@@ -45,12 +44,74 @@ from flaskapp.storage_utilities.container import (
     get_full_container_page_representation,
 )
 from flaskapp.storage_utilities.representation import parse_representation
+from flaskapp.storage_utilities.activity_counts import (
+    RECORD,
+    counts_enabled,
+    get_activity_count,
+    recount_activities,
+)
+from flaskapp.storage_utilities.entity_types import recount_entity_types
+from flaskapp.storage_utilities.statistics import refresh_dashboard_stats
+from flaskapp.storage_utilities.activity_times import rebuild_time_index
+from flaskapp.storage_utilities.activity_type_index import (
+    invalidate_type_index,
+    rebuild_type_index,
+)
+from flaskapp.storage_utilities.timemaps import clear_timemaps, invalidate_timemaps
+from flaskapp.storage_utilities.version_deltas import (
+    convert_versions,
+    unlink_version,
+    version_data,
+    version_text,
+)
+from flaskapp.storage_utilities.compaction import compact_activities, retention_rules
+from flaskapp.storage_utilities.previous_versions import (
+    backfill_previous_versions,
+    refresh_previous_versions,
+)
+from flaskapp.storage_utilities.version_retention import (
+    parse_thinning,
+    policy_set,
+    prune_versions,
+    retention_policy,
+)
+from flaskapp.storage_utilities.activity_pages import (
+    invalidate_activity_pages,
+    clear_activity_pages,
+)
+from flaskapp.storage_utilities.listing import (
+    prefix_listing_query,
+    prefix_listing_after,
+    cached_prefix_total,
+    encode_after_token,
+    decode_after_token,
+)
+from flaskapp.storage_utilities.subaddressing import (
+    lookup_sub_identifier,
+    rebuild_sub_identifiers,
+)
+from flaskapp.storage_utilities.rendering import (
+    find_rendering,
+    prerenders,
+    schedule_store_rendering,
+    prune_renderings,
+    prerender_records,
+)
+from flaskapp.offload import run_cpu_bound
+from flaskapp.singleflight import coalesce_requests
+from flaskapp.existence import (
+    init_existence_filter,
+    reset_existence_filter,
+    might_exist,
+    remember_missing,
+)
 from flaskapp.errors import (
     status_nt,
     construct_error_response,
     status_record_not_found,
     status_container_not_found,
     status_page_not_found,
+    status_bad_page_token,
     status_db_save_error,
     status_graphstore_error,
     status_ok,
@@ -59,11 +120,11 @@ from flaskapp.errors import (
     status_not_implemented,
     ResourceValidationError,
 )
-from flaskapp.utilities import checksum_json, authenticate_bearer, squish_dict
+from flaskapp.utilities import checksum_json, authenticate_bearer, prefix_record_ids
 from flaskapp.base_graph_utils import get_url_prefixes_from_context
 
 # RDF format translations
-from flaskapp.graph_prefix_bindings import get_bound_graph, FORMATS
+from flaskapp.graph_prefix_bindings import FORMATS
 from flaskapp.conneg import (
     desired_rdf_format,
     determine_requested_format_and_profile,
@@ -73,8 +134,6 @@ from flaskapp.conneg import (
 
 from gettysparqlpatterns import RequiredParametersMissingError
 
-from pyld import jsonld
-
 # Create a new "records" route blueprint
 records = Blueprint("records", __name__)
 
@@ -112,37 +171,220 @@ def create_checksums(extent):
         db.session.rollback()
 
 
-def _quick_count(query):
-    count_q = query.statement.with_only_columns(*[func.count()]).order_by(None)
-    count = query.session.execute(count_q).scalar()
-    return count
+@records.cli.command("renderings")
+@click.argument("action")
+def manage_renderings(action):
+    # Flask CLI command to maintain the pre-rendered serializations (PRERENDER_FORMATS)
+    # `flask records renderings prune` - remove renderings for checksums that are no longer current
+    # `flask records renderings all` - render any records that are missing a rendering
+    action = action.lower()
+    if action not in ["prune", "all"]:
+        print("Option must be 'prune' or 'all'.")
+        return
+
+    if action == "prune":
+        removed = prune_renderings()
+        print(f"Removed {removed} stale renderings")
+        return
+
+    if not current_app.config["PRERENDER_FORMATS"]:
+        print("PRERENDER_FORMATS is not set - nothing to render.")
+        return
+
+    print("Rendering records - may take some time")
+    completed = 0
+    last_id = 0
+    while True:
+        batch = [
+            x
+            for (x,) in db.session.query(Record.id)
+            .filter(Record.id > last_id, Record.checksum != None)
+            .order_by(Record.id)
+            .limit(100)
+        ]
+        if not batch:
+            break
+        prerender_records(batch)
+        # Keep the session from growing over a long run
+        db.session.expunge_all()
+        last_id = batch[-1]
+        completed += len(batch)
+        print(f"Record count: {completed} complete")
+
+
+@records.cli.command("existence-filter")
+def rebuild_existence_filter():
+    # Flask CLI command to rebuild the existence filter file from the records table
+    # `flask records existence-filter` - eg after restoring the database from a backup
+    if current_app.config["EXISTENCE_FILTER"] is not True:
+        print("EXISTENCE_FILTER is not enabled.")
+        return
+    init_existence_filter(rebuild=True)
+    reset_existence_filter()
+    print(f"Rebuilt {current_app.config['EXISTENCE_FILTER_PATH']}")
+
+
+@records.cli.command("subaddressing-index")
+def rebuild_subaddressing_index():
+    # Flask CLI command to (re)build the subaddressing index for every record
+    # `flask records subaddressing-index` - needed once after SUBADDRESSING_INDEX is first enabled
+    print("Indexing records - may take some time")
+    for completed in rebuild_sub_identifiers():
+        print(f"Record count: {completed} complete")
+
+
+@records.cli.command("activity-pages")
+def clear_stored_activity_pages():
+    # Flask CLI command to remove every stored activity stream page (ACTIVITY_PAGE_CACHE)
+    # `flask records activity-pages` - eg after activities have been removed directly in the DB
+    clear_activity_pages()
+    print("Removed the stored activity stream pages")
+
+
+@records.cli.command("activity-counts")
+def recount_activity_counts():
+    # Flask CLI command to recount the activity stream totals (ACTIVITY_COUNTS)
+    # `flask records activity-counts` - needed once after ACTIVITY_COUNTS is first enabled
+    print("Counting activities - may take some time")
+    recount_activities()
+    print("Activity counts are up to date")
+
+
+@records.cli.command("entity-types")
+def recount_entity_type_registry():
+    # Flask CLI command to rebuild the entity type registry from the records table
+    # `flask records entity-types` - eg after records have been changed directly in the DB
+    recount_entity_types()
+    print("Entity type registry is up to date")
+
+
+@records.cli.command("statistics")
+def refresh_statistics():
+    # Flask CLI command to recompute the stored dashboard statistics
+    # `flask records statistics` - eg from a cron job, more often than DASHBOARD_STATS_TTL
+    _, computed = refresh_dashboard_stats()
+    print(f"Dashboard statistics computed at {computed.isoformat()}")
+
+
+@records.cli.command("activity-time-index")
+def rebuild_activity_time_index():
+    # Flask CLI command to build the activity time index used by skip-to-datetime
+    # `flask records activity-time-index` - after the `activity_time_index` migration
+    print("Indexing activity times - may take some time")
+    spans = rebuild_time_index()
+    print(f"Indexed {spans} spans of activities")
+
+
+@records.cli.command("activity-type-index")
+def rebuild_activity_type_index():
+    # Flask CLI command to build the index of where each page of the per-type activity streams
+    # starts - `flask records activity-type-index`, after the `activity_type_index` migration
+    print("Indexing the activity streams of each entity type - may take some time")
+    marks = rebuild_type_index()
+    print(f"Indexed {marks} pages of activities")
+
+
+@records.cli.command("timemaps")
+def clear_stored_timemaps():
+    # Flask CLI command to remove every stored TimeMap page (TIMEMAP_CACHE)
+    # `flask records timemaps` - eg after versions have been changed directly in the DB
+    clear_timemaps()
+    print("Removed the stored TimeMap pages")
+
+
+@records.cli.command("version-deltas")
+@click.option("--full", is_flag=True, help="Store every version in full again")
+def convert_version_storage(full):
+    # Flask CLI command to store the existing versions as patches (VERSION_DELTAS), keeping
+    # every VERSION_SNAPSHOT_INTERVAL-th version of each record in full
+    # `flask records version-deltas` - after the `version_deltas` migration
+    # `flask records version-deltas --full` - before turning VERSION_DELTAS off for good
+    print("Converting versions - may take some time")
+    for completed in convert_versions(100, deltas=not full):
+        print(f"Record count: {completed} complete")
+
+
+@records.cli.command("compact-activities")
+@click.option("--keep", type=int, help="Keep the latest N events of each record")
+@click.option(
+    "--collapse-updates/--no-collapse-updates",
+    default=None,
+    help="Keep only the last of consecutive Update events",
+)
+@click.option(
+    "--deleted-days",
+    type=int,
+    help="Remove the activities of records deleted more than N days ago",
+)
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint of an earlier run")
+def compact_activity_stream(keep, collapse_updates, deleted_days, restart):
+    # Flask CLI command to apply the activity retention rules to the whole activity stream
+    # `flask records compact-activities` - with the rules from ACTIVITY_RETENTION_KEEP,
+    # ACTIVITY_COLLAPSE_UPDATES and ACTIVITY_RETENTION_DELETED_DAYS, or as given. An
+    # interrupted run carries on from its last checkpoint.
+    rules = retention_rules(keep, collapse_updates, deleted_days)
+    if not (
+        rules["keep"] > 0 or rules["collapse_updates"] or rules["deleted_days"] > 0
+    ):
+        print("No retention rules are set - nothing to remove.")
+        return
+
+    print(f"Compacting the activity stream with {rules} - may take some time")
+    for progress in compact_activities(
+        rules, current_app.config["COMPACTION_BATCH_SIZE"], restart=restart
+    ):
+        print(
+            f"Record count: {progress['records']} complete, "
+            f"{progress['removed']} activities removed"
+        )
+
+
+@records.cli.command("previous-versions")
+def fill_previous_versions():
+    # Flask CLI command to set each record's pointer to its latest version, used for the
+    # rel="previous" Link header (LINK_HEADER_PREV_VERSION)
+    # `flask records previous-versions` - once, for the records stored before it was kept
+    print("Setting the previous version of each record - may take some time")
+    for completed in backfill_previous_versions(500):
+        print(f"Record count: {completed} complete")
+
+
+@records.cli.command("prune-versions")
+@click.option(
+    "--max-versions", type=int, help="Keep the latest N versions of each record"
+)
+@click.option(
+    "--max-age", type=int, help="Remove the versions made more than N days ago"
+)
+@click.option("--thinning", help='A thinning schedule, eg "7:daily,90:monthly"')
+def prune_old_versions(max_versions, max_age, thinning):
+    # Flask CLI command to apply the version retention rules to every record
+    # `flask records prune-versions` - with the rules from VERSION_RETENTION_MAX,
+    # VERSION_RETENTION_MAX_AGE and VERSION_THINNING, or as given. Eg from a cron job.
+    if thinning is not None:
+        try:
+            thinning = parse_thinning(thinning)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--thinning")
+    policy = retention_policy(max_versions, max_age, thinning)
+    if not policy_set(policy):
+        print("No retention rules are set - nothing to remove.")
+        return
+
+    print(f"Pruning versions with {policy} - may take some time")
+    for progress in prune_versions(
+        policy, current_app.config["VERSION_PRUNE_BATCH_SIZE"]
+    ):
+        print(
+            f"Record count: {progress['records']} complete, "
+            f"{progress['removed']} versions removed"
+        )
 
 
 # Parse the request for the prefix listing and pass back the JSON-encodable listing for the given page
 def handle_prefix_listing(entity_id, request, idPrefix):
     # Instead of responding with a single record, find and list the responses that match the 'glob' in the request
-    # load_only - we only care about three columns.
-    records = (
-        Record.query.options(
-            load_only(
-                Record.id,
-                Record.entity_id,
-                Record.entity_type,
-                Record.datetime_updated,
-                Record.datetime_deleted,
-            )
-        )
-        .filter(Record.datetime_deleted == None)
-        .filter(Record.entity_id.like(entity_id[:-1] + "%"))
-        .order_by(Record.id)
-    )
-    # Pagination - GET URL parameter 'page'
-    page = 1
-    if "page" in request.args:
-        try:
-            page = int(request.args["page"])
-        except (ValueError, TypeError):
-            current_app.logger.error("Bad value supplied for 'page' parameter.")
+    prefix = entity_id[:-1]
 
     # BROWSE_PAGE_SIZE - optional app config value
     page_size = 200
@@ -153,36 +395,73 @@ def handle_prefix_listing(entity_id, request, idPrefix):
             "Bad value supplied for BROWSE_PAGE_SIZE environment var."
         )
 
-    # Use SQLAlchemy's inbuilt pagination routine
-    page_request = records.paginate(page=page, per_page=page_size)
+    # The total may be a little out of date - see flaskapp.storage_utilities.listing
+    total = cached_prefix_total(prefix)
 
-    # Do a quick count based on the query. Might not be that much quicker than .count() with the load_only
-    # option above, but this way is the quickest method for doing a count.
-    total = _quick_count(records)
-
-    # Return the URL, the entity type and the datetime_updated
-    # (Maybe sort by the date?)
-    items = [
-        {
-            "id": f"{idPrefix}/{item.entity_id}",
-            "type": item.entity_type,
-            "datetime_updated": item.datetime_updated,
+    def listing(items):
+        # Return the URL, the entity type and the datetime_updated
+        return {
+            "items": [
+                {
+                    "id": f"{idPrefix}/{item.entity_id}",
+                    "type": item.entity_type,
+                    "datetime_updated": item.datetime_updated,
+                }
+                for item in items
+            ],
+            "total": total,
         }
-        for item in page_request.items
-    ]
 
-    r_json = {
-        "items": items,
-        "total": total,
-        "first": f"{idPrefix}/{entity_id}?page=1",
-    }
+    if "page" in request.args:
+        # Numbered pages, in record id order, as given out by earlier versions
+        page = 1
+        try:
+            page = int(request.args["page"])
+        except (ValueError, TypeError):
+            current_app.logger.error("Bad value supplied for 'page' parameter.")
+        if page < 1:
+            abort(construct_error_response(status_page_not_found))
+
+        items = (
+            prefix_listing_query(prefix)
+            .order_by(Record.id)
+            .offset((page - 1) * page_size)
+            .limit(page_size + 1)
+            .all()
+        )
+        if page > 1 and not items:
+            abort(construct_error_response(status_page_not_found))
 
-    # Pagination will be in the usual "first", "prev", "next" pattern
-    if page_request.has_next is True:
-        r_json["next"] = f"{idPrefix}/{entity_id}?page={page+1}"
-        r_json["last"] = f"{idPrefix}/{entity_id}?page={math.ceil(total/page_size)}"
-    if page > 1:
-        r_json["prev"] = f"{idPrefix}/{entity_id}?page={page-1}"
+        r_json = listing(items[:page_size])
+        r_json["first"] = f"{idPrefix}/{entity_id}?page=1"
+
+        # Pagination will be in the usual "first", "prev", "next" pattern
+        if len(items) > page_size:
+            r_json["next"] = f"{idPrefix}/{entity_id}?page={page+1}"
+            r_json["last"] = (
+                f"{idPrefix}/{entity_id}?page={max(page + 1, math.ceil(total/page_size))}"
+            )
+        if page > 1:
+            r_json["prev"] = f"{idPrefix}/{entity_id}?page={page-1}"
+
+        return r_json
+
+    # Keyset pages, in entity_id order, each following on from the last id of the one before
+    after = None
+    if token := request.args.get("after"):
+        try:
+            after = decode_after_token(token)
+        except ValueError:
+            abort(construct_error_response(status_bad_page_token))
+
+    items = prefix_listing_after(prefix, after, page_size + 1)
+
+    r_json = listing(items[:page_size])
+    r_json["first"] = f"{idPrefix}/{entity_id}"
+    if len(items) > page_size:
+        r_json["next"] = (
+            f"{idPrefix}/{entity_id}?after={encode_after_token(items[page_size - 1].entity_id)}"
+        )
 
     return r_json
 
@@ -251,10 +530,20 @@ def subaddressing_search(entity_id):
             # Can't possibly find a subaddressed item
             return (None, None)
 
+    # Possible parent records, nearest first
+    candidates = [
+        "/".join(parts[:x]) for x in reversed(range(sub_min_parts - 1, sub_max_parts))
+    ]
+
+    if current_app.config["SUBADDRESSING_INDEX"] is True:
+        return lookup_sub_identifier(entity_id, candidates)
+
     record = None
-    for x in reversed(range(sub_min_parts - 1, sub_max_parts)):
+    for candidate in candidates:
+        if not might_exist(candidate):
+            continue
         record = (
-            Record.query.filter(Record.entity_id == "/".join(parts[:x]))
+            Record.query.filter(Record.entity_id == candidate)
             .filter(Record.data != None)
             .one_or_none()
         )
@@ -308,7 +597,8 @@ def container_record(container_id, page=None):
         if not shortformat:
             shortformat = "json-ld"
 
-        data = reformat_rdf(
+        data = run_cpu_bound(
+            reformat_rdf,
             data,
             shortformat=shortformat,
             use_pyld=current_app.config["USE_PYLD_REFORMAT"],
@@ -585,6 +875,7 @@ def container_post_item(entity_id):
 
 
 @records.route("/<path:entity_id>", methods=["GET", "HEAD", "OPTIONS"])
+@coalesce_requests
 def entity_record(entity_id):
     """GET the record that exactly matches the entity_id, or if the entity_id ends with a '*', treat it as a wildcard
     search for items in the LOD Gateway"""
@@ -616,13 +907,17 @@ def entity_record(entity_id):
         ########################
 
         current_app.logger.info(f"Looking up resource {entity_id}")
-        record = (
-            db.session.query(Record)
-            .filter(Record.entity_id == entity_id)
-            .options(defer(Record.data))
-            .limit(1)
-            .first()
-        )
+        record = None
+        if might_exist(entity_id):
+            record = (
+                db.session.query(Record)
+                .filter(Record.entity_id == entity_id)
+                .options(defer(Record.data))
+                .limit(1)
+                .first()
+            )
+            if record is None:
+                remember_missing(entity_id)
 
         current_app.logger.debug(
             f"{entity_id} - Record lookup complete at timecode {time.perf_counter() - profile_time}"
@@ -643,7 +938,7 @@ def entity_record(entity_id):
                 subaddressed = url_for(
                     "records.entity_record", entity_id=record.entity_id
                 )
-                current_app.logger.debug(f"{record.data['@context']}")
+                current_app.logger.debug(f"{record.data.get('@context')}")
                 if (
                     current_app.config["PROCESS_RDF"] is True
                     and "@context" in record.data
@@ -671,29 +966,19 @@ def entity_record(entity_id):
         # The Content Profile Link headers should be added if this is a L2, it is confirmed that there is data, and what object it is.
 
         if current_app.config["LINK_HEADER_PREV_VERSION"] and record is not None:
-            prev = (
-                db.session.query(Version)
-                .options(
-                    load_only(
-                        Version.record_id, Version.entity_id, Version.datetime_updated
-                    )
-                )
-                .filter(Version.record_id == record.id)
-                .order_by(Version.datetime_updated.desc())
-                .limit(1)
-                .first()
-            )
-            if prev is not None:
+            # Kept up to date on the record itself (see
+            # flaskapp.storage_utilities.previous_versions)
+            if record.previous_version is not None:
                 link_headers = (
                     link_headers
-                    + f', <{hostPrefix}{ url_for("records.entity_version", entity_id=prev.entity_id) }>; rel="previous"'
+                    + f', <{hostPrefix}{ url_for("records.entity_version", entity_id=record.previous_version) }>; rel="previous"'
                 )
 
             current_app.logger.debug(
-                f"{entity_id} - Version query run and Link headers generated at timecode {time.perf_counter() - profile_time}"
+                f"{entity_id} - Version Link headers generated at timecode {time.perf_counter() - profile_time}"
             )
         else:
-            current_app.logger.debug(f"{entity_id} - Version query run disabled.")
+            current_app.logger.debug(f"{entity_id} - Version Link headers disabled.")
 
         # Is the client trying to negotiate for an earlier version through Accept-Datetime
         if (
@@ -705,10 +990,7 @@ def entity_record(entity_id):
                 f"{entity_id} - request for earlier version. Query begun at {time.perf_counter() - profile_time}"
             )
             # parse date and try to find a matching version, 302 redirect
-            desired_datetime = dateparser.parse(
-                request.headers["accept-datetime"],
-                settings={"RETURN_AS_TIMEZONE_AWARE": True},
-            )
+            desired_datetime = parse_datetime(request.headers["accept-datetime"])
 
             # force tzaware
             tzaware_updated = record.datetime_updated.replace(tzinfo=pytz.UTC)
@@ -751,18 +1033,33 @@ def entity_record(entity_id):
 
                 return response
 
+        # Is the stored JSON going to be sent back unchanged? If so, it does not need to be
+        # decoded and re-encoded - the text stored in the DB can be passed straight through.
+        passthrough = None
+        if subaddressed is None and (
+            request.values.get("relativeid", "").lower() in trueset
+            or current_app.config["PREFIX_RECORD_IDS"] == "NONE"
+        ):
+            passthrough = get_stored_json_text(Record, record.id)
+
         # Otherwise, supply the current record.
-        if record and record.data:
+        if record and (passthrough or record.data):
             current_app.logger.debug(
                 f"{entity_id} - If-None-Match header set? {bool(request.if_none_match)}"
             )
-            if record.checksum in request.if_none_match:
+            # Compressed copies have the checksum with a ':<coding>' suffix as their etag
+            cached = [
+                tag
+                for tag in request.if_none_match.as_set()
+                if etag_checksum(tag) == record.checksum
+            ]
+            if cached or request.if_none_match.star_tag:
                 # Client has supplied etags of the resources it has cached for this URI
                 # If the current checksum for this record matches, send back an empty response
                 # using HTTP 304 Not Modified, with the etag and last modified date in the headers
                 headers = {
                     "Last-Modified": format_datetime(record.datetime_updated),
-                    "ETag": f'"{record.checksum}"',
+                    "ETag": f'"{cached[0] if cached else record.checksum}"',
                 }
 
                 if current_app.config["KEEP_LAST_VERSION"] is True:
@@ -780,9 +1077,6 @@ def entity_record(entity_id):
             desired = determine_requested_format_and_profile(request)
             # Response -> dict {"preferred_mimetype": ..., "accepted_mimetypes": [...,], "requested_profiles": [...,]}
 
-            # id/@id?
-            attr = "@id" if "@id" in record.data else "id"
-
             current_app.logger.debug(
                 f"Desired RDF format and profile information? {desired}"
             )
@@ -793,6 +1087,10 @@ def entity_record(entity_id):
             # Recursively prefix each 'id' attribute that currently lacks a http(s):// prefix
             prefixRecordIDs = current_app.config["PREFIX_RECORD_IDS"]
             unprefixed = False
+            # A stored serialization of the record in the requested format (see PRERENDER_FORMATS)
+            rendering = None
+            # ...or the format that this response should be stored as, if there wasn't one
+            render_format = None
             if (
                 request.values.get("relativeid", "").lower() in trueset
                 or prefixRecordIDs == "NONE"
@@ -805,8 +1103,16 @@ def entity_record(entity_id):
                 desired = {}
                 unprefixed = True
                 data = (
-                    subdata or record.data
+                    passthrough or subdata or record.data
                 )  # so pass back the record data as-is to the client
+            elif subaddressed is None and (
+                rendering := find_rendering(record, desired, request)
+            ):
+                # The rendering was made from the prefixed data, so there is nothing to do here
+                current_app.logger.debug(
+                    f"{entity_id} - stored rendering found (encoding: {rendering.encoding})"
+                )
+                data = rendering.data
             else:  # otherwise, record "id" field prefixing is enabled, as configured
                 current_app.logger.debug(
                     f"{entity_id} - PREFIXING IDs to absolute URIs STARTED at timecode {time.perf_counter() - profile_time}"
@@ -816,6 +1122,9 @@ def entity_record(entity_id):
                     False if prefixRecordIDs == "TOP" else True
                 )  # recursive by default
 
+                # id/@id?
+                attr = "@id" if "@id" in record.data else "id"
+
                 data = subdata or record.data
 
                 # Assume that id/@id choice used in the data is the same as the top level
@@ -823,32 +1132,14 @@ def entity_record(entity_id):
                 if current_app.config["PROCESS_RDF"] is True and "@context" in data:
                     urlprefixes = get_url_prefixes_from_context(data["@context"])
 
-                data = containerRecursiveCallback(
-                    data=data,
-                    attr=attr,
-                    callback=idPrefixer,
-                    prefix=idPrefix,
+                data = prefix_record_ids(
+                    data,
+                    attr,
+                    idPrefix,
                     recursive=recursive,
                     urlprefixes=urlprefixes,
                 )
 
-                # Removing @base, if present
-                if context := data.get("@context"):
-                    if isinstance(context, dict):
-                        if "@base" in context:
-                            del context["@base"]
-                    elif isinstance(context, list):
-                        for x in context:
-                            if isinstance(x, dict) and "@base" in x:
-                                del x["@base"]
-
-                    # Now, flatten the context if needed, removing empty lists, dicts
-                    if flattened_context := squish_dict(context):
-                        data["@context"] = flattened_context
-                    else:
-                        # Nothing in @context now?
-                        del data["@context"]
-
                 current_app.logger.debug(
                     f"{entity_id} - PREFIXING IDs to absolute URIs ENDED at timecode {time.perf_counter() - profile_time}"
                 )
@@ -996,11 +1287,19 @@ def entity_record(entity_id):
                                 current_app.config["USE_PYLD_REFORMAT"] is True
                                 and "rdflib" not in request.values
                             )
-                            if use_pyld:
+                            if rendering is not None:
+                                current_app.logger.debug(
+                                    f"{entity_id} - using the stored {shortformat} rendering"
+                                )
+                                data = rendering.data
+                                # blank out the etag for now
+                                etag = None
+                            elif use_pyld:
                                 current_app.logger.debug(
                                     f"{entity_id} - using PyLD to parse JSON-LD"
                                 )
-                                data = reformat_rdf(
+                                data = run_cpu_bound(
+                                    reformat_rdf,
                                     data,
                                     shortformat=shortformat,
                                     use_pyld=use_pyld,
@@ -1012,7 +1311,8 @@ def entity_record(entity_id):
                                 current_app.logger.debug(
                                     f"{entity_id} - using RDFLIB to parse JSON-LD"
                                 )
-                                data = reformat_rdf(
+                                data = run_cpu_bound(
+                                    reformat_rdf,
                                     data,
                                     shortformat=shortformat,
                                     use_pyld=False,
@@ -1021,6 +1321,13 @@ def entity_record(entity_id):
                                 # blank out the etag for now
                                 etag = None
 
+                            if (
+                                rendering is None
+                                and subaddressed is None
+                                and prerenders(shortformat, use_pyld)
+                            ):
+                                render_format = shortformat
+
                             current_app.logger.debug(
                                 f"{entity_id} - CHANGING RDFFORMAT FINISHED at timecode {time.perf_counter() - profile_time}"
                             )
@@ -1040,6 +1347,41 @@ def entity_record(entity_id):
                 response.headers["Link"] = link_headers
                 response.headers["Vary"] = "accept-datetime"
 
+            if rendering is not None and rendering.encoding is not None:
+                # Already compressed - Flask-Compress leaves responses with a Content-Encoding alone
+                response.headers["Content-Encoding"] = rendering.encoding
+                if etag:
+                    # Different bytes, so a different etag - as Flask-Compress would give it
+                    response.headers["ETag"] = (
+                        f'"{record.checksum}:{rendering.encoding}"'
+                    )
+
+            if (
+                rendering is None
+                and subaddressed is None
+                and unprefixed is False
+                and etag
+                and prerenders("json-ld")
+            ):
+                # Plain, prefixed JSON-LD
+                render_format = "json-ld"
+
+            if current_app.config["PRECOMPRESS_RENDERINGS"] is True and (
+                rendering is not None or render_format is not None
+            ):
+                # A stored copy could be picked by Accept-Encoding, whether or not this one was
+                response.vary.add("Accept-Encoding")
+
+            if render_format is not None and record.checksum:
+                # Not rendered at ingest (eg. ingested before this was enabled)
+                # so keep this one for next time
+                schedule_store_rendering(
+                    record.id,
+                    record.checksum,
+                    render_format,
+                    response.get_data(as_text=True),
+                )
+
             if subaddressed is not None:
                 response.headers["Location"] = subaddressed
             current_app.logger.debug(
@@ -1225,39 +1567,38 @@ def entity_version(entity_id):
             # and should be sent:
 
             # Recursively prefix each 'id' attribute that currently lacks a http(s):// prefix
-            data = version.data
             allow_format_rewriting = True
+            prefixRecordIDs = current_app.config["PREFIX_RECORD_IDS"]
+            if (
+                request.values.get("relativeid", "").lower() in trueset
+                or prefixRecordIDs == "NONE"
+            ):  # when "NONE", record "id" field prefixing is not enabled
+                # Don't allow format rewriting if the URIs are relative (ntriples, etc break):
+                allow_format_rewriting = False
+                # Nothing will be changed, so pass the stored JSON through without decoding it
+                data = version_text(version)
+            else:
+                data = version_data(version)
 
-            if data is not None:
-                prefixRecordIDs = current_app.config["PREFIX_RECORD_IDS"]
-                if (
-                    request.values.get("relativeid", "").lower() in trueset
-                    or prefixRecordIDs == "NONE"
-                ):  # when "NONE", record "id" field prefixing is not enabled
-                    # Don't allow format rewriting if the URIs are relative (ntriples, etc break):
-                    allow_format_rewriting = False
-                else:  # otherwise, record "id" field prefixing is enabled, as configured
-                    current_app.logger.debug(
-                        f"{entity_id} - PREFIXING IDs to absolute URIs STARTED at timecode {time.perf_counter() - profile_time}"
-                    )
-                    recursive = (
-                        False if prefixRecordIDs == "TOP" else True
-                    )  # recursive by default
-
-                    # Assume that id/@id choice used in the data is the same as the top level
-                    attr = "@id" if "@id" in data else "id"
-                    urlprefixes = None
-                    if current_app.config["PROCESS_RDF"] is True and "@context" in data:
-                        urlprefixes = get_url_prefixes_from_context(data["@context"])
-
-                    data = containerRecursiveCallback(
-                        data=data,
-                        attr=attr,
-                        callback=idPrefixer,
-                        prefix=idPrefix,
-                        recursive=recursive,
-                        urlprefixes=urlprefixes,
-                    )
+            if data is not None and allow_format_rewriting:
+                # record "id" field prefixing is enabled, as configured
+                current_app.logger.debug(
+                    f"{entity_id} - PREFIXING IDs to absolute URIs STARTED at timecode {time.perf_counter() - profile_time}"
+                )
+                recursive = (
+                    False if prefixRecordIDs == "TOP" else True
+                )  # recursive by default
+
+                # Assume that id/@id choice used in the data is the same as the top level
+                attr = "@id" if "@id" in data else "id"
+                urlprefixes = None
+                if current_app.config["PROCESS_RDF"] is True and "@context" in data:
+                    urlprefixes = get_url_prefixes_from_context(data["@context"])
+
+                rewrite = compile_id_prefixer(
+                    idPrefix, frozenset(urlprefixes or ()), recursive
+                )
+                data = rewrite(data, attr, tidy_context=False)
 
                 current_app.logger.debug(
                     f"{entity_id} - PREFIXING IDs to absolute URIs ENDED at timecode {time.perf_counter() - profile_time}"
@@ -1286,48 +1627,20 @@ def entity_version(entity_id):
                             # Browsers typically don't handle ntriples/turtle
                             content_type = "text/plain;charset=UTF-8"
 
-                        if (
+                        use_pyld = (
                             current_app.config["USE_PYLD_REFORMAT"] is True
                             and "rdflib" not in request.values
-                        ):
-                            current_app.logger.debug(
-                                f"VERSION {entity_id} - using PyLD to parse JSON-LD"
-                            )
-                            # Use the PyLD library to parse into nquads, and rdflib to convert
-                            # rdflib's json-ld import has not been tested on our data, so not relying on it
-                            proc = jsonld.JsonLdProcessor()
-                            serialized_rdf = proc.to_rdf(
-                                data,
-                                {
-                                    "format": "application/n-quads",
-                                    "documentLoader": current_app.config[
-                                        "RDF_DOCLOADER"
-                                    ],
-                                },
-                            )
-
-                            ident = data.get("id") or data.get("@id")
-
-                            # rdflib to load and format the nquads
-                            # forcing it, because of pyld's awful nquad export
-                            g = get_bound_graph(identifier=ident)
-
-                            # May not be nquads, even though we requested it:
-                            serialized_rdf = triples_to_quads(serialized_rdf, ident)
-
-                            g.parse(data=serialized_rdf, format="nquads")
-                            data = g.serialize(format=desired[1])
-                        else:
-                            current_app.logger.debug(
-                                f"{entity_id} - using RDFLIB to parse JSON-LD"
-                            )
-                            ident = data.get("id") or data.get("@id")
-
-                            # using rdflib to both parse and re-serialize the RDF:
-                            g = get_bound_graph(identifier=ident)
-
-                            g.parse(data=json.dumps(data), format="json-ld")
-                            data = g.serialize(format=desired[1])
+                        )
+                        current_app.logger.debug(
+                            f"VERSION {entity_id} - using {'PyLD' if use_pyld else 'RDFLIB'} to parse JSON-LD"
+                        )
+                        data = run_cpu_bound(
+                            reformat_rdf,
+                            data,
+                            shortformat=desired[1],
+                            use_pyld=use_pyld,
+                            rdf_docloader=current_app.config["RDF_DOCLOADER"],
+                        )
 
                         current_app.logger.debug(
                             f"VERSION {entity_id} - CHANGING RDFFORMAT FINISHED at timecode {time.perf_counter() - profile_time}"
@@ -1386,7 +1699,11 @@ def delete_entity_version(entity_id):
             current_app.logger.warning(
                 f"Deleting version '-VERSION-/{entity_id}' as requested."
             )
+            invalidate_timemaps(version.record_id)
+            unlink_version(version)
             db.session.delete(version)
+            db.session.flush()
+            refresh_previous_versions([version.record_id])
             db.session.commit()
             return jsonify({"message": f"-VERSION-/{entity_id} deleted."}), 200
         except SQLAlchemyError as e:
@@ -1443,7 +1760,8 @@ def truncate_activity_stream_of_entity_id(entity_id):
         response = construct_error_response(status)
         abort(response)
 
-    count = get_record_activities_count(entity_id)
+    # Counted from the activities themselves, as they are about to be removed
+    count = get_record_activities_count(entity_id, exact=True)
     # Are there events for this ID?
     if count == 0:
         response = construct_error_response(status_record_not_found)
@@ -1498,6 +1816,11 @@ def truncate_activity_stream_of_entity_id(entity_id):
         .all()
     )
 
+    # The later pages of the record's type's stream start in different places without them
+    invalidate_type_index(
+        a.id for a in activity_list[keep_latest_events:end_of_truncate]
+    )
+
     deleted = 0
     # python slice will pull all the list into memory
     # should be fine, given the above note.
@@ -1505,6 +1828,11 @@ def truncate_activity_stream_of_entity_id(entity_id):
         db.session.delete(a)
         deleted += 1
 
+    # Any stored activity stream pages that held them are now out of date
+    invalidate_activity_pages(
+        a.id for a in activity_list[keep_latest_events:end_of_truncate]
+    )
+
     current_app.logger.warning(
         f"Truncating {entity_id} activity-stream to most recent {keep_latest_events} event(s)"
     )
@@ -1609,5 +1937,7 @@ def get_record_activities(entity_id, offset, limit):
     return activities
 
 
-def get_record_activities_count(entity_id):
+def get_record_activities_count(entity_id, exact=False):
+    if counts_enabled() and not exact:
+        return get_activity_count(RECORD, entity_id)
     return (Activity.query.join(Record).filter(Record.entity_id == entity_id)).count()
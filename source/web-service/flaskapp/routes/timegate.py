@@ -1,14 +1,24 @@
 from email.utils import formatdate
 
-from flask import Blueprint, current_app, abort, request, jsonify, url_for
+from flask import Blueprint, current_app, abort, request, url_for
 from sqlalchemy.orm import load_only
 
 from flaskapp.models import db
-from flaskapp.models.record import Record, Version
+from flaskapp.models.record import Record
+from flaskapp.background import submit
 from flaskapp.utilities import requested_linkformat
+from flaskapp.storage_utilities.timemaps import (
+    cache_enabled,
+    get_stored_timemap,
+    record_state,
+    store_timemap,
+    version_key,
+    version_page,
+)
 from flaskapp.errors import (
     construct_error_response,
     status_record_not_found,
+    status_bad_timemap_cursor,
 )
 
 # Create a new "sparql" route blueprint
@@ -21,6 +31,24 @@ def json_to_linkformat(d):
     return ";".join(lf)
 
 
+def http_date(dt):
+    return formatdate(timeval=dt.timestamp(), localtime=False, usegmt=True)
+
+
+def timemap_response(text, fmt, uri_t):
+    if fmt == "application/json":
+        return current_app.response_class(text, mimetype="application/json")
+
+    response = current_app.make_response(text)
+    response.content_type = "application/link-format;charset=utf-8"
+    response.mimetype = "application/link-format"
+    response.status_code = 200
+    response.content_encoding = "utf-8"
+    response.content_location = uri_t
+    response.location = uri_t
+    return response
+
+
 @timegate.route("/-tm-/<path:entity_id>")
 def get_timemap(entity_id):
     # Get the timemap for the given entity_id, if one exists
@@ -30,7 +58,15 @@ def get_timemap(entity_id):
     record = (
         db.session.query(Record)
         .filter(Record.entity_id == entity_id)
-        .options(load_only(Record.entity_id, Record.id, Record.datetime_updated))
+        .options(
+            load_only(
+                Record.entity_id,
+                Record.id,
+                Record.datetime_updated,
+                Record.checksum,
+                Record.previous_version,
+            )
+        )
         .limit(1)
         .first()
     )
@@ -40,11 +76,45 @@ def get_timemap(entity_id):
         response = construct_error_response(status_record_not_found)
         return abort(response)
 
+    # Which page - the versions before (older than) or after (newer than) a version, or else
+    # the newest. See flaskapp.storage_utilities.timemaps
+    cursor = {k: request.args[k] for k in ("before", "after") if k in request.args}
+
     # Memento URI-R:
     uri_r = f"{idPrefix}{ url_for('records.entity_record', entity_id=entity_id) }"
 
     # This URI-T
-    uri_t = f"{idPrefix}{ url_for('timegate.get_timemap', entity_id=entity_id) }"
+    uri_t = (
+        f"{idPrefix}{ url_for('timegate.get_timemap', entity_id=entity_id, **cursor) }"
+    )
+
+    # Response format? config['MEMENTO_PREFERRED_FORMAT'] for the default
+    requested_fmt = requested_linkformat(request, mementoformat)
+    current_app.logger.debug(
+        f"Accept: {request.headers.get('accept')}, pref: {mementoformat}, tm format decision: {requested_fmt}"
+    )
+
+    # Read before the versions, so that a page is never stored under a newer state than it
+    # was rendered from
+    state = record_state(record)
+    if cache_enabled() and (
+        stored := get_stored_timemap(record.id, state, uri_t, requested_fmt)
+    ):
+        return timemap_response(stored, requested_fmt, uri_t)
+
+    before = after = None
+    if "before" in cursor or "after" in cursor:
+        key = version_key(record.id, cursor.get("before", cursor.get("after")))
+        if key is None:
+            return abort(construct_error_response(status_bad_timemap_cursor))
+        if "before" in cursor:
+            before = key
+        else:
+            after = key
+
+    versions, has_newer, has_older = version_page(
+        record.id, current_app.config["TIMEMAP_PAGE_SIZE"], before=before, after=after
+    )
 
     # Timemap formatting
     # no browser understands link-format, and it's a pain of a format. A JSON-encoded version is
@@ -56,82 +126,65 @@ def get_timemap(entity_id):
     # MUST URI-R as rel "original"
     # and MUST each URI-M (Version)
     timemap = []
-    timemap.append(
-        {
-            "uri": uri_t,
-            "rel": "self",
-            "until": formatdate(
-                timeval=record.datetime_updated.timestamp(),
-                localtime=False,
-                usegmt=True,
-            ),
-        }
-    )
+    timemap.append({"uri": uri_t, "rel": "self"})
+    if has_newer and versions:
+        timemap[0]["until"] = http_date(versions[0][1])
+    else:
+        timemap[0]["until"] = http_date(record.datetime_updated)
     timemap.append({"uri": uri_r, "rel": "original timegate"})
 
-    versions = (
-        db.session.query(Version)
-        .options(
-            load_only(Version.record_id, Version.entity_id, Version.datetime_updated)
-        )
-        .filter(Version.record_id == record.id)
-        .order_by(Version.datetime_updated.desc())
-        .all()
-    )
-
-    num_versions = len(versions)
-    if num_versions == 1:
-        # spec doesn't really talk about how to format in this case
+    # Other pages of the TimeMap, in time order
+    if has_older:
         timemap.append(
             {
-                "uri": f"{idPrefix}{ url_for('records.entity_version', entity_id=versions[0].entity_id) }",
-                "datetime": formatdate(
-                    timeval=versions[0].datetime_updated.timestamp(),
-                    localtime=False,
-                    usegmt=True,
-                ),
-                "rel": "first last memento",
+                "uri": f"{idPrefix}{ url_for('timegate.get_timemap', entity_id=entity_id, before=versions[-1][0]) }",
+                "rel": "prev",
+                "type": requested_fmt,
             }
         )
-    elif num_versions > 1:
-        for idx, version in enumerate(versions):
-            mm = {
-                "uri": f"{idPrefix}{ url_for('records.entity_version', entity_id=version.entity_id) }",
-                "datetime": formatdate(
-                    timeval=version.datetime_updated.timestamp(),
-                    localtime=False,
-                    usegmt=True,
-                ),
-                "rel": "memento",
+    if has_newer:
+        newest = versions[0][0] if versions else cursor["before"]
+        timemap.append(
+            {
+                "uri": f"{idPrefix}{ url_for('timegate.get_timemap', entity_id=entity_id, after=newest) }",
+                "rel": "next",
+                "type": requested_fmt,
             }
-            if idx == 0:
-                # Should be an ordered list from the DB, last as newest
-                mm["rel"] = "last memento"
-            elif num_versions - idx == 1:
-                # last in list will be the oldest - 'first' is the correct type
-                mm["rel"] = "first memento"
-                # mark timemap with until datetime
-                timemap[0]["from"] = formatdate(
-                    timeval=version.datetime_updated.timestamp(),
-                    localtime=False,
-                    usegmt=True,
-                )
-            timemap.append(mm)
+        )
+
+    # The URI of each version, made without calling url_for for every one
+    version_uri = (
+        f"{idPrefix}{ url_for('records.entity_version', entity_id='_') }"
+    ).removesuffix("_")
+
+    num_versions = len(versions)
+    for idx, (version_entity_id, version_datetime) in enumerate(versions):
+        mm = {
+            "uri": f"{version_uri}{version_entity_id}",
+            "datetime": http_date(version_datetime),
+            "rel": "memento",
+        }
+        # Newest first - so the first on the newest page is the last memento, and the last
+        # on the oldest page is the first memento
+        newest = idx == 0 and not has_newer
+        oldest = idx == num_versions - 1 and not has_older
+        if newest and oldest:
+            # spec doesn't really talk about how to format in this case
+            mm["rel"] = "first last memento"
+        elif newest:
+            mm["rel"] = "last memento"
+        elif oldest:
+            mm["rel"] = "first memento"
+        if idx == num_versions - 1:
+            # mark timemap with the from datetime
+            timemap[0]["from"] = mm["datetime"]
+        timemap.append(mm)
 
-    # Response format? config['MEMENTO_PREFERRED_FORMAT'] for the default
-    requested_fmt = requested_linkformat(request, mementoformat)
-    current_app.logger.debug(
-        f"Accept: {request.headers.get('accept')}, pref: {mementoformat}, tm format decision: {requested_fmt}"
-    )
     if requested_fmt == "application/json":
-        return jsonify(timemap), 200
+        text = current_app.json.dumps(timemap)
     else:
-        lf = " , \n".join([json_to_linkformat(x) for x in timemap])
-        response = current_app.make_response(lf)
-        response.content_type = "application/link-format;charset=utf-8"
-        response.mimetype = "application/link-format"
-        response.status_code = 200
-        response.content_encoding = "utf-8"
-        response.content_location = uri_t
-        response.location = uri_t
-        return response
+        text = " , \n".join([json_to_linkformat(x) for x in timemap])
+
+    if cache_enabled():
+        submit(store_timemap, record.id, state, uri_t, requested_fmt, text)
+    return timemap_response(text, requested_fmt, uri_t)
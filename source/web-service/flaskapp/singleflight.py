@@ -0,0 +1,134 @@
+import functools
+import threading
+
+from flask import current_app, request, abort
+from werkzeug.exceptions import HTTPException
+
+"""
+Request coalescing ('single-flight')
+------------------------------------
+
+When COALESCE_REQUESTS is enabled, identical GET/HEAD requests that arrive at a worker while
+the same request is already being handled wait for that first request to finish and are sent
+a copy of its response, rather than each repeating the same DB fetch, id prefixing and RDF
+reformatting. This is per worker process - nothing is shared between workers.
+
+Requests are identical if they have the same method, path and query string, and the same
+values for the headers that change the response (REQUEST_VARIANT_HEADERS).
+
+If the first request fails, the waiting requests fail in the same way. A waiting request gives
+up after COALESCE_TIMEOUT seconds with a SingleFlightTimeoutError (HTTP 503).
+
+The waiting uses threading primitives, which are cooperative under gevent's monkey-patching, so
+this works for the sync, gthread and gevent worker classes alike.
+"""
+
+REQUEST_VARIANT_HEADERS = (
+    "Accept",
+    "Accept-Encoding",
+    "Accept-Datetime",
+    "Accept-Profile",
+    "Profile",
+    "If-None-Match",
+    "Authorization",
+)
+
+
+class SingleFlightTimeoutError(RuntimeError):
+    """Gave up waiting for an identical request in progress"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run a function at most once at a time per key - callers with the same key arriving
+    while it is running wait for, and share, its result or exception."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, timeout=None):
+        """Returns (result, shared) where shared is True if the result came from another caller"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if leader:
+            try:
+                call.result = func()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result, False
+
+        if not call.done.wait(timeout):
+            raise SingleFlightTimeoutError(f"Timed out waiting on {key}")
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+
+_flights = SingleFlight()
+
+
+def _snapshot(response):
+    # The response object itself is not shared, as after_request handlers (and Flask-Compress)
+    # modify it in place
+    return (response.get_data(), response.status, list(response.headers.items()))
+
+
+def _from_snapshot(snapshot):
+    body, status, headers = snapshot
+    return current_app.response_class(body, status=status, headers=headers)
+
+
+def coalesce_requests(view):
+    """Decorator for a view, coalescing identical concurrent GET and HEAD requests"""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_app.config.get(
+            "COALESCE_REQUESTS"
+        ) is not True or request.method not in ("GET", "HEAD"):
+            return view(*args, **kwargs)
+
+        key = (
+            request.method,
+            request.full_path,
+            tuple(request.headers.get(h) for h in REQUEST_VARIANT_HEADERS),
+        )
+
+        def render():
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            except HTTPException as e:
+                if e.response is None:
+                    raise
+                # aborted with a response (eg a 404) - share a copy of that
+                return ("error", _snapshot(e.response), e.response)
+            return ("ok", _snapshot(response), response)
+
+        (outcome, snapshot, response), shared = _flights.do(
+            key, render, timeout=current_app.config["COALESCE_TIMEOUT"]
+        )
+        if shared:
+            current_app.logger.debug(f"Coalesced request for {request.full_path}")
+            response = _from_snapshot(snapshot)
+
+        if outcome == "error":
+            abort(response)
+        return response
+
+    return wrapper
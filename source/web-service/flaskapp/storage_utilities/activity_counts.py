@@ -0,0 +1,137 @@
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import event, func, literal, select, insert
+
+from flaskapp.models import db
+from flaskapp.models.activity import Activity, ActivityCount
+from flaskapp.models.record import Record
+from flaskapp.storage_utilities.counters import increment_counts
+
+"""
+Activity counts
+---------------
+
+When ACTIVITY_COUNTS is enabled, the number of activities in the whole activity stream, in
+the stream of each entity type and in the stream of each record is kept in the
+'activity_counts' table, so that the activity stream collections can give their totals
+without counting through the activities table on every request.
+
+Every Activity added or deleted through the session is noted as it is flushed, and the
+counts are adjusted as the transaction commits - one batch of upserts, in a consistent order
+(see flaskapp.storage_utilities.counters), and as late as possible so that the rows are
+locked only briefly. A transaction that is rolled back leaves the counts as they were.
+
+Activities deleted in bulk (by the compaction job) are noted with note_removed_activities.
+Any others added or removed other than through the ORM session (eg by hand in the DB) are not
+counted - `flask records activity-counts` recounts everything from the activities table.
+"""
+
+ALL = "all"
+TYPE = "type"
+RECORD = "record"
+
+_DELTAS_KEY = "activity_count_deltas"
+
+
+def counts_enabled():
+    return current_app.config.get("ACTIVITY_COUNTS") is True
+
+
+def type_key(entity_type):
+    return (entity_type or "").lower()
+
+
+def get_activity_count(scope, key=""):
+    return (
+        db.session.query(ActivityCount.count)
+        .filter(ActivityCount.scope == scope, ActivityCount.key == key)
+        .scalar()
+        or 0
+    )
+
+
+@event.listens_for(db.session, "after_flush")
+def _note_activity_changes(session, flush_context):
+    if not counts_enabled():
+        return
+    deltas = None
+    for change, objects in ((1, session.new), (-1, session.deleted)):
+        for obj in objects:
+            if isinstance(obj, Activity):
+                if deltas is None:
+                    deltas = session.info.setdefault(_DELTAS_KEY, Counter())
+                deltas[obj.record_id] += change
+
+
+def note_removed_activities(session, removed):
+    """Count activities deleted in bulk (rather than one by one through the session) as the
+    transaction commits - removed being a Counter of the number deleted for each record id
+    """
+    if counts_enabled() and removed:
+        session.info.setdefault(_DELTAS_KEY, Counter()).subtract(removed)
+
+
+@event.listens_for(db.session, "before_commit")
+def _apply_activity_counts(session):
+    if not counts_enabled():
+        return
+    # Anything still to be flushed may hold activities
+    session.flush()
+    deltas = session.info.pop(_DELTAS_KEY, None)
+    if not deltas:
+        return
+
+    changes = Counter()
+    for record_id, entity_id, entity_type in session.query(
+        Record.id, Record.entity_id, Record.entity_type
+    ).filter(Record.id.in_(list(deltas))):
+        change = deltas[record_id]
+        changes[(ALL, "")] += change
+        changes[(TYPE, type_key(entity_type))] += change
+        changes[(RECORD, entity_id)] += change
+
+    increment_counts(
+        session,
+        ActivityCount,
+        ["scope", "key"],
+        "count",
+        {k: v for k, v in changes.items() if v},
+    )
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def _forget_activity_changes(session, previous_transaction):
+    session.info.pop(_DELTAS_KEY, None)
+
+
+def recount_activities():
+    """Replace every count with a fresh count of the activities table"""
+    db.session.query(ActivityCount).delete(synchronize_session=False)
+    # A count that is already in the new totals is not adjusted again by this commit
+    db.session.info.pop(_DELTAS_KEY, None)
+
+    columns = ["scope", "key", "count"]
+    db.session.execute(
+        insert(ActivityCount).from_select(
+            columns, select(literal(ALL), literal(""), func.count(Activity.id))
+        )
+    )
+    entity_type = func.coalesce(Activity.entity_type, "")
+    db.session.execute(
+        insert(ActivityCount).from_select(
+            columns,
+            select(literal(TYPE), entity_type, func.count(Activity.id)).group_by(
+                entity_type
+            ),
+        )
+    )
+    db.session.execute(
+        insert(ActivityCount).from_select(
+            columns,
+            select(literal(RECORD), Record.entity_id, func.count(Activity.id))
+            .join(Record, Record.id == Activity.record_id)
+            .group_by(Record.entity_id),
+        )
+    )
+    db.session.commit()
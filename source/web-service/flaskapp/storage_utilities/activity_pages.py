@@ -0,0 +1,138 @@
+import bisect
+import hashlib
+
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import undefer
+
+from flaskapp.models import db
+from flaskapp.models.activity import Activity, ActivityStreamPage
+
+"""
+Stored activity stream pages
+----------------------------
+
+Activity ids only ever increase, but they are handed out when an ingest adds an activity,
+not when it commits: an activity with an id beyond the end of a page of the activity stream
+can be visible while an ingest that began earlier is still to commit some on that page. So a
+page is only taken to be 'closed' - nothing more can be added to it, and it can only change
+if some of its activities are removed, by truncating a record's activity stream - once an
+activity after it was created more than ACTIVITY_PAGE_GRACE seconds ago, as every id on the
+page was handed out before that one was. When ACTIVITY_PAGE_CACHE is enabled, each closed
+page is rendered once, stored in the 'activity_stream_pages' table with a strong ETag (a
+hash of its body), and from then on sent as it was stored. Pages that are not closed yet,
+including the last page, are always rendered on request.
+
+Pages are stored by the range of activity ids they cover, so a change to ITEMS_PER_PAGE
+does not serve pages of the old size. Removing activities deletes the stored pages that
+held them. A page is stored on the background thread, after it has been rendered, so before
+storing it the activities in its range are counted again - a page that holds activities
+removed in the meantime (which found no stored page to delete) is not stored.
+"""
+
+
+def page_range(pagenum, limit):
+    """The (first, last) activity ids on a page"""
+    return ((pagenum - 1) * limit + 1, pagenum * limit)
+
+
+def page_etag(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def last_settled_id(grace):
+    """The id of the latest activity created more than grace seconds ago (or 0) - every
+    activity up to it has been committed"""
+    # Stored as UTC, without the timezone
+    settled = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=grace)
+    return (
+        db.session.query(Activity.id)
+        .filter(Activity.datetime_created < settled)
+        .order_by(Activity.id.desc())
+        .limit(1)
+        .scalar()
+    ) or 0
+
+
+def page_closed(pagenum, limit, grace):
+    """Is there an activity after the page that was created more than grace seconds ago?"""
+    _, last_id = page_range(pagenum, limit)
+    return last_settled_id(grace) > last_id
+
+
+def get_stored_page(base_url, pagenum, limit):
+    """The stored page, with its data loaded, or None"""
+    first_id, last_id = page_range(pagenum, limit)
+    return (
+        db.session.query(ActivityStreamPage)
+        .options(undefer(ActivityStreamPage.data))
+        .filter(
+            ActivityStreamPage.base_url == base_url,
+            ActivityStreamPage.first_id == first_id,
+            ActivityStreamPage.last_id == last_id,
+        )
+        .one_or_none()
+    )
+
+
+def store_page(base_url, pagenum, limit, text, etag, num_items):
+    """Store the page, rendered with num_items activities, unless some of those have been
+    removed since"""
+    first_id, last_id = page_range(pagenum, limit)
+    remaining = (
+        db.session.query(func.count(Activity.id))
+        .filter(Activity.id >= first_id, Activity.id <= last_id)
+        .scalar()
+    )
+    if remaining != num_items:
+        db.session.rollback()
+        return
+    page = ActivityStreamPage(
+        base_url=base_url,
+        first_id=first_id,
+        last_id=last_id,
+        etag=etag,
+        datetime_created=datetime.now(timezone.utc),
+        data=text,
+    )
+    db.session.add(page)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker stored it first
+        db.session.rollback()
+
+
+def invalidate_activity_pages(activity_ids):
+    """Delete the stored pages holding any of these activities, as part of the current
+    transaction. Returns the number deleted."""
+    activity_ids = sorted(set(activity_ids))
+    if not activity_ids:
+        return 0
+
+    stale = [
+        page_id
+        for page_id, first_id, last_id in db.session.query(
+            ActivityStreamPage.id,
+            ActivityStreamPage.first_id,
+            ActivityStreamPage.last_id,
+        ).filter(
+            ActivityStreamPage.first_id <= activity_ids[-1],
+            ActivityStreamPage.last_id >= activity_ids[0],
+        )
+        # Is there one of the ids within the page's range?
+        if bisect.bisect_right(activity_ids, last_id)
+        > bisect.bisect_left(activity_ids, first_id)
+    ]
+    if stale:
+        db.session.query(ActivityStreamPage).filter(
+            ActivityStreamPage.id.in_(stale)
+        ).delete(synchronize_session=False)
+    return len(stale)
+
+
+def clear_activity_pages():
+    db.session.query(ActivityStreamPage).delete(synchronize_session=False)
+    db.session.commit()
@@ -0,0 +1,115 @@
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from flaskapp.models import db
+from flaskapp.models.activity import Activity, ActivityTimeSpan
+from flaskapp.background import submit
+
+"""
+Activity time index
+-------------------
+
+To find the first activity created at or after a given time (for
+/activity-stream/skip-to-datetime) without scanning the activities table, the activity ids
+are split into spans of TIME_SPAN ids, and once there is an activity beyond the end of a span
+(the same point at which a page of the activity stream is closed) a row is added to the
+'activity_time_index' table with the earliest and latest creation times in that span.
+
+The latest time is carried forward from span to span, so that it never decreases - the
+first span whose latest time is at or after the one asked for is then found with a single
+lookup of its index, and the activity itself by reading forward from the start of that span.
+Activities later removed (by truncation or compaction) can only make a span's latest time
+an overestimate, which costs a slightly longer read but never gives the wrong activity.
+
+The index is extended on the background thread when a lookup finds it behind, and can be
+built or rebuilt with `flask records activity-time-index`.
+"""
+
+TIME_SPAN = 1000
+# The most spans added in one transaction
+_EXTEND_BATCH = 1000
+
+
+def _indexed_to():
+    """(last id indexed, latest time indexed)"""
+    return (
+        db.session.query(ActivityTimeSpan.last_id, ActivityTimeSpan.last_datetime)
+        .order_by(ActivityTimeSpan.first_id.desc())
+        .first()
+    ) or (0, None)
+
+
+def _closed_to():
+    """The last id of the last span with an activity beyond it"""
+    max_id = db.session.query(func.max(Activity.id)).scalar() or 0
+    return max(max_id - 1, 0) // TIME_SPAN * TIME_SPAN
+
+
+def extend_time_index():
+    """Add the spans closed since the index was last extended. Returns the number added."""
+    added = 0
+    indexed_to, latest = _indexed_to()
+    closed_to = _closed_to()
+    while indexed_to < closed_to:
+        batch_to = min(indexed_to + _EXTEND_BATCH * TIME_SPAN, closed_to)
+        span = (Activity.id - 1) // TIME_SPAN
+        rows = (
+            db.session.query(
+                span,
+                func.min(Activity.datetime_created),
+                func.max(Activity.datetime_created),
+            )
+            .filter(Activity.id > indexed_to, Activity.id <= batch_to)
+            .group_by(span)
+            .order_by(span)
+        )
+        for number, earliest, last in rows:
+            latest = last if latest is None else max(latest, last)
+            db.session.add(
+                ActivityTimeSpan(
+                    first_id=number * TIME_SPAN + 1,
+                    last_id=(number + 1) * TIME_SPAN,
+                    first_datetime=earliest,
+                    last_datetime=latest,
+                )
+            )
+            added += 1
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker is extending it too
+            db.session.rollback()
+            return added
+        indexed_to = batch_to
+    return added
+
+
+def rebuild_time_index():
+    db.session.query(ActivityTimeSpan).delete(synchronize_session="fetch")
+    db.session.commit()
+    return extend_time_index()
+
+
+def first_activity_since(when):
+    """The id of the first activity created at or after when, or None"""
+    start = (
+        db.session.query(ActivityTimeSpan.first_id)
+        .filter(ActivityTimeSpan.last_datetime >= when)
+        .order_by(ActivityTimeSpan.last_datetime, ActivityTimeSpan.first_id)
+        .limit(1)
+        .scalar()
+    )
+    if start is None:
+        # After everything indexed so far
+        indexed_to, _ = _indexed_to()
+        start = indexed_to + 1
+        if _closed_to() - indexed_to >= TIME_SPAN:
+            submit(extend_time_index)
+
+    return (
+        db.session.query(Activity.id)
+        .filter(Activity.id >= start, Activity.datetime_created >= when)
+        .order_by(Activity.id)
+        .limit(1)
+        .scalar()
+    )
@@ -0,0 +1,155 @@
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from flaskapp.models import db
+from flaskapp.models.activity import Activity, ActivityTypeMark
+from flaskapp.background import submit
+from flaskapp.storage_utilities.activity_pages import last_settled_id
+from flaskapp.storage_utilities.entity_types import known_entity_types
+
+"""
+Activity type index
+-------------------
+
+A page of the activity stream of one entity type (/activity-stream/type/<type>) starts at a
+position in that type's activities, not at a known activity id, so finding it means
+stepping over every activity of the type before it. To avoid that, the
+'activity_type_index' table holds the id of the activity at the start of each page (every
+ITEMS_PER_PAGE-th position) of each type's stream. A page is then found with one lookup of
+the nearest start at or before it, and a read forward from there of the page itself.
+After a change to ITEMS_PER_PAGE, the old starts are still right, so the read forward from
+one is at most one old page long until the index has caught up.
+
+Activity ids are handed out before an ingest commits, so the index only goes as far as the
+latest activity created more than ACTIVITY_PAGE_GRACE seconds ago - the same point up to
+which pages of the activity stream are closed (see flaskapp.storage_utilities.activity_pages).
+It is extended on the background thread when a lookup finds it behind, and can be built or
+rebuilt with `flask records activity-type-index`. Removing activities (by truncation or
+compaction) shifts the positions of every later activity of the same type, so the starts
+from the first removed activity on are deleted, to be found again by the next extension.
+An extension checks before it commits that none of the activities it counted have gone,
+and that the start it counted from is still there.
+"""
+
+# The most activity ids read (and counted) in one transaction
+_EXTEND_BATCH = 10000
+# The most activity ids looked up in one query when activities are removed
+_INVALIDATE_CHUNK = 1000
+
+
+def _last_mark(entity_type, position=None):
+    """(position, activity id) of the type's last page start, or of the last one at or before
+    position if given - or None"""
+    query = db.session.query(
+        ActivityTypeMark.position, ActivityTypeMark.activity_id
+    ).filter(ActivityTypeMark.entity_type == entity_type)
+    if position is not None:
+        query = query.filter(ActivityTypeMark.position <= position)
+    return query.order_by(ActivityTypeMark.position.desc()).first()
+
+
+def _type_ids(entity_type):
+    return db.session.query(Activity.id).filter(Activity.entity_type == entity_type)
+
+
+def extend_type_index(entity_type):
+    """Add the page starts of the type's stream settled since it was last extended. Returns
+    the number added."""
+    limit = current_app.config["ITEMS_PER_PAGE"]
+    settled_to = last_settled_id(current_app.config["ACTIVITY_PAGE_GRACE"])
+    added = 0
+    start = _last_mark(entity_type)
+    position, after = start if start is not None else (-1, 0)
+    while True:
+        ids = [
+            x
+            for (x,) in _type_ids(entity_type)
+            .filter(Activity.id > after, Activity.id <= settled_to)
+            .order_by(Activity.id)
+            .limit(_EXTEND_BATCH)
+        ]
+        if not ids:
+            return added
+
+        for activity_id in ids:
+            position += 1
+            if position % limit == 0:
+                db.session.add(
+                    ActivityTypeMark(
+                        entity_type=entity_type,
+                        position=position,
+                        activity_id=activity_id,
+                    )
+                )
+                added += 1
+
+        # Activities removed while these were counted would leave the positions wrong
+        counted = (
+            _type_ids(entity_type)
+            .filter(Activity.id > after, Activity.id <= ids[-1])
+            .with_entities(func.count(Activity.id))
+            .scalar()
+        )
+        if counted != len(ids) or (
+            start is not None
+            and tuple(_last_mark(entity_type, start[0]) or ()) != tuple(start)
+        ):
+            db.session.rollback()
+            return added
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker is extending it too
+            db.session.rollback()
+            return added
+        start = (position, ids[-1])
+        after = ids[-1]
+
+
+def rebuild_type_index():
+    """Build the index of every entity type's stream afresh. Returns the number of page
+    starts added."""
+    db.session.query(ActivityTypeMark).delete(synchronize_session="fetch")
+    db.session.commit()
+    return sum(extend_type_index(entity_type) for entity_type in known_entity_types())
+
+
+def invalidate_type_index(activity_ids):
+    """Delete the page starts that removing these activities would leave in the wrong place,
+    as part of the current transaction - called before the activities are deleted"""
+    activity_ids = list(activity_ids)
+    first_removed = {}
+    for start in range(0, len(activity_ids), _INVALIDATE_CHUNK):
+        for entity_type, first_id in (
+            db.session.query(Activity.entity_type, func.min(Activity.id))
+            .filter(
+                Activity.id.in_(activity_ids[start : start + _INVALIDATE_CHUNK]),
+                Activity.entity_type.isnot(None),
+            )
+            .group_by(Activity.entity_type)
+        ):
+            first_removed[entity_type] = min(
+                first_id, first_removed.get(entity_type, first_id)
+            )
+    for entity_type, first_id in first_removed.items():
+        db.session.query(ActivityTypeMark).filter(
+            ActivityTypeMark.entity_type == entity_type,
+            ActivityTypeMark.activity_id >= first_id,
+        ).delete(synchronize_session=False)
+
+
+def page_start(entity_type, offset, limit):
+    """The id of the activity at offset in the type's stream, or None if there is none"""
+    mark = _last_mark(entity_type, offset)
+    position, activity_id = mark if mark is not None else (0, None)
+    if offset - position >= limit:
+        # A page or more past the end of the index
+        submit(extend_type_index, entity_type)
+    if activity_id is not None and position == offset:
+        return activity_id
+
+    ids = _type_ids(entity_type)
+    if activity_id is not None:
+        ids = ids.filter(Activity.id >= activity_id)
+    return ids.order_by(Activity.id).offset(offset - position).limit(1).scalar()
@@ -0,0 +1,161 @@
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+
+from flaskapp.models import db
+from flaskapp.models.activity import Activity
+from flaskapp.models.record import Record
+from flaskapp.utilities import Event
+from flaskapp.storage_utilities.activity_counts import note_removed_activities
+from flaskapp.storage_utilities.activity_pages import invalidate_activity_pages
+from flaskapp.storage_utilities.activity_type_index import invalidate_type_index
+from flaskapp.storage_utilities.statistics import load_stats, record_stats
+
+"""
+Activity stream compaction
+--------------------------
+
+`flask records compact-activities` removes activities from the whole activity stream,
+according to these retention rules (each off by default):
+
+* ACTIVITY_RETENTION_DELETED_DAYS - every activity of a record deleted more than this many
+  days ago is removed.
+* ACTIVITY_COLLAPSE_UPDATES - of a run of consecutive Update events for a record, only the
+  last is kept.
+* ACTIVITY_RETENTION_KEEP - only the latest this many events of each record are kept, along
+  with its oldest (as when truncating a single record's activity stream).
+
+The records are worked through in order of id, COMPACTION_BATCH_SIZE at a time, reading only
+the ids and events of their activities and deleting the ones to go in bulk. Each batch is
+committed along with a checkpoint (kept in the 'statistics' table), so that a run that is
+stopped carries on from where it got to, unless the rules have changed in the meantime.
+
+The activity counts, if kept, are adjusted in the same transaction, and the stored activity
+stream pages holding any removed activity are deleted. The activity time index needs no
+change - see flaskapp.storage_utilities.activity_times.
+"""
+
+CHECKPOINT = "activity-compaction"
+# The most activity ids in one DELETE
+_DELETE_CHUNK = 1000
+
+
+def retention_rules(keep=None, collapse_updates=None, deleted_days=None):
+    """The rules to apply, from the app config unless given"""
+    config = current_app.config
+    return {
+        "keep": config["ACTIVITY_RETENTION_KEEP"] if keep is None else keep,
+        "collapse_updates": (
+            config["ACTIVITY_COLLAPSE_UPDATES"]
+            if collapse_updates is None
+            else collapse_updates
+        ),
+        "deleted_days": (
+            config["ACTIVITY_RETENTION_DELETED_DAYS"]
+            if deleted_days is None
+            else deleted_days
+        ),
+    }
+
+
+def activities_to_remove(events, rules, expired=False):
+    """The ids to remove from one record's activity stream, given its (id, event) pairs oldest
+    first, and whether the record was deleted long enough ago to remove them all"""
+    if expired:
+        return [activity_id for activity_id, _ in events]
+
+    kept = events
+    if rules["collapse_updates"]:
+        update = Event.Update.name
+        kept = [
+            (activity_id, event)
+            for idx, (activity_id, event) in enumerate(kept)
+            if not (
+                event == update and idx + 1 < len(kept) and kept[idx + 1][1] == update
+            )
+        ]
+    if 0 < rules["keep"] < len(kept):
+        kept = kept[:1] + kept[-rules["keep"] :]
+
+    kept_ids = {activity_id for activity_id, _ in kept}
+    return [activity_id for activity_id, _ in events if activity_id not in kept_ids]
+
+
+def _remove_activities(removed_ids, removed):
+    invalidate_type_index(removed_ids)
+    for start in range(0, len(removed_ids), _DELETE_CHUNK):
+        db.session.query(Activity).filter(
+            Activity.id.in_(removed_ids[start : start + _DELETE_CHUNK])
+        ).delete(synchronize_session=False)
+    note_removed_activities(db.session, removed)
+    invalidate_activity_pages(removed_ids)
+
+
+def compact_activities(rules, batch_size, restart=False):
+    """Apply the retention rules to every record's activity stream, a batch of records at a
+    time, yielding the progress so far after each batch"""
+    progress = {"last_record_id": 0, "records": 0, "removed": 0}
+    checkpoint = None if restart else load_stats(CHECKPOINT)
+    if (
+        checkpoint is not None
+        and not checkpoint.get("complete")
+        and checkpoint.get("rules") == rules
+    ):
+        progress.update(checkpoint)
+    progress["rules"] = rules
+    progress["complete"] = False
+
+    cutoff = None
+    if rules["deleted_days"] > 0:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=rules["deleted_days"])
+
+    while True:
+        record_ids = [
+            x
+            for (x,) in db.session.query(Record.id)
+            .filter(Record.id > progress["last_record_id"])
+            .order_by(Record.id)
+            .limit(batch_size)
+        ]
+        if not record_ids:
+            break
+
+        expired = set()
+        if cutoff is not None:
+            expired = {
+                x
+                for (x,) in db.session.query(Record.id).filter(
+                    Record.id.in_(record_ids), Record.datetime_deleted < cutoff
+                )
+            }
+        streams = defaultdict(list)
+        for activity_id, record_id, event in (
+            db.session.query(Activity.id, Activity.record_id, Activity.event)
+            .filter(Activity.record_id.in_(record_ids))
+            .order_by(Activity.id)
+        ):
+            streams[record_id].append((activity_id, event))
+
+        removed = Counter()
+        removed_ids = []
+        for record_id, events in streams.items():
+            if ids := activities_to_remove(events, rules, record_id in expired):
+                removed[record_id] = len(ids)
+                removed_ids.extend(ids)
+        if removed_ids:
+            _remove_activities(removed_ids, removed)
+
+        progress["last_record_id"] = record_ids[-1]
+        progress["records"] += len(record_ids)
+        progress["removed"] += len(removed_ids)
+        # The checkpoint is committed along with the batch it records
+        record_stats(CHECKPOINT, progress)
+        db.session.commit()
+        db.session.expunge_all()
+        yield dict(progress)
+
+    progress["complete"] = True
+    record_stats(CHECKPOINT, progress)
+    db.session.commit()
+    yield dict(progress)
@@ -0,0 +1,35 @@
+from sqlalchemy import insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+def increment_counts(session, model, key_columns, count_column, changes):
+    """Add each change to the count_column of the model's row with those key_columns values,
+    creating the rows that do not exist yet. changes is {(key values): change}, and the key
+    columns must have a unique constraint."""
+    if not changes:
+        return
+    # Always in the same order, so that concurrent commits cannot deadlock on the rows
+    rows = [
+        {**dict(zip(key_columns, key)), count_column: change}
+        for key, change in sorted(changes.items())
+    ]
+    count = getattr(model, count_column)
+
+    dialect = session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        upsert = (postgresql if dialect == "postgresql" else sqlite).insert(model)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={count_column: count + upsert.excluded[count_column]},
+        )
+        session.execute(upsert, rows)
+        return
+
+    for row in rows:
+        updated = session.execute(
+            update(model)
+            .where(*[getattr(model, k) == row[k] for k in key_columns])
+            .values({count_column: count + row[count_column]})
+        )
+        if updated.rowcount == 0:
+            session.execute(insert(model), [row])
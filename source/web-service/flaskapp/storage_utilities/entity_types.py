@@ -0,0 +1,127 @@
+import os
+import threading
+
+from collections import Counter
+
+from sqlalchemy import event, func, case, select, insert
+
+from flaskapp.models import db
+from flaskapp.models.entity_type import EntityType
+from flaskapp.models.record import Record
+from flaskapp.storage_utilities.counters import increment_counts
+
+"""
+Entity type registry
+--------------------
+
+The 'entity_types' table holds every entity type that records have been ingested with, and
+the number of current (not deleted) records of each. Ingests note the records they create,
+delete or bring back, and the counts are adjusted as the transaction commits, in the same way
+as the activity counts (see flaskapp.storage_utilities.activity_counts).
+
+Each worker caches the set of known types, lowercased, for checking the type in activity
+stream requests. A type is only ever added to the registry, so the highest id in the table
+serves as its version number: the cache is only reloaded when a type that is not in it is
+asked for, and the version shows that the registry has changed since it was loaded.
+
+`flask records entity-types` recounts the registry from the records table.
+"""
+
+_DELTAS_KEY = "entity_type_deltas"
+
+# The pid is kept so that a cache is never carried across a fork.
+_CACHE = {"pid": None, "version": None, "types": frozenset()}
+_LOCK = threading.Lock()
+
+
+def note_record_count(entity_type, change):
+    """Count a record of this type as created (+1) or deleted (-1), when the session commits"""
+    if entity_type and isinstance(entity_type, str):
+        db.session.info.setdefault(_DELTAS_KEY, Counter())[entity_type] += change
+
+
+@event.listens_for(db.session, "before_commit")
+def _apply_record_counts(session):
+    deltas = session.info.pop(_DELTAS_KEY, None)
+    if deltas:
+        increment_counts(
+            session,
+            EntityType,
+            ["entity_type"],
+            "num_records",
+            {(entity_type,): change for entity_type, change in deltas.items()},
+        )
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def _forget_record_counts(session, previous_transaction):
+    session.info.pop(_DELTAS_KEY, None)
+
+
+def registry_version():
+    return db.session.query(func.max(EntityType.id)).scalar() or 0
+
+
+def _load_registry():
+    version = registry_version()
+    types = frozenset(
+        entity_type.lower()
+        for (entity_type,) in db.session.query(EntityType.entity_type)
+    )
+    with _LOCK:
+        _CACHE.update(pid=os.getpid(), version=version, types=types)
+    return types
+
+
+def known_entity_types():
+    """The lowercased entity types in the registry, from this worker's cache"""
+    if _CACHE["pid"] != os.getpid():
+        return _load_registry()
+    return _CACHE["types"]
+
+
+def is_known_entity_type(entity_type):
+    """Is the (lowercased) type in the registry? Only a type that is not already in this
+    worker's cache costs a query, and the registry is only reloaded if it has changed.
+    """
+    if entity_type in known_entity_types():
+        return True
+    if registry_version() != _CACHE["version"]:
+        return entity_type in _load_registry()
+    return False
+
+
+def entity_type_counts():
+    """[(entity_type, number of current records)] for each type that has any records, most
+    records first"""
+    return (
+        db.session.query(EntityType.entity_type, EntityType.num_records)
+        .filter(EntityType.num_records > 0)
+        .order_by(EntityType.num_records.desc(), EntityType.entity_type)
+        .all()
+    )
+
+
+def recount_entity_types():
+    """Replace the registry with a fresh count of the records table"""
+    db.session.info.pop(_DELTAS_KEY, None)
+    db.session.query(EntityType).delete(synchronize_session=False)
+    db.session.execute(
+        insert(EntityType).from_select(
+            ["entity_type", "num_records"],
+            select(
+                Record.entity_type,
+                func.sum(case((Record.datetime_deleted == None, 1), else_=0)),
+            )
+            .filter(Record.entity_type != None)
+            .group_by(Record.entity_type),
+        )
+    )
+    db.session.commit()
+    reset_entity_type_cache()
+
+
+def reset_entity_type_cache():
+    """Drop this worker's cache, eg when the database has been replaced"""
+    with _LOCK:
+        _CACHE.update(pid=None, version=None, types=frozenset())
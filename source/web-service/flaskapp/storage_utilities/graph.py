@@ -20,6 +20,7 @@ from pyld.jsonld import JsonLdError
 
 from flaskapp.base_graph_utils import base_graph_filter, get_url_prefixes_from_context
 from flaskapp.graph_prefix_bindings import get_bound_graph
+from flaskapp.offload import run_cpu_bound, OffloadError
 
 
 # RDF processing
@@ -81,7 +82,28 @@ def graph_check_endpoint(query_endpoint):
         return False
 
 
-def graph_expand(data, proc=None):
+# The pure-CPU parts of the graph expansion are kept free of the app context, so that they
+# can be run in the offload process pool (see flaskapp.offload)
+def jsonld_to_nquads(data, rdf_docloader=None):
+    proc = jsonld.JsonLdProcessor()
+    return proc.to_rdf(
+        data,
+        {
+            "format": "application/n-quads",
+            "documentLoader": rdf_docloader,
+        },
+    )
+
+
+def rdflib_to_nquads(data, identifier=None):
+    g = get_bound_graph(identifier=identifier)
+    g.parse(data=json.dumps(data), format="json-ld")
+    if len(g) == 0:
+        return None
+    return g.serialize(format="nquads")
+
+
+def graph_expand(data):
     json_ld_cxt = None
     json_ld_id = None
     json_ld_type = None
@@ -107,23 +129,22 @@ def graph_expand(data, proc=None):
     if current_app.config["USE_PYLD_REFORMAT"] is True:
         current_app.logger.info(f"{json_ld_id} - expanding using PyLD")
         try:
-            if proc is None:
-                proc = jsonld.JsonLdProcessor()
-
             current_app.logger.debug(
                 f"{json_ld_id} - PyLD parsing START at timecode {time.perf_counter() - tictoc}"
             )
-            serialized_nt = proc.to_rdf(
+            # In the offload pool, as ingests and reads alike would otherwise block here
+            serialized_nt = run_cpu_bound(
+                jsonld_to_nquads,
                 data,
-                {
-                    "format": "application/n-quads",
-                    "documentLoader": current_app.config["RDF_DOCLOADER"],
-                },
+                rdf_docloader=current_app.config["RDF_DOCLOADER"],
             )
 
             current_app.logger.debug(
                 f"{json_ld_id} - PyLD parsing END at timecode {time.perf_counter() - tictoc}"
             )
+        except OffloadError:
+            # Not a problem with the data - let the request fail with a 503
+            raise
         except Exception as e:
             current_app.logger.error(
                 "Graph expansion error of type '%s' for %s (%s): %s"
@@ -172,17 +193,16 @@ def graph_expand(data, proc=None):
         current_app.logger.debug(
             f"{json_ld_id} - RDFLIB parsing START at timecode {time.perf_counter() - tictoc}"
         )
-        g = get_bound_graph(identifier=json_ld_id)
-        g.parse(data=json.dumps(data), format="json-ld")
+        serialized_nt = run_cpu_bound(rdflib_to_nquads, data, identifier=json_ld_id)
         current_app.logger.debug(
-            f"{json_ld_id} - RDFLIB parsing END, START serialization at timecode {time.perf_counter() - tictoc}"
+            f"{json_ld_id} - RDFLIB parsing and serialization END at timecode {time.perf_counter() - tictoc}"
         )
-        if len(g) == 0:
+        if serialized_nt is None:
             current_app.logger.error(
                 f"No suitable quads or triples were parsed from the supplied JSON-LD. Is {json_ld_id} actually JSON-LD?"
             )
             return False
-        return g.serialize(format="nquads")
+        return serialized_nt
 
 
 def graph_replace(
@@ -343,7 +363,6 @@ def revert_triplestore_if_possible(list_of_relative_ids: list, timeout: int = 45
     query_endpoint = current_app.config["SPARQL_QUERY_ENDPOINT"]
     update_endpoint = current_app.config["SPARQL_UPDATE_ENDPOINT"]
 
-    proc = None
     results = {}
 
     for relative_id in list_of_relative_ids:
@@ -381,7 +400,7 @@ def revert_triplestore_if_possible(list_of_relative_ids: list, timeout: int = 45
                             data=record_obj.data, id_attr=id_attr
                         )
 
-                        nt = graph_expand(data, proc=proc)
+                        nt = graph_expand(data)
                         if nt is False:
                             current_app.logger.warning(
                                 f"REVERT: Attempted to revert {relative_id} to DB version, JSON-LD failed to expand. Skipping."
@@ -0,0 +1,137 @@
+import base64
+import binascii
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.orm import load_only
+
+from flaskapp.models import db
+from flaskapp.models.record import Record
+from flaskapp.background import submit
+
+"""
+Prefix listings
+---------------
+
+The 'entity_id*' listing pages through the matching records in entity_id order, using an
+opaque 'after' token holding the last entity_id on the page rather than an OFFSET, so every
+page costs the same however deep it is. The older 'page=N' links (in record id order) are
+still answered as before.
+
+On PostgreSQL the entity_id comparisons, LIKE and ordering are done in the "C" collation, so
+that they can all be served by the ix_records_entity_id_c index whatever the database's
+default collation is.
+
+The total number of matches for each prefix is counted at most once every
+PREFIX_COUNT_TTL seconds by each worker. Once a total is older than that it is still used,
+while a fresh count is made on the background thread (see flaskapp.background).
+"""
+
+# prefix -> (total, time counted)
+_TOTALS = {}
+_REFRESHING = set()
+_TOTALS_SIZE = 1000
+_LOCK = threading.Lock()
+
+
+def encode_after_token(entity_id):
+    return (
+        base64.urlsafe_b64encode(entity_id.encode("utf-8")).decode("ascii").rstrip("=")
+    )
+
+
+def decode_after_token(token):
+    """The entity_id held by an 'after' token. Raises ValueError if it is not a valid token."""
+    try:
+        return base64.b64decode(
+            token + "=" * (-len(token) % 4), altchars=b"-_", validate=True
+        ).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid page token '{token}'") from e
+
+
+def _entity_id_column():
+    if current_app.config["DB_DIALECT"] == "postgresql":
+        return Record.entity_id.collate("C")
+    return Record.entity_id
+
+
+def prefix_listing_query(prefix):
+    """Query for the current (not deleted) records whose entity_id begins with the prefix"""
+    return (
+        db.session.query(Record)
+        .options(
+            load_only(
+                Record.id,
+                Record.entity_id,
+                Record.entity_type,
+                Record.datetime_updated,
+                Record.datetime_deleted,
+            )
+        )
+        .filter(Record.datetime_deleted == None)
+        .filter(_entity_id_column().like(prefix + "%"))
+    )
+
+
+def prefix_listing_after(prefix, after, limit):
+    """Up to limit matching records, in entity_id order, following the entity_id 'after'"""
+    entity_id = _entity_id_column()
+    query = prefix_listing_query(prefix)
+    if after is not None:
+        query = query.filter(entity_id > after)
+    return query.order_by(entity_id).limit(limit).all()
+
+
+def count_prefix(prefix):
+    return (
+        db.session.query(func.count(Record.id))
+        .filter(Record.datetime_deleted == None)
+        .filter(_entity_id_column().like(prefix + "%"))
+        .scalar()
+    )
+
+
+def _store_total(prefix, total):
+    with _LOCK:
+        if len(_TOTALS) >= _TOTALS_SIZE and prefix not in _TOTALS:
+            _TOTALS.clear()
+        _TOTALS[prefix] = (total, time.monotonic())
+
+
+def _refresh_total(prefix):
+    try:
+        _store_total(prefix, count_prefix(prefix))
+    finally:
+        with _LOCK:
+            _REFRESHING.discard(prefix)
+
+
+def cached_prefix_total(prefix):
+    """The number of records matching the prefix, possibly up to PREFIX_COUNT_TTL seconds old
+    (or a little older, while a fresh count is made)"""
+    ttl = current_app.config["PREFIX_COUNT_TTL"]
+    if ttl <= 0:
+        return count_prefix(prefix)
+
+    cached = _TOTALS.get(prefix)
+    if cached is None:
+        total = count_prefix(prefix)
+        _store_total(prefix, total)
+        return total
+
+    total, counted = cached
+    if time.monotonic() - counted >= ttl:
+        with _LOCK:
+            refresh = prefix not in _REFRESHING
+            _REFRESHING.add(prefix)
+        if refresh:
+            submit(_refresh_total, prefix)
+    return total
+
+
+def clear_prefix_totals():
+    with _LOCK:
+        _TOTALS.clear()
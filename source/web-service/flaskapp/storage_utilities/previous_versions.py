@@ -0,0 +1,63 @@
+from flaskapp.models import db
+from flaskapp.models.record import Record, Version
+
+"""
+Previous version pointers
+-------------------------
+
+Each record keeps the entity_id of its latest version (the one most recently made, so the
+highest id) in 'previous_version', so that a GET of the record can give the rel="previous"
+Link header (LINK_HEADER_PREV_VERSION) from the row it has already loaded. It is set by
+record_update and record_delete as they make (or remove) versions, and recomputed from the
+versions table whenever versions are deleted some other way - by DELETE of a version, or by
+the version pruner (see flaskapp.storage_utilities.version_retention). A record with no
+versions has none. 'is_old_version' is always False for a record, as an old version is a
+row in the versions table rather than in 'records'.
+
+The rows stored before these were maintained are filled in, a batch of records at a time,
+by `flask records previous-versions`.
+"""
+
+
+def latest_version(record_id):
+    """The entity_id of the latest version of the record (as a correlated subquery if
+    record_id is a column)"""
+    return (
+        db.session.query(Version.entity_id)
+        .filter(Version.record_id == record_id)
+        .order_by(Version.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def refresh_previous_versions(record_ids):
+    """Recompute the previous_version of the records, as part of the current transaction"""
+    record_ids = list(record_ids)
+    if record_ids:
+        db.session.query(Record).filter(Record.id.in_(record_ids)).update(
+            {"previous_version": latest_version(Record.id), "is_old_version": False},
+            synchronize_session="fetch",
+        )
+
+
+def backfill_previous_versions(batch_size):
+    """Set previous_version and is_old_version on every record, a batch of records at a
+    time, yielding the number of records done after each batch"""
+    completed = 0
+    last_id = 0
+    while True:
+        record_ids = [
+            x
+            for (x,) in db.session.query(Record.id)
+            .filter(Record.id > last_id)
+            .order_by(Record.id)
+            .limit(batch_size)
+        ]
+        if not record_ids:
+            break
+        refresh_previous_versions(record_ids)
+        db.session.commit()
+        last_id = record_ids[-1]
+        completed += len(record_ids)
+        yield completed
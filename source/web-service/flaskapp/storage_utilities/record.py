@@ -2,6 +2,7 @@ import json
 import uuid
 
 from flask import current_app
+from sqlalchemy import cast, Text
 
 from flaskapp.models import db
 from flaskapp.models.record import Record, Version
@@ -18,16 +19,32 @@ from flaskapp.errors import (
     status_ok,
 )
 from flaskapp.utilities import checksum_json, Event
+from flaskapp.storage_utilities.subaddressing import (
+    index_sub_identifiers,
+    remove_sub_identifiers,
+)
+from flaskapp.existence import might_exist, remember_missing, add_to_existence_filter
+from flaskapp.activity_watch import note_new_activity
+from flaskapp.storage_utilities.activity_counts import type_key
+from flaskapp.storage_utilities.entity_types import note_record_count
+from flaskapp.storage_utilities.timemaps import invalidate_timemaps
+from flaskapp.storage_utilities.version_deltas import set_version_data
+
+
+def get_record(rec_id, also_containers=True, use_existence_filter=False):
+    # The existence filter can lag behind records created elsewhere by a few seconds, so only
+    # read-only callers should trust it (see flaskapp.existence)
+    if not use_existence_filter or might_exist(rec_id):
+        if (
+            result := db.session.query(Record)
+            .filter(Record.entity_id == rec_id)
+            .one_or_none()
+        ):
+            return {"record": result}
+        if use_existence_filter:
+            remember_missing(rec_id)
 
-
-def get_record(rec_id, also_containers=True):
-    if (
-        result := db.session.query(Record)
-        .filter(Record.entity_id == rec_id)
-        .one_or_none()
-    ):
-        return {"record": result}
-    elif current_app.config["LDP_BACKEND"] and also_containers:
+    if current_app.config["LDP_BACKEND"] and also_containers:
         # make sure it begins and ends with '/'
         container_id = f"/{rec_id.strip('/')}/"
         if (
@@ -39,6 +56,15 @@ def get_record(rec_id, also_containers=True):
     return None
 
 
+def get_stored_json_text(model, pk):
+    """Get the JSON 'data' of a Record or Version row as the text held in the DB (data::text),
+    without decoding it. Returns None if there is no data (eg a deleted record)"""
+    text = db.session.query(cast(model.data, Text)).filter(model.id == pk).scalar()
+    if text is None or text == "null":
+        return None
+    return text
+
+
 # ### VALIDATION FUNCTIONS ###
 def validate_record_set(record_list):
     """
@@ -84,11 +110,15 @@ def record_create(input_rec, commit=False, process_the_activity=False):
     r.datetime_created = datetime.now(timezone.utc)
     r.datetime_updated = r.datetime_created
     r.datetime_deleted = None
+    note_record_count(r.entity_type, 1)
     r.data = input_rec
     r.checksum = checksum_json(input_rec)
 
     db.session.add(r)
     db.session.flush()
+    add_to_existence_filter([entity_id])
+    if current_app.config["SUBADDRESSING_INDEX"] is True:
+        index_sub_identifiers(r.id, entity_id, input_rec)
 
     if parent_container is not None:
         parent_container.add_to_container(
@@ -123,20 +153,31 @@ def record_update(db_rec, input_rec, commit=False, process_the_activity=False):
         prev.datetime_created = db_rec.datetime_updated
         prev.datetime_updated = db_rec.datetime_updated
         prev.datetime_deleted = db_rec.datetime_deleted
-        prev.data = db_rec.data
+        # In full, or as a patch against the new data
+        set_version_data(prev, db_rec.id, db_rec.data, input_rec)
         prev.checksum = db_rec.checksum
         # Link back to old record
         prev.record = db_rec
         prev.record_id = db_rec.id
 
         db.session.add(prev)
+        db_rec.previous_version = prev_id
+
+    # The TimeMap has a new version, or at least a new 'until' time
+    invalidate_timemaps(db_rec.id)
 
     # With the update to the model, this should be automatic
     # db_rec.datetime_updated = datetime.now(timezone.utc)
     db_rec.data = input_rec
+    if db_rec.datetime_deleted is not None:
+        # Brought back
+        note_record_count(db_rec.entity_type, 1)
     db_rec.datetime_deleted = None
     db_rec.checksum = checksum_json(input_rec)
 
+    if current_app.config["SUBADDRESSING_INDEX"] is True:
+        index_sub_identifiers(db_rec.id, db_rec.entity_id, input_rec, replace=True)
+
     # Will ONLY try to assert the container structure if the autocreate setting is on.
     if (
         current_app.config["LDP_BACKEND"]
@@ -188,6 +229,7 @@ def record_delete(db_rec, input_rec, commit=False, process_the_activity=False):
             prev.record_id = db_rec.id
 
             db.session.add(prev)
+            db_rec.previous_version = prev_id
         else:
             # Hard delete?
             # Remove all old versions?
@@ -195,8 +237,11 @@ def record_delete(db_rec, input_rec, commit=False, process_the_activity=False):
                 f"KEEP_VERSIONS_AFTER_DELETION not enabled: also removing all versions of {db_rec.entity_id}."
             )
 
-            for version in db_rec.versions:
-                db.session.delete(version)
+            db.session.query(Version).filter(Version.record_id == db_rec.id).delete(
+                synchronize_session=False
+            )
+            db.session.expire(db_rec, ["versions"])
+            db_rec.previous_version = None
 
     parent_container = None
     # If LDP backend is enabled, ensure there is a container to add this to:
@@ -214,10 +259,16 @@ def record_delete(db_rec, input_rec, commit=False, process_the_activity=False):
             raise
 
     current_app.logger.debug(f"Deleting {db_rec.entity_id}")
+    invalidate_timemaps(db_rec.id)
     db_rec.data = None
     db_rec.checksum = None
+    if db_rec.datetime_deleted is None:
+        note_record_count(db_rec.entity_type, -1)
     db_rec.datetime_deleted = datetime.now(timezone.utc)
 
+    if current_app.config["SUBADDRESSING_INDEX"] is True:
+        remove_sub_identifiers(db_rec.id)
+
     if parent_container is not None:
         removed_from_container = parent_container.remove_from_container(
             db_rec, db_dialect=current_app.config["DB_DIALECT"]
@@ -239,7 +290,11 @@ def process_activity(prim_key, crud_event, commit=False):
     a.datetime_created = datetime.now(timezone.utc)
     a.record_id = prim_key
     a.event = crud_event.name
+    # The record is normally already in the session, so this does not need a query
+    if (record := db.session.get(Record, prim_key)) is not None:
+        a.entity_type = type_key(record.entity_type) or None
     db.session.add(a)
+    note_new_activity(a)
 
     if commit is True:
         db.session.commit()
@@ -0,0 +1,264 @@
+import gzip
+
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import or_, case
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from flaskapp.models import db
+from flaskapp.models.record import Record
+from flaskapp.models.rendering import Rendering
+from flaskapp.base_graph_utils import get_url_prefixes_from_context
+from flaskapp.conneg import reformat_rdf
+from flaskapp.offload import run_cpu_bound
+from flaskapp.background import submit
+from flaskapp.utilities import prefix_record_ids
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+"""
+Pre-rendered serializations
+---------------------------
+
+When PRERENDER_FORMATS is set (eg "turtle,nt11"), each record that is created or updated by
+an ingest is rendered into those formats once the ingest has committed. This happens on the
+background thread (see flaskapp.background) of the worker that handled the ingest, and the
+results are stored in the 'renderings' table keyed by the record, checksum and format.
+
+entity_record serves a stored rendering when one exists for the record's current checksum.
+On a miss, it renders the record as normal and then stores the result in the background, so
+records ingested before this was switched on are filled in lazily as they are requested.
+
+Renderings are made from the record data after the same id prefixing that entity_record
+applies, with the default RDF library (USE_PYLD_REFORMAT). Requests that ask for something
+else (relativeid, rdflib, a content profile or a subaddressed fragment) are rendered live.
+The 'json-ld' format is the prefixed JSON document itself, exactly as it would be sent.
+
+With PRECOMPRESS_RENDERINGS, gzip and brotli copies of each rendering are stored too (if it
+is at least COMPRESS_MIN_SIZE bytes), and sent as-is to clients that accept that encoding,
+with the encoding added to the ETag ("<checksum>:gzip") just as Flask-Compress does for the
+responses that it compresses on the fly (FLASK_GZIP_COMPRESSION).
+"""
+
+# data is the body to send, str or (if encoding is set) compressed bytes
+StoredRendering = namedtuple("StoredRendering", ["data", "encoding"])
+
+ENCODINGS = ["br", "gzip"]
+
+
+def prerenders(shortformat, use_pyld=None):
+    """Would a rendering of this format, made with this RDF library, be stored?"""
+    return (
+        shortformat in current_app.config["PRERENDER_FORMATS"]
+        and (
+            shortformat == "json-ld"
+            or use_pyld == current_app.config["USE_PYLD_REFORMAT"]
+        )
+        and current_app.config["PREFIX_RECORD_IDS"] != "NONE"
+    )
+
+
+def prefixed_record_data(data):
+    """The record data with its ids prefixed, as entity_record would display them"""
+    attr = "@id" if "@id" in data else "id"
+    urlprefixes = None
+    if current_app.config["PROCESS_RDF"] is True and "@context" in data:
+        urlprefixes = get_url_prefixes_from_context(data["@context"])
+
+    return prefix_record_ids(
+        data,
+        attr,
+        current_app.config["idPrefix"],
+        recursive=current_app.config["PREFIX_RECORD_IDS"] != "TOP",
+        urlprefixes=urlprefixes,
+    )
+
+
+def render_record(record, shortformat):
+    if shortformat == "json-ld":
+        # Serialized as entity_record's response would be
+        return current_app.json.response(prefixed_record_data(record.data)).get_data(
+            as_text=True
+        )
+
+    return run_cpu_bound(
+        reformat_rdf,
+        prefixed_record_data(record.data),
+        shortformat=shortformat,
+        use_pyld=current_app.config["USE_PYLD_REFORMAT"],
+        rdf_docloader=current_app.config["RDF_DOCLOADER"],
+    )
+
+
+def get_rendering(record_id, checksum, shortformat, encoding=None):
+    """Get a StoredRendering, compressed with the given encoding if that copy exists"""
+    query = db.session.query(Rendering.data)
+    if encoding is not None:
+        compressed = getattr(Rendering, f"data_{encoding}")
+        # Only fetch the uncompressed text if there is no compressed copy
+        query = db.session.query(
+            compressed, case((compressed.is_(None), Rendering.data))
+        )
+
+    row = (
+        query.filter(
+            Rendering.record_id == record_id,
+            Rendering.checksum == checksum,
+            Rendering.format == shortformat,
+        )
+        .limit(1)
+        .first()
+    )
+    if row is None:
+        return None
+    if encoding is not None and row[0] is not None:
+        return StoredRendering(row[0], encoding)
+    return StoredRendering(row[-1], None)
+
+
+def find_rendering(record, desired, request):
+    """Return the StoredRendering that answers this request for the record, if there is one"""
+    if not current_app.config["PRERENDER_FORMATS"] or not record.checksum:
+        return None
+
+    if current_app.config["PROCESS_RDF"] is not True:
+        shortformat = "json-ld"
+    else:
+        if not desired.get("accepted_mimetypes") or desired.get("requested_profiles"):
+            return None
+
+        preferred = desired.get("preferred_mimetype", "")
+        if preferred.startswith("application/ld+json") or preferred.startswith(
+            "application/json"
+        ):
+            shortformat = "json-ld"
+        else:
+            _, _, shortformat = desired["accepted_mimetypes"][0]
+
+    use_pyld = (
+        current_app.config["USE_PYLD_REFORMAT"] is True
+        and "rdflib" not in request.values
+    )
+    if not prerenders(shortformat, use_pyld):
+        return None
+
+    encoding = None
+    if current_app.config["PRECOMPRESS_RENDERINGS"] is True:
+        encoding = request.accept_encodings.best_match(ENCODINGS)
+
+    return get_rendering(record.id, record.checksum, shortformat, encoding)
+
+
+def compress_rendering(data):
+    """gzip and brotli copies of the rendering, or None for each if it is not worth doing"""
+    if current_app.config["PRECOMPRESS_RENDERINGS"] is not True:
+        return None, None
+
+    raw = data.encode("utf-8")
+    if len(raw) < current_app.config["COMPRESS_MIN_SIZE"]:
+        return None, None
+
+    # This only happens once per rendering, so use the best compression available
+    return (
+        gzip.compress(raw, compresslevel=9),
+        brotli.compress(raw) if brotli is not None else None,
+    )
+
+
+def store_rendering(record_id, checksum, shortformat, data):
+    """Store a rendering, replacing any of the same format made from an older checksum"""
+    db.session.query(Rendering).filter(
+        Rendering.record_id == record_id,
+        Rendering.format == shortformat,
+        Rendering.checksum != checksum,
+    ).delete(synchronize_session=False)
+
+    data_gzip, data_br = compress_rendering(data)
+    db.session.add(
+        Rendering(
+            record_id=record_id,
+            checksum=checksum,
+            format=shortformat,
+            datetime_created=datetime.now(timezone.utc),
+            data=data,
+            data_gzip=data_gzip,
+            data_br=data_br,
+        )
+    )
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker got there first
+        db.session.rollback()
+
+
+def prerender_records(record_ids):
+    """Render and store the configured formats for each record, pruning stale renderings"""
+    for record_id in record_ids:
+        record = db.session.get(Record, record_id)
+        if record is None:
+            continue
+
+        if record.checksum is None or record.data is None:
+            # Deleted - nothing is current
+            db.session.query(Rendering).filter(Rendering.record_id == record_id).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+            continue
+
+        # storing a rendering commits, so hold on to the checksum this run is for
+        checksum = record.checksum
+        existing = {
+            x
+            for (x,) in db.session.query(Rendering.format).filter(
+                Rendering.record_id == record_id,
+                Rendering.checksum == checksum,
+            )
+        }
+        for shortformat in current_app.config["PRERENDER_FORMATS"]:
+            if shortformat in existing:
+                continue
+            try:
+                data = render_record(record, shortformat)
+            except Exception as e:
+                current_app.logger.error(
+                    f"Could not pre-render {record.entity_id} as {shortformat}: {e}"
+                )
+                continue
+            store_rendering(record_id, checksum, shortformat, data)
+
+
+def prune_renderings():
+    """Remove all renderings made from a checksum that no longer matches their record"""
+    stale = (
+        db.session.query(Rendering.id)
+        .join(Record, Record.id == Rendering.record_id)
+        .filter(or_(Record.checksum == None, Record.checksum != Rendering.checksum))
+    )
+    try:
+        removed = (
+            db.session.query(Rendering)
+            .filter(Rendering.id.in_(stale.scalar_subquery()))
+            .delete(synchronize_session=False)
+        )
+        db.session.commit()
+    except SQLAlchemyError as e:
+        current_app.logger.error(f"Could not prune stale renderings: {e}")
+        db.session.rollback()
+        return 0
+    return removed
+
+
+def schedule_prerender(record_ids):
+    """Render the records in the background, once the calling transaction has committed"""
+    return submit(prerender_records, list(record_ids))
+
+
+def schedule_store_rendering(record_id, checksum, shortformat, data):
+    return submit(store_rendering, record_id, checksum, shortformat, data)
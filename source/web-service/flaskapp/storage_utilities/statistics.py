@@ -0,0 +1,187 @@
+import json
+import math
+import threading
+
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from flaskapp.models import db
+from flaskapp.models.activity import Activity
+from flaskapp.models.record import Record
+from flaskapp.models.statistics import Statistics
+from flaskapp.background import submit
+from flaskapp.storage_utilities.activity_counts import (
+    ALL,
+    TYPE,
+    RECORD,
+    counts_enabled,
+    get_activity_count,
+    type_key,
+)
+from flaskapp.storage_utilities.entity_types import entity_type_counts
+
+"""
+Dashboard statistics
+--------------------
+
+The figures on the /dashboard page (the number of records and changes, the most recently
+changed record of each entity type and so on) are computed together and stored as a JSON
+document in the 'statistics' table, with the time they were computed, which the dashboard
+shows as "stats as of".
+
+A request for the dashboard uses the stored figures. Once they are more than
+DASHBOARD_STATS_TTL seconds old, they are still used, while fresh ones are computed on the
+background thread (see flaskapp.background) - so a request never waits for them, except when
+there are none stored at all. They can also be refreshed on a schedule, with
+`flask records statistics`, eg from a cron job.
+
+The figures are read from the maintained counts where they exist (the entity type registry,
+and the activity counts if ACTIVITY_COUNTS is enabled), and otherwise from the indexes on the
+activities table.
+"""
+
+DASHBOARD = "dashboard"
+
+_REFRESHING = set()
+_LOCK = threading.Lock()
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def _count_activities(scope, key="", **filters):
+    if counts_enabled():
+        return get_activity_count(scope, key)
+    return db.session.query(func.count(Activity.id)).filter_by(**filters).scalar() or 0
+
+
+def compute_dashboard_stats():
+    """The dashboard figures, as a JSON-serializable dict"""
+    last_id, last_change = (
+        db.session.query(Activity.id, Activity.datetime_created)
+        .order_by(Activity.id.desc())
+        .first()
+    ) or (0, None)
+
+    types = entity_type_counts()
+    entities = []
+    for entity_type, num_records in types:
+        key = type_key(entity_type)
+        last_updated = (
+            db.session.query(Activity.datetime_created)
+            .filter(Activity.entity_type == key)
+            .order_by(Activity.id.desc())
+            .limit(1)
+            .scalar()
+        )
+        # The current record of this type with the most recent activity
+        most_recent = (
+            db.session.query(Record.id, Record.entity_id, Record.datetime_updated)
+            .join(Activity, Activity.record_id == Record.id)
+            .filter(
+                Activity.entity_type == key,
+                Record.entity_type == entity_type,
+                Record.datetime_deleted == None,
+            )
+            .order_by(Activity.id.desc())
+            .first()
+        )
+        entity = {
+            "entity_name": entity_type,
+            "num_records": num_records,
+            "num_changes": _count_activities(TYPE, key, entity_type=key),
+            "last_updated": _isoformat(last_updated),
+            "most_recent_rec": None,
+            "most_recent_date": None,
+            "most_recent_num_changes": 0,
+        }
+        if most_recent is not None:
+            record_id, entity_id, updated = most_recent
+            entity["most_recent_rec"] = entity_id
+            entity["most_recent_date"] = _isoformat(updated)
+            entity["most_recent_num_changes"] = _count_activities(
+                RECORD, entity_id, record_id=record_id
+            )
+        entities.append(entity)
+
+    return {
+        "num_records": sum(num_records for _, num_records in types),
+        "num_changes": _count_activities(ALL),
+        "last_change": _isoformat(last_change),
+        "as_last_page": math.ceil(last_id / current_app.config["ITEMS_PER_PAGE"]),
+        "entities": entities,
+    }
+
+
+def record_stats(name, stats):
+    """Add or replace the figures stored under the name, as part of the current transaction.
+    Returns the time they are stored as computed at."""
+    computed = datetime.now(timezone.utc)
+    data = json.dumps(stats)
+    row = db.session.query(Statistics).filter(Statistics.name == name).one_or_none()
+    if row is None:
+        db.session.add(Statistics(name=name, datetime_computed=computed, data=data))
+    else:
+        row.datetime_computed = computed
+        row.data = data
+    return computed
+
+
+def load_stats(name):
+    """The figures stored under the name, or None"""
+    data = db.session.query(Statistics.data).filter(Statistics.name == name).scalar()
+    return json.loads(data) if data is not None else None
+
+
+def store_stats(name, stats):
+    """Store the figures, replacing any already stored under the name. Returns the time they
+    are stored as computed at."""
+    computed = record_stats(name, stats)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker stored it first
+        db.session.rollback()
+    return computed
+
+
+def refresh_dashboard_stats():
+    try:
+        stats = compute_dashboard_stats()
+        return stats, store_stats(DASHBOARD, stats)
+    finally:
+        with _LOCK:
+            _REFRESHING.discard(DASHBOARD)
+
+
+def get_dashboard_stats():
+    """(figures, when they were computed) - possibly up to DASHBOARD_STATS_TTL seconds old (or
+    a little older, while they are refreshed)"""
+    if current_app.config["DASHBOARD_STATS_TTL"] <= 0:
+        return compute_dashboard_stats(), datetime.now(timezone.utc)
+
+    row = (
+        db.session.query(Statistics.data, Statistics.datetime_computed)
+        .filter(Statistics.name == DASHBOARD)
+        .one_or_none()
+    )
+    if row is None:
+        with _LOCK:
+            _REFRESHING.add(DASHBOARD)
+        return refresh_dashboard_stats()
+
+    data, computed = row
+    if computed.tzinfo is None:
+        computed = computed.replace(tzinfo=timezone.utc)
+    age = (datetime.now(timezone.utc) - computed).total_seconds()
+    if age >= current_app.config["DASHBOARD_STATS_TTL"]:
+        with _LOCK:
+            refresh = DASHBOARD not in _REFRESHING
+            _REFRESHING.add(DASHBOARD)
+        if refresh:
+            submit(refresh_dashboard_stats)
+    return json.loads(data), computed
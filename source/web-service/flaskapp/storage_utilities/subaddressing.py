@@ -0,0 +1,157 @@
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.orm import undefer
+
+from flaskapp.models import db
+from flaskapp.models.record import Record
+from flaskapp.models.subaddress import SubIdentifier
+
+"""
+Subaddressing index
+-------------------
+
+When SUBADDRESSING_INDEX is enabled, every id embedded in a record that could be requested
+by subaddressing - that is, one that begins with the record's own id and a '/' -
+is stored in the 'sub_identifiers' table, with the path through the record's data to the
+node it identifies. The rows for a record are replaced when it is updated and removed when
+it is deleted.
+
+A subaddressed request is then answered by an indexed lookup within the nearest possible
+parent record that exists, rather than by searching through that record's data. As with the
+unindexed search, farther parent records are not looked in, and only "id" (not "@id") is
+matched, so that a request gets the same answer whether the index is enabled or not.
+
+If an id appears more than once in a record, the node nearest the top of the document is
+indexed, as that is the one the unindexed search would find.
+"""
+
+
+def find_sub_identifiers(data, record_entity_id):
+    """Returns {embedded id: path} for each subaddressable id within the data"""
+    found = {}
+    if not isinstance(data, dict):
+        return found
+
+    prefix = f"{record_entity_id}/"
+    # (node, path to it, number of object keys along that path)
+    stack = [(data, [], 0)]
+    while stack:
+        node, path, depth = stack.pop()
+        children = []
+        if isinstance(node, dict):
+            value = node.get("id")
+            if (
+                path
+                and isinstance(value, str)
+                and value.startswith(prefix)
+                and (value not in found or depth < found[value][1])
+            ):
+                found[value] = (path, depth)
+            for k, v in node.items():
+                if isinstance(v, (dict, list)):
+                    children.append((v, path + [k], depth + 1))
+        elif isinstance(node, list):
+            for i, v in enumerate(node):
+                if isinstance(v, (dict, list)):
+                    # list indices are not counted in the depth
+                    children.append((v, path + [i], depth))
+        # depth first, in document order
+        stack.extend(reversed(children))
+
+    return {value: path for value, (path, _) in found.items()}
+
+
+def extract_path(data, path):
+    """The node at the path within the data, or None if the path does not lead anywhere"""
+    node = data
+    try:
+        for step in path:
+            node = node[step]
+    except (KeyError, IndexError, TypeError):
+        return None
+    return node if isinstance(node, dict) else None
+
+
+def index_sub_identifiers(record_id, record_entity_id, data, replace=False):
+    """Add the index rows for a record's data, replacing any existing ones if asked"""
+    if replace:
+        remove_sub_identifiers(record_id)
+
+    rows = [
+        {"entity_id": value, "record_id": record_id, "path": path}
+        for value, path in find_sub_identifiers(data, record_entity_id).items()
+    ]
+    if rows:
+        db.session.execute(insert(SubIdentifier), rows)
+    return len(rows)
+
+
+def remove_sub_identifiers(record_id):
+    db.session.query(SubIdentifier).filter(SubIdentifier.record_id == record_id).delete(
+        synchronize_session=False
+    )
+
+
+def lookup_sub_identifier(entity_id, candidates):
+    """Find the node with this id within the nearest of the candidate parent records (given
+    nearest first) that exists. Returns (record, node), or (None, None) - also if that record
+    does not hold the id."""
+    rows = {
+        parent: (record_id, path)
+        for parent, record_id, path in db.session.query(
+            Record.entity_id, Record.id, SubIdentifier.path
+        )
+        .outerjoin(
+            SubIdentifier,
+            (SubIdentifier.record_id == Record.id)
+            & (SubIdentifier.entity_id == entity_id),
+        )
+        .filter(Record.entity_id.in_(candidates), Record.data != None)
+    }
+    parent = next((x for x in candidates if x in rows), None)
+    if parent is None or rows[parent][1] is None:
+        return (None, None)
+
+    record_id, path = rows[parent]
+    record = (
+        db.session.query(Record)
+        .options(undefer(Record.data))
+        .filter(Record.id == record_id)
+        .one()
+    )
+    node = extract_path(record.data, path)
+    if node is None or node.get("id") != entity_id:
+        current_app.logger.error(
+            f"Subaddressing index entry for {entity_id} in {record.entity_id} is out of date"
+        )
+        return (None, None)
+
+    # A copy, as the caller may add a @context to it
+    return (record, dict(node))
+
+
+def rebuild_sub_identifiers(batch_size=100):
+    """Rebuild the index for every record. Yields the running count of records done."""
+    completed = 0
+    last_id = 0
+    while True:
+        batch = (
+            db.session.query(Record)
+            .filter(Record.id > last_id)
+            .options(undefer(Record.data))
+            .order_by(Record.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        for record in batch:
+            index_sub_identifiers(
+                record.id, record.entity_id, record.data, replace=True
+            )
+        db.session.commit()
+        # Keep the session from growing over a long run
+        db.session.expunge_all()
+        last_id = batch[-1].id
+        completed += len(batch)
+        yield completed
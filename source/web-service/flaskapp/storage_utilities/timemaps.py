@@ -0,0 +1,135 @@
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import func, tuple_
+from sqlalchemy.exc import IntegrityError
+
+from flaskapp.models import db
+from flaskapp.models.record import Version
+from flaskapp.models.timemap import TimeMapPage
+
+"""
+TimeMap pages
+-------------
+
+A record's TimeMap lists its versions newest first, TIMEMAP_PAGE_SIZE at a time. Pages are
+read by keyset - the versions before (older than) or after (newer than) a given version, in
+(datetime_updated, entity_id) order, which the ix_versions_chronological_lookup index covers -
+so a page deep into a long history costs no more than the first. Following the Memento paging
+conventions, each page links to the page of older versions with rel="prev" and to the page of
+newer versions with rel="next", and its "self" link gives the span of time it covers.
+
+When TIMEMAP_CACHE is enabled, each page is stored in the 'timemap_pages' table, in each
+format, the first time it is asked for, and sent as stored from then on. A record's stored
+pages are deleted when it is updated or deleted, or one of its versions is deleted.
+
+A page is stored (on the background thread) after it has been rendered, so a change to the
+record can commit in between, and find nothing to delete. So each page is also stored under
+the state of the record it was rendered from, and only a page stored under the record's
+current state is ever sent. The state is that of the record row - its datetime_updated,
+checksum and previous_version (see flaskapp.storage_utilities.previous_versions) - and the
+number of versions with the newest version's id. Version ids only increase, so that changes
+whenever a version is added or removed, including the removals that leave the record row as
+it was (a DELETE of a version other than the latest, or the version pruner). A page left
+behind by such a race is never used, and goes at the record's next change.
+"""
+
+
+def cache_enabled():
+    return current_app.config.get("TIMEMAP_CACHE") is True
+
+
+def version_key(record_id, version_entity_id):
+    """The (datetime_updated, entity_id) of one of the record's versions, or None"""
+    return (
+        db.session.query(Version.datetime_updated, Version.entity_id)
+        .filter(Version.record_id == record_id, Version.entity_id == version_entity_id)
+        .one_or_none()
+    )
+
+
+def version_page(record_id, limit, before=None, after=None):
+    """(the (entity_id, datetime_updated) of a page of versions newest first, are there
+    newer ones, are there older ones) - the page being those just before (older than) or after
+    (newer than) the version key given, or else the newest"""
+    key = tuple_(Version.datetime_updated, Version.entity_id)
+    query = db.session.query(Version.entity_id, Version.datetime_updated).filter(
+        Version.record_id == record_id
+    )
+    if after is not None:
+        # The oldest of those newer than the key, turned around
+        rows = (
+            query.filter(key > tuple_(*after))
+            .order_by(Version.datetime_updated, Version.entity_id)
+            .limit(limit + 1)
+            .all()
+        )
+        return rows[:limit][::-1], len(rows) > limit, True
+
+    if before is not None:
+        query = query.filter(key < tuple_(*before))
+    rows = (
+        query.order_by(Version.datetime_updated.desc(), Version.entity_id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    return rows[:limit], before is not None, len(rows) > limit
+
+
+def record_state(record):
+    """What a stored page of the record's TimeMap is only good for - given the record with
+    its datetime_updated, checksum and previous_version loaded"""
+    count, newest = (
+        db.session.query(func.count(Version.id), func.max(Version.id))
+        .filter(Version.record_id == record.id)
+        .one()
+    )
+    updated = record.datetime_updated.isoformat() if record.datetime_updated else ""
+    return (
+        f"{updated}|{record.checksum or ''}|{record.previous_version or ''}"
+        f"|{count}|{newest or ''}"
+    )
+
+
+def get_stored_timemap(record_id, state, uri, fmt):
+    return (
+        db.session.query(TimeMapPage.data)
+        .filter(
+            TimeMapPage.record_id == record_id,
+            TimeMapPage.uri == uri,
+            TimeMapPage.format == fmt,
+            TimeMapPage.state == state,
+        )
+        .scalar()
+    )
+
+
+def store_timemap(record_id, state, uri, fmt, text):
+    db.session.add(
+        TimeMapPage(
+            record_id=record_id,
+            uri=uri,
+            format=fmt,
+            state=state,
+            datetime_created=datetime.now(timezone.utc),
+            data=text,
+        )
+    )
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker stored it first, or the record has gone
+        db.session.rollback()
+
+
+def invalidate_timemaps(record_id):
+    """Delete the record's stored TimeMap pages, as part of the current transaction"""
+    if cache_enabled():
+        db.session.query(TimeMapPage).filter(TimeMapPage.record_id == record_id).delete(
+            synchronize_session=False
+        )
+
+
+def clear_timemaps():
+    db.session.query(TimeMapPage).delete(synchronize_session=False)
+    db.session.commit()
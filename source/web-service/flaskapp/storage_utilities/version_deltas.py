@@ -0,0 +1,331 @@
+import copy
+import json
+import threading
+
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import cast, Text
+
+from flaskapp.models import db
+from flaskapp.models.record import Record, Version
+
+"""
+Delta-compressed versions
+-------------------------
+
+When VERSION_DELTAS is enabled, record_update keeps the outgoing data of a record as a JSON
+patch (RFC 6902 add/remove/replace operations) that turns the next newer state of the
+record - the next newer version, or else the current record itself - back into it, rather
+than as a full copy. RFC 6902 leaves the order of an object's keys alone, and an added key
+goes at the end, so where that would not give the keys in their original order the patch
+also has an "order" operation listing them, and the object is rebuilt in that order. A
+rebuilt version then serializes to the same JSON text as the data it was made from. Such a version has is_delta set, and its 'data' column holds the
+patch. Each VERSION_SNAPSHOT_INTERVAL-th version is still kept in full, so that any version
+can be rebuilt by applying at most that many patches, working back from the nearest full
+state newer than it. The versions of a record are chained in order of id.
+
+The chain holds as long as every change to a record's data leaves a version behind, which
+it does while KEEP_LAST_VERSION is on. Deleting a version in the middle of a chain first
+stores the next older version in full (see unlink_version), as it was relative to the one
+being removed, and pruning versions in bulk does the same (see unlink_versions). Turning
+VERSION_DELTAS off again only stops new versions being made as patches - the existing ones
+are read as before.
+
+Rebuilt versions are kept in a per-process LRU cache of VERSION_CACHE_SIZE entries, as JSON
+text, keyed by the version's entity_id. A version never changes once made, so the cache
+needs no invalidation.
+
+`flask records version-deltas` converts the versions already stored, a batch of records at
+a time - and with `--full`, converts them all back to full copies.
+"""
+
+_CACHE = OrderedDict()
+_LOCK = threading.Lock()
+# The most versions read at once while looking for a full one
+_CHAIN_BATCH = 50
+
+
+def deltas_enabled():
+    return current_app.config.get("VERSION_DELTAS") is True
+
+
+# JSON patches ----------------------------
+def _escape(token):
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token):
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def _equal(a, b):
+    # As ==, but telling apart True from 1 and 1 from 1.0, as JSON does
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        # Keys in the same order, too
+        return list(a) == list(b) and all(_equal(v, b[k]) for k, v in a.items())
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_equal(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def _diff(src, dst, path, ops):
+    if _equal(src, dst):
+        return
+    if isinstance(src, dict) and isinstance(dst, dict):
+        for key in src:
+            if key not in dst:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in dst.items():
+            if key in src:
+                _diff(src[key], value, f"{path}/{_escape(key)}", ops)
+            else:
+                ops.append(
+                    {"op": "add", "path": f"{path}/{_escape(key)}", "value": value}
+                )
+        # The order the keys would be left in by the removals and additions
+        kept = [key for key in src if key in dst] + [
+            key for key in dst if key not in src
+        ]
+        if kept != list(dst):
+            ops.append({"op": "order", "path": path, "keys": list(dst)})
+    elif isinstance(src, list) and isinstance(dst, list):
+        # Only the part between the common start and end of the lists has changed
+        shortest = min(len(src), len(dst))
+        start = 0
+        while start < shortest and _equal(src[start], dst[start]):
+            start += 1
+        end = 0
+        while end < shortest - start and _equal(src[-1 - end], dst[-1 - end]):
+            end += 1
+        old, new = src[start : len(src) - end], dst[start : len(dst) - end]
+        common = min(len(old), len(new))
+        for idx in range(common):
+            _diff(old[idx], new[idx], f"{path}/{start + idx}", ops)
+        # Removed from the end backwards, so that the indexes still to be removed hold
+        for idx in reversed(range(common, len(old))):
+            ops.append({"op": "remove", "path": f"{path}/{start + idx}"})
+        for idx in range(common, len(new)):
+            ops.append(
+                {"op": "add", "path": f"{path}/{start + idx}", "value": new[idx]}
+            )
+    else:
+        ops.append({"op": "replace", "path": path, "value": dst})
+
+
+def make_patch(src, dst):
+    """The list of operations that turns src into dst"""
+    ops = []
+    _diff(src, dst, "", ops)
+    return ops
+
+
+def apply_patch(doc, ops):
+    """A copy of doc with the operations applied"""
+    doc = copy.deepcopy(doc)
+    for op in ops:
+        tokens = [_unescape(x) for x in op["path"].split("/")[1:]]
+        if op["op"] == "order":
+            target = doc
+            for token in tokens:
+                target = (
+                    target[int(token)] if isinstance(target, list) else target[token]
+                )
+            # Re-inserting the keys in place, so the object keeps its identity
+            values = {key: target.pop(key) for key in op["keys"]}
+            target.update(values)
+            continue
+        if not tokens:
+            doc = copy.deepcopy(op["value"])
+            continue
+        parent = doc
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+        key = tokens[-1]
+        if isinstance(parent, list):
+            key = int(key)
+            if op["op"] == "add":
+                parent.insert(key, copy.deepcopy(op["value"]))
+                continue
+        if op["op"] == "remove":
+            del parent[key]
+        else:
+            parent[key] = copy.deepcopy(op["value"])
+    return doc
+
+
+# Storing ----------------------------
+def _wants_snapshot(record_id, interval):
+    """Would a new version of the record be the one to keep in full? - it is if the
+    interval - 1 versions before it are all patches"""
+    if interval <= 1:
+        return True
+    recent = [
+        is_delta
+        for (is_delta,) in db.session.query(Version.is_delta)
+        .filter(Version.record_id == record_id)
+        .order_by(Version.id.desc())
+        .limit(interval - 1)
+    ]
+    return len(recent) == interval - 1 and all(recent)
+
+
+def set_version_data(version, record_id, data, newer_data):
+    """Set the data of a new version of the record - given the record's data as the version
+    holds it, and its data now - as a patch if VERSION_DELTAS is enabled and it is not the
+    version to keep in full"""
+    version.data = data
+    version.is_delta = False
+    if (
+        deltas_enabled()
+        and isinstance(data, dict)
+        and isinstance(newer_data, dict)
+        and not _wants_snapshot(
+            record_id, current_app.config["VERSION_SNAPSHOT_INTERVAL"]
+        )
+    ):
+        version.data = make_patch(newer_data, data)
+        version.is_delta = True
+
+
+# Reading ----------------------------
+def _rebuild(record_id, version_id):
+    """The data of a version stored as a patch, by working back from the nearest full state"""
+    patches = []
+    base = None
+    after = version_id - 1
+    while True:
+        rows = (
+            db.session.query(Version.id, Version.is_delta, Version.data)
+            .filter(Version.record_id == record_id, Version.id > after)
+            .order_by(Version.id)
+            .limit(_CHAIN_BATCH)
+            .all()
+        )
+        full = next((row for row in rows if not row.is_delta), None)
+        patches += [row.data for row in rows if full is None or row.id < full.id]
+        if full is not None:
+            base = full.data
+            break
+        if len(rows) < _CHAIN_BATCH:
+            # Patched all the way from the record as it is now
+            base = db.session.query(Record.data).filter(Record.id == record_id).scalar()
+            break
+        after = rows[-1].id
+
+    data = base
+    for patch in reversed(patches):
+        data = apply_patch(data, patch)
+    return data
+
+
+def version_text(version):
+    """The data of a version as JSON text, rebuilding it if need be. None if it has none."""
+    if not version.is_delta:
+        text = (
+            db.session.query(cast(Version.data, Text))
+            .filter(Version.id == version.id)
+            .scalar()
+        )
+        return None if text is None or text == "null" else text
+
+    with _LOCK:
+        if (text := _CACHE.get(version.entity_id)) is not None:
+            _CACHE.move_to_end(version.entity_id)
+            return text
+
+    text = json.dumps(_rebuild(version.record_id, version.id))
+    with _LOCK:
+        _CACHE[version.entity_id] = text
+        while len(_CACHE) > current_app.config["VERSION_CACHE_SIZE"]:
+            _CACHE.popitem(last=False)
+    return text
+
+
+def version_data(version):
+    """The data of a version, rebuilding it if need be"""
+    if not version.is_delta:
+        return version.data
+    text = version_text(version)
+    return json.loads(text) if text is not None else None
+
+
+def unlink_version(version):
+    """Before the version is deleted, store the next older one (if that is a patch against
+    it) in full"""
+    older = (
+        db.session.query(Version)
+        .filter(Version.record_id == version.record_id, Version.id < version.id)
+        .order_by(Version.id.desc())
+        .first()
+    )
+    if older is not None and older.is_delta:
+        older.data = version_data(older)
+        older.is_delta = False
+
+
+def unlink_versions(record_id, chain, removed):
+    """Before the versions with the ids in removed are deleted in bulk, store in full each of
+    the others that is a patch against one of them - chain being the (id, is_delta) of all
+    the record's versions, in order of id"""
+    for (version_id, is_delta), (newer_id, _) in zip(chain, chain[1:]):
+        if is_delta and version_id not in removed and newer_id in removed:
+            db.session.query(Version).filter(Version.id == version_id).update(
+                {"data": _rebuild(record_id, version_id), "is_delta": False},
+                synchronize_session=False,
+            )
+
+
+def convert_versions(batch_size, deltas=True):
+    """Store the versions of every record as patches, as record_update would have (or, if not
+    deltas, all in full), a batch of records at a time. Yields the number of records done
+    after each batch."""
+    interval = current_app.config["VERSION_SNAPSHOT_INTERVAL"]
+    completed = 0
+    last_id = 0
+    while True:
+        record_ids = [
+            x
+            for (x,) in db.session.query(Version.record_id)
+            .filter(Version.record_id > last_id)
+            .group_by(Version.record_id)
+            .order_by(Version.record_id)
+            .limit(batch_size)
+        ]
+        if not record_ids:
+            break
+
+        records = dict(
+            db.session.query(Record.id, Record.data).filter(Record.id.in_(record_ids))
+        )
+        chains = {}
+        for version in (
+            db.session.query(Version)
+            .filter(Version.record_id.in_(record_ids))
+            .order_by(Version.id)
+        ):
+            chains.setdefault(version.record_id, []).append(version)
+
+        for record_id, versions in chains.items():
+            # Everything in full first, as the patches are made from the full data
+            states = [version_data(v) for v in versions] + [records.get(record_id)]
+            for idx, version in enumerate(versions):
+                data, newer_data = states[idx], states[idx + 1]
+                version.is_delta = False
+                version.data = data
+                if (
+                    deltas
+                    and (idx + 1) % interval
+                    and isinstance(data, dict)
+                    and isinstance(newer_data, dict)
+                ):
+                    version.data = make_patch(newer_data, data)
+                    version.is_delta = True
+
+        db.session.commit()
+        db.session.expunge_all()
+        last_id = record_ids[-1]
+        completed += len(record_ids)
+        yield completed
@@ -0,0 +1,185 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+
+from flaskapp.models import db
+from flaskapp.models.record import Version
+from flaskapp.storage_utilities.previous_versions import refresh_previous_versions
+from flaskapp.storage_utilities.timemaps import invalidate_timemaps
+from flaskapp.storage_utilities.version_deltas import unlink_versions
+
+"""
+Version retention
+-----------------
+
+`flask records prune-versions` removes old versions of records (see KEEP_LAST_VERSION),
+according to these retention rules (each off by default):
+
+* VERSION_RETENTION_MAX - only the latest this many versions of each record are kept.
+* VERSION_RETENTION_MAX_AGE - versions made more than this many days ago are removed.
+* VERSION_THINNING - a schedule of `<days>:<period>` steps, eg "7:daily,90:monthly": of the
+  versions more than 7 days old, only the latest of each day is kept, and of those more than
+  90 days old, only the latest of each month. The periods are hourly, daily, weekly,
+  monthly and yearly.
+
+A version is kept only if every rule keeps it. The records are worked through in order of
+id, VERSION_PRUNE_BATCH_SIZE at a time, reading only the ids and times of their versions
+and deleting the ones to go in bulk, one transaction per batch. A run that is stopped can
+simply be started again, eg from a cron job.
+
+A version stored as a patch (VERSION_DELTAS) against one that is removed is first stored in
+full, so that it can still be rebuilt. The stored TimeMap pages of every record that lost
+a version are deleted, and its previous_version pointer is recomputed.
+"""
+
+# The most version ids in one DELETE
+_DELETE_CHUNK = 1000
+
+# The bucket a version falls into for each thinning period
+PERIODS = {
+    "hourly": lambda dt: (dt.date(), dt.hour),
+    "daily": lambda dt: dt.date(),
+    "weekly": lambda dt: tuple(dt.isocalendar())[:2],
+    "monthly": lambda dt: (dt.year, dt.month),
+    "yearly": lambda dt: dt.year,
+}
+
+
+def parse_thinning(value):
+    """The (days, period) steps of a thinning schedule such as "7:daily,90:monthly". Raises
+    ValueError if it is not one."""
+    steps = []
+    for step in (value or "").split(","):
+        if not step.strip():
+            continue
+        days, _, period = step.partition(":")
+        period = period.strip().lower()
+        if period not in PERIODS:
+            raise ValueError(f"'{step}' is not <days>:<one of {', '.join(PERIODS)}>")
+        steps.append((int(days), period))
+    return sorted(steps)
+
+
+def retention_policy(max_versions=None, max_age=None, thinning=None):
+    """The rules to apply, from the app config unless given"""
+    config = current_app.config
+    return {
+        "max_versions": (
+            config["VERSION_RETENTION_MAX"] if max_versions is None else max_versions
+        ),
+        "max_age": config["VERSION_RETENTION_MAX_AGE"] if max_age is None else max_age,
+        "thinning": config["VERSION_THINNING"] if thinning is None else thinning,
+    }
+
+
+def policy_set(policy):
+    return bool(
+        policy["max_versions"] > 0 or policy["max_age"] > 0 or policy["thinning"]
+    )
+
+
+def _aware(value):
+    # sqlite hands back naive datetimes, which are stored as UTC
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def versions_to_prune(versions, policy, now):
+    """The ids to remove of one record's versions, given their (id, datetime_updated) pairs
+    newest first"""
+    cutoff = None
+    if policy["max_age"] > 0:
+        cutoff = now - timedelta(days=policy["max_age"])
+    # The oldest step that a version is past is the one that applies to it
+    steps = [
+        (now - timedelta(days=days), days, period)
+        for days, period in policy["thinning"]
+    ]
+    steps.sort()
+
+    removed = []
+    seen = set()
+    for rank, (version_id, updated) in enumerate(versions):
+        updated = _aware(updated)
+        if 0 < policy["max_versions"] <= rank or (
+            cutoff is not None and updated < cutoff
+        ):
+            removed.append(version_id)
+            continue
+        for since, days, period in steps:
+            if updated < since:
+                bucket = (days, PERIODS[period](updated))
+                if bucket in seen:
+                    removed.append(version_id)
+                else:
+                    seen.add(bucket)
+                break
+    return removed
+
+
+def _remove_versions(removed_ids):
+    for start in range(0, len(removed_ids), _DELETE_CHUNK):
+        db.session.query(Version).filter(
+            Version.id.in_(removed_ids[start : start + _DELETE_CHUNK])
+        ).delete(synchronize_session=False)
+
+
+def prune_versions(policy, batch_size):
+    """Apply the retention rules to the versions of every record, a batch of records at a
+    time, yielding the progress so far after each batch"""
+    progress = {"records": 0, "removed": 0}
+    now = datetime.now(timezone.utc)
+    last_id = 0
+    while True:
+        record_ids = [
+            x
+            for (x,) in db.session.query(Version.record_id)
+            .filter(Version.record_id > last_id)
+            .group_by(Version.record_id)
+            .order_by(Version.record_id)
+            .limit(batch_size)
+        ]
+        if not record_ids:
+            break
+
+        chains = defaultdict(list)
+        for version_id, record_id, updated, is_delta in (
+            db.session.query(
+                Version.id,
+                Version.record_id,
+                Version.datetime_updated,
+                Version.is_delta,
+            )
+            .filter(Version.record_id.in_(record_ids))
+            .order_by(Version.id)
+        ):
+            chains[record_id].append((version_id, updated, bool(is_delta)))
+
+        removed_ids = []
+        pruned = []
+        for record_id, chain in chains.items():
+            newest_first = sorted(
+                ((version_id, updated) for version_id, updated, _ in chain),
+                key=lambda x: (_aware(x[1]), x[0]),
+                reverse=True,
+            )
+            removed = versions_to_prune(newest_first, policy, now)
+            if removed:
+                unlink_versions(
+                    record_id,
+                    [(version_id, is_delta) for version_id, _, is_delta in chain],
+                    set(removed),
+                )
+                invalidate_timemaps(record_id)
+                removed_ids.extend(removed)
+                pruned.append(record_id)
+        if removed_ids:
+            _remove_versions(removed_ids)
+            refresh_previous_versions(pruned)
+
+        db.session.commit()
+        db.session.expunge_all()
+        last_id = record_ids[-1]
+        progress["records"] += len(record_ids)
+        progress["removed"] += len(removed_ids)
+        yield dict(progress)
@@ -1,4 +1,6 @@
 import copy
+import email.utils
+import functools
 import json
 import hashlib
 import traceback
@@ -6,6 +8,7 @@ import sys
 import re
 import requests
 
+from datetime import datetime
 from enum import Enum
 
 from urllib.parse import urlsplit, urlunsplit
@@ -118,6 +121,40 @@ def format_datetime(dt):
     return dt.strftime("%Y-%m-%dT%H:%M:%S%z")
 
 
+@functools.lru_cache(maxsize=256)
+def _parse_fixed_datetime(value):
+    # RFC 1123, as Accept-Datetime is sent (eg 'Thu, 10 Mar 2022 16:45:07 GMT')
+    try:
+        return email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        pass
+    # ISO 8601 (eg '2022-03-10T16:45:07Z')
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def parse_datetime(value):
+    """Parse a datetime from an Accept-Datetime header or a skip-to-datetime request, as a
+    timezone aware datetime, or None if it cannot be understood.
+
+    RFC 1123 and ISO 8601 dates are parsed directly (and cached, as the same header values
+    recur). Anything else, such as free text, is left to dateparser, which is slow to import
+    and to run, so is only loaded when it is needed - and not cached, as a date like
+    'yesterday' is relative to now."""
+    value = value.strip()
+    parsed = _parse_fixed_datetime(value)
+    if parsed is None:
+        import dateparser
+
+        return dateparser.parse(value, settings={"RETURN_AS_TIMEZONE_AWARE": True})
+    if parsed.tzinfo is None:
+        # A date with no timezone is taken as local time, as dateparser does
+        return parsed.astimezone()
+    return parsed
+
+
 def checksum_json(json_obj):
     # Expects a JSON-serializable data structure to be passed to it.
     checksum = hashlib.sha256()
@@ -127,6 +164,12 @@ def checksum_json(json_obj):
 
 
 # Performs a recursive walkthrough of any dictionary/list calling the callback for any matched attribute
+def etag_checksum(etag):
+    """The record checksum that an ETag was made from - without the W/ prefix, the quotes or
+    the ':<coding>' suffix given to a compressed copy (eg 'W/"1a2b:gzip"' -> '1a2b')"""
+    return etag.removeprefix("W/").strip('"').split(":", 1)[0]
+
+
 def containerRecursiveCallback(
     data,
     attr=None,
@@ -249,6 +292,118 @@ def idPrefixer(attr, value, prefix=None, urlprefixes=None, **kwargs):
     return value
 
 
+def _without_base(context):
+    # A copy of the @context without any @base, leaving the stored data untouched
+    if isinstance(context, dict):
+        if "@base" in context:
+            return {k: v for k, v in context.items() if k != "@base"}
+    elif isinstance(context, list):
+        return [
+            (
+                {k: v for k, v in x.items() if k != "@base"}
+                if isinstance(x, dict) and "@base" in x
+                else x
+            )
+            for x in context
+        ]
+    return context
+
+
+def _children(node):
+    return iter(node.items()) if isinstance(node, dict) else iter(enumerate(node))
+
+
+@functools.lru_cache(maxsize=64)
+def compile_id_prefixer(prefix, urlprefixes=frozenset(), recursive=True):
+    """Build a function `rewrite(data, attr, tidy_context=True)` that prefixes a document's
+    relative 'id's, giving the same result as containerRecursiveCallback with idPrefixer.
+
+    The function is built once for each (prefix, urlprefixes, recursive) combination. It walks
+    the document with an explicit stack rather than recursion, and only copies the dicts and
+    lists that contain a changed id - unchanged parts of the document are shared with the
+    original, which is never modified. With tidy_context, the top level @context has any @base
+    removed and is flattened with squish_dict, as is done for display."""
+    skip_schemes = frozenset(ALLOWED_SCHEMES.union(urlprefixes))
+    prefix_has_slash = prefix.endswith("/") if prefix else False
+
+    def prefix_id(value):
+        # Equivalent to idPrefixer
+        if value.startswith("/"):
+            joiner = ""
+            if prefix_has_slash:
+                # two slashes, remove one
+                value = value[1:]
+        else:
+            joiner = "" if prefix_has_slash else "/"
+
+        if prefix and value.split(":", 1)[0] not in skip_schemes:
+            return prefix + joiner + value
+        return value
+
+    def rewrite(data, attr, tidy_context=True):
+        if not isinstance(data, (dict, list)):
+            raise RuntimeError(
+                "compile_id_prefixer() The 'data' argument must be a dictionary or list type!"
+            )
+
+        # frame: [container, its (key, value) iterator, changed values by key, key in parent]
+        stack = [[data, _children(data), {}, None]]
+        result = data
+        while stack:
+            frame = stack[-1]
+            node, items, changes, _ = frame
+            for key, val in items:
+                if isinstance(val, (dict, list)):
+                    if recursive:
+                        # descend, and carry on with this container's items afterwards
+                        stack.append([val, _children(val), {}, key])
+                        break
+                elif (attr is None or key == attr) and isinstance(val, str):
+                    new_val = prefix_id(val)
+                    if new_val != val:
+                        changes[key] = new_val
+            else:
+                # All of this container's items have been seen
+                stack.pop()
+                if not changes:
+                    new_node = node
+                elif isinstance(node, dict):
+                    new_node = {**node, **changes}
+                else:
+                    new_node = list(node)
+                    for key, val in changes.items():
+                        new_node[key] = val
+
+                if stack:
+                    if new_node is not node:
+                        stack[-1][2][frame[3]] = new_node
+                else:
+                    result = new_node
+
+        if tidy_context and isinstance(result, dict):
+            if context := result.get("@context"):
+                result = dict(result)
+                # Removing @base, if present, then flatten the context if needed, removing
+                # empty lists, dicts
+                if flattened_context := squish_dict(_without_base(context)):
+                    result["@context"] = flattened_context
+                else:
+                    # Nothing in @context now?
+                    del result["@context"]
+
+        return result
+
+    return rewrite
+
+
+def prefix_record_ids(data, attr, prefix, recursive=True, urlprefixes=None):
+    """Prefix the relative 'id's in a record for display, and tidy up its @context afterwards
+    (any @base is removed, and the context is flattened, or dropped if nothing is left)
+    """
+    rewrite = compile_id_prefixer(prefix, frozenset(urlprefixes or ()), recursive)
+    return rewrite(data, attr)
+
+
 def idUnPrefixer(attr, value, prefix="", **kwargs):
     """Helper callback method to remove the prefix from JSON-LD document 'id' attributes"""
     if prefix is not None:
@@ -0,0 +1,37 @@
+"""Entity type registry
+
+Revision ID: 0a4d9b6e2c75
+Revises: f1c7a3e5b829
+Create Date: 2026-10-19
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0a4d9b6e2c75"
+down_revision = "f1c7a3e5b829"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "entity_types",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("entity_type", sa.String(), nullable=False),
+        sa.Column("num_records", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("entity_type"),
+    )
+    # Fill it from the existing records
+    op.execute(
+        "INSERT INTO entity_types (entity_type, num_records) "
+        "SELECT entity_type, sum(CASE WHEN datetime_deleted IS NULL THEN 1 ELSE 0 END) "
+        "FROM records WHERE entity_type IS NOT NULL GROUP BY entity_type"
+    )
+
+
+def downgrade():
+    op.drop_table("entity_types")
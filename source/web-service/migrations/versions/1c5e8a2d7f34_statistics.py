@@ -0,0 +1,32 @@
+"""Stored statistics
+
+Revision ID: 1c5e8a2d7f34
+Revises: 0a4d9b6e2c75
+Create Date: 2026-10-19
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "1c5e8a2d7f34"
+down_revision = "0a4d9b6e2c75"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "statistics",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("datetime_computed", sa.TIMESTAMP(), nullable=False),
+        sa.Column("data", sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("name"),
+    )
+
+
+def downgrade():
+    op.drop_table("statistics")
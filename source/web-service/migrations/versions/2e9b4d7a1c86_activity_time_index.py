@@ -0,0 +1,40 @@
+"""Activity time index
+
+Revision ID: 2e9b4d7a1c86
+Revises: 1c5e8a2d7f34
+Create Date: 2026-10-19
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "2e9b4d7a1c86"
+down_revision = "1c5e8a2d7f34"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by `flask records activity-time-index`, or as skip-to-datetime is used
+    op.create_table(
+        "activity_time_index",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("first_id", sa.Integer(), nullable=False),
+        sa.Column("last_id", sa.Integer(), nullable=False),
+        sa.Column("first_datetime", sa.TIMESTAMP(), nullable=False),
+        sa.Column("last_datetime", sa.TIMESTAMP(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("first_id"),
+    )
+    op.create_index(
+        "ix_activity_time_index_last",
+        "activity_time_index",
+        ["last_datetime", "first_id"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_activity_time_index_last", table_name="activity_time_index")
+    op.drop_table("activity_time_index")
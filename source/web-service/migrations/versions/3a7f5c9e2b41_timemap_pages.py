@@ -0,0 +1,37 @@
+"""Stored TimeMap pages
+
+Revision ID: 3a7f5c9e2b41
+Revises: 2e9b4d7a1c86
+Create Date: 2026-10-19
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "3a7f5c9e2b41"
+down_revision = "2e9b4d7a1c86"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "timemap_pages",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("record_id", sa.Integer(), nullable=False),
+        sa.Column("uri", sa.String(), nullable=False),
+        sa.Column("format", sa.String(), nullable=False),
+        sa.Column("datetime_created", sa.TIMESTAMP(), nullable=False),
+        sa.Column("data", sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(["record_id"], ["records.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "record_id", "uri", "format", name="timemap_pages_uri_format"
+        ),
+    )
+
+
+def downgrade():
+    op.drop_table("timemap_pages")
@@ -0,0 +1,35 @@
+"""Versions stored as patches
+
+Revision ID: 4b8e6d1f3a92
+Revises: 3a7f5c9e2b41
+Create Date: 2026-10-19
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "4b8e6d1f3a92"
+down_revision = "3a7f5c9e2b41"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing versions are all in full - convert them with `flask records version-deltas`
+    op.add_column("versions", sa.Column("is_delta", sa.Boolean(), nullable=True))
+
+
+def downgrade():
+    # Without the flag, the patches would be taken for the versions' data
+    deltas = (
+        op.get_bind()
+        .execute(sa.text("SELECT count(*) FROM versions WHERE is_delta"))
+        .scalar()
+    )
+    if deltas:
+        raise RuntimeError(
+            f"{deltas} versions are stored as patches - run `flask records version-deltas --full` first"
+        )
+    op.drop_column("versions", "is_delta")
@@ -0,0 +1,28 @@
+"""Compressed copies of pre-rendered serializations
+
+Revision ID: 5d0a8e3f61b2
+Revises: c4e1d2a7b9f0
+Create Date: 2026-10-19
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "5d0a8e3f61b2"
+down_revision = "c4e1d2a7b9f0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("renderings", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("data_gzip", sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column("data_br", sa.LargeBinary(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("renderings", schema=None) as batch_op:
+        batch_op.drop_column("data_br")
+        batch_op.drop_column("data_gzip")
@@ -0,0 +1,61 @@
+"""Store TimeMap pages under the state of the record
+
+Revision ID: 5d2a8c4f6e17
+Revises: 4b8e6d1f3a92
+Create Date: 2026-10-19
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "5d2a8c4f6e17"
+down_revision = "4b8e6d1f3a92"
+branch_labels = None
+depends_on = None
+
+
+def _create_table(with_state):
+    columns = [
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("record_id", sa.Integer(), nullable=False),
+        sa.Column("uri", sa.String(), nullable=False),
+        sa.Column("format", sa.String(), nullable=False),
+    ]
+    if with_state:
+        columns.append(sa.Column("state", sa.String(), nullable=False))
+    op.create_table(
+        "timemap_pages",
+        *columns,
+        sa.Column("datetime_created", sa.TIMESTAMP(), nullable=False),
+        sa.Column("data", sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(["record_id"], ["records.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        (
+            sa.UniqueConstraint(
+                "record_id",
+                "uri",
+                "format",
+                "state",
+                name="timemap_pages_uri_format_state",
+            )
+            if with_state
+            else sa.UniqueConstraint(
+                "record_id", "uri", "format", name="timemap_pages_uri_format"
+            )
+        ),
+    )
+
+
+# The stored pages are only a cache, so they are dropped rather than converted
+
+
+def upgrade():
+    op.drop_table("timemap_pages")
+    _create_table(with_state=True)
+
+
+def downgrade():
+    op.drop_table("timemap_pages")
+    _create_table(with_state=False)
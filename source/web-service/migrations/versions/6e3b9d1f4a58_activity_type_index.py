@@ -0,0 +1,35 @@
+"""Activity type index
+
+Revision ID: 6e3b9d1f4a58
+Revises: 5d2a8c4f6e17
+Create Date: 2026-10-19
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "6e3b9d1f4a58"
+down_revision = "5d2a8c4f6e17"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by `flask records activity-type-index`, or as the per-type streams are read
+    op.create_table(
+        "activity_type_index",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("entity_type", sa.String(), nullable=False),
+        sa.Column("position", sa.Integer(), nullable=False),
+        sa.Column("activity_id", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "entity_type", "position", name="activity_type_index_position"
+        ),
+    )
+
+
+def downgrade():
+    op.drop_table("activity_type_index")
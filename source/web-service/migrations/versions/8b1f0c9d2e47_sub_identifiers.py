@@ -0,0 +1,49 @@
+"""Index of subaddressable ids within records
+
+Revision ID: 8b1f0c9d2e47
+Revises: 5d0a8e3f61b2
+Create Date: 2026-10-19
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "8b1f0c9d2e47"
+down_revision = "5d0a8e3f61b2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "sub_identifiers",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("entity_id", sa.String(), nullable=False),
+        sa.Column("record_id", sa.Integer(), nullable=False),
+        sa.Column("path", sa.JSON(), nullable=False),
+        sa.ForeignKeyConstraint(["record_id"], ["records.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "entity_id", "record_id", name="sub_identifiers_entity_id_record"
+        ),
+    )
+    op.create_index(
+        op.f("ix_sub_identifiers_entity_id"),
+        "sub_identifiers",
+        ["entity_id"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_sub_identifiers_record_id"),
+        "sub_identifiers",
+        ["record_id"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_sub_identifiers_record_id"), table_name="sub_identifiers")
+    op.drop_index(op.f("ix_sub_identifiers_entity_id"), table_name="sub_identifiers")
+    op.drop_table("sub_identifiers")
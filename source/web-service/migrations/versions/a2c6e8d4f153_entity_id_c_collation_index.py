@@ -0,0 +1,34 @@
+"""Index records.entity_id in the "C" collation, for prefix listings
+
+Revision ID: a2c6e8d4f153
+Revises: 8b1f0c9d2e47
+Create Date: 2026-10-19
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "a2c6e8d4f153"
+down_revision = "8b1f0c9d2e47"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Lets LIKE 'prefix%', and ordering and paging by entity_id, use an index whatever the
+    # database's default collation is. SQLite always compares text bytewise, so needs nothing.
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_records_entity_id_c ON records (entity_id COLLATE "C")'
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_records_entity_id_c")
@@ -0,0 +1,42 @@
+"""Index records by (entity_id, checksum), for bulk revalidation
+
+Revision ID: b7d3f91c0a28
+Revises: a2c6e8d4f153
+Create Date: 2026-10-19
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "b7d3f91c0a28"
+down_revision = "a2c6e8d4f153"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Lets /records/revalidate compare checksums with an index-only scan
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            op.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_records_entity_id_checksum ON records (entity_id, checksum)"
+            )
+    else:
+        op.create_index(
+            "ix_records_entity_id_checksum",
+            "records",
+            ["entity_id", "checksum"],
+            unique=False,
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            op.execute(
+                "DROP INDEX CONCURRENTLY IF EXISTS ix_records_entity_id_checksum"
+            )
+    else:
+        op.drop_index("ix_records_entity_id_checksum", table_name="records")
@@ -0,0 +1,40 @@
+"""Pre-rendered record serializations
+
+Revision ID: c4e1d2a7b9f0
+Revises: ff9f39c62302
+Create Date: 2026-10-19
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "c4e1d2a7b9f0"
+down_revision = "ff9f39c62302"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "renderings",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("record_id", sa.Integer(), nullable=False),
+        sa.Column("checksum", sa.String(), nullable=False),
+        sa.Column("format", sa.String(), nullable=False),
+        sa.Column("datetime_created", sa.TIMESTAMP(), nullable=False),
+        sa.Column("data", sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(["record_id"], ["records.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "record_id",
+            "checksum",
+            "format",
+            name="renderings_record_checksum_format",
+        ),
+    )
+
+
+def downgrade():
+    op.drop_table("renderings")
@@ -0,0 +1,37 @@
+"""Stored activity stream pages
+
+Revision ID: d3a8c5e91f07
+Revises: b7d3f91c0a28
+Create Date: 2026-10-19
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "d3a8c5e91f07"
+down_revision = "b7d3f91c0a28"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "activity_stream_pages",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("base_url", sa.String(), nullable=False),
+        sa.Column("first_id", sa.Integer(), nullable=False),
+        sa.Column("last_id", sa.Integer(), nullable=False),
+        sa.Column("etag", sa.String(), nullable=False),
+        sa.Column("datetime_created", sa.TIMESTAMP(), nullable=False),
+        sa.Column("data", sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "base_url", "first_id", "last_id", name="activity_stream_pages_range"
+        ),
+    )
+
+
+def downgrade():
+    op.drop_table("activity_stream_pages")
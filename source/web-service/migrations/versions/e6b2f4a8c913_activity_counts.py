@@ -0,0 +1,32 @@
+"""Running counts of activities
+
+Revision ID: e6b2f4a8c913
+Revises: d3a8c5e91f07
+Create Date: 2026-10-19
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "e6b2f4a8c913"
+down_revision = "d3a8c5e91f07"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "activity_counts",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("scope", sa.String(), nullable=False),
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("scope", "key", name="activity_counts_scope_key"),
+    )
+
+
+def downgrade():
+    op.drop_table("activity_counts")
@@ -0,0 +1,63 @@
+"""Store each activity's lowercased entity type, indexed with its id
+
+Revision ID: f1c7a3e5b829
+Revises: e6b2f4a8c913
+Create Date: 2026-10-19
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "f1c7a3e5b829"
+down_revision = "e6b2f4a8c913"
+branch_labels = None
+depends_on = None
+
+# Activities are updated this many ids at a time, each batch committed on its own on
+# PostgreSQL, so that the whole table is never locked at once
+BATCH_SIZE = 50000
+
+
+def backfill(bind):
+    last = bind.execute(sa.text("SELECT max(id) FROM activities")).scalar() or 0
+    for start in range(0, last, BATCH_SIZE):
+        bind.execute(
+            sa.text(
+                "UPDATE activities SET entity_type = ("
+                "SELECT lower(records.entity_type) FROM records "
+                "WHERE records.id = activities.record_id"
+                ") WHERE activities.id > :start AND activities.id <= :end"
+            ),
+            {"start": start, "end": start + BATCH_SIZE},
+        )
+
+
+def upgrade():
+    op.add_column("activities", sa.Column("entity_type", sa.String(), nullable=True))
+
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            backfill(op.get_bind())
+            op.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_activities_entity_type_id ON activities (entity_type, id)"
+            )
+    else:
+        backfill(op.get_bind())
+        op.create_index(
+            "ix_activities_entity_type_id",
+            "activities",
+            ["entity_type", "id"],
+            unique=False,
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_activities_entity_type_id")
+    else:
+        op.drop_index("ix_activities_entity_type_id", table_name="activities")
+    with op.batch_alter_table("activities") as batch_op:
+        batch_op.drop_column("entity_type")
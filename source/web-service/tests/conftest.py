@@ -18,6 +18,7 @@ from flaskapp.models.activity import Activity
 from flaskapp.models.record import Record
 
 from flaskapp.storage_utilities.container import get_container
+from flaskapp.storage_utilities.entity_types import reset_entity_type_cache
 from flaskapp.storage_utilities.record import (
     record_create,
     process_activity,
@@ -149,6 +150,8 @@ def test_db(current_app):
         )
     db.drop_all()
     db.create_all()
+    # Nothing cached from the previous database should be used with the new one
+    reset_entity_type_cache()
     # get or create-and-get the root container to ensure it always is in the test db
     _ = get_container("/")
     return db
@@ -163,6 +166,8 @@ def test_db_no_rdf(current_app_no_rdf):
         )
     db.drop_all()
     db.create_all()
+    # Nothing cached from the previous database should be used with the new one
+    reset_entity_type_cache()
     # get or create-and-get the root container to ensure it always is in the test db
     _ = get_container("/")
     return db
@@ -0,0 +1,80 @@
+import json
+import pytest
+
+from flaskapp.models import db
+from flaskapp.models.activity import Activity, ActivityCount
+from flaskapp.models.record import Record
+from flaskapp.storage_utilities.record import record_create, record_update
+from flaskapp.storage_utilities.activity_counts import (
+    ALL,
+    TYPE,
+    RECORD,
+    get_activity_count,
+    recount_activities,
+)
+
+
+@pytest.fixture
+def counts_app(current_app, test_db):
+    current_app.config["ACTIVITY_COUNTS"] = True
+    yield current_app
+    current_app.config["ACTIVITY_COUNTS"] = False
+
+
+def all_counts():
+    return {
+        (x.scope, x.key): x.count for x in db.session.query(ActivityCount) if x.count
+    }
+
+
+class TestActivityCounts:
+    def test_maintained(self, counts_app):
+        for n in range(3):
+            record_create(
+                {"id": f"counted/{n}", "type": "HumanMadeObject"},
+                process_the_activity=True,
+            )
+        record_create({"id": "counted/p", "type": "Person"}, process_the_activity=True)
+        db.session.commit()
+        record = db.session.query(Record).filter(Record.entity_id == "counted/0").one()
+        record_update(
+            record,
+            {"id": "counted/0", "type": "HumanMadeObject"},
+            process_the_activity=True,
+        )
+        db.session.commit()
+
+        assert get_activity_count(ALL) == 5
+        assert get_activity_count(TYPE, "humanmadeobject") == 4
+        assert get_activity_count(RECORD, "counted/0") == 2
+
+        # Removing activities takes them off again
+        db.session.delete(
+            db.session.query(Activity).filter(Activity.record_id == record.id).first()
+        )
+        db.session.commit()
+        assert get_activity_count(RECORD, "counted/0") == 1
+
+        # A rolled back transaction leaves the counts alone
+        record_create({"id": "counted/x", "type": "Person"}, process_the_activity=True)
+        db.session.flush()
+        db.session.rollback()
+        assert get_activity_count(TYPE, "person") == 1
+
+        maintained = all_counts()
+        recount_activities()
+        assert all_counts() == maintained
+
+    def test_collections_use_counts(self, counts_app, client, namespace):
+        record_create({"id": "counted/1", "type": "Person"}, process_the_activity=True)
+        db.session.commit()
+        # Only the counts are read, so a count that is off shows up in the totals
+        db.session.query(ActivityCount).update({"count": ActivityCount.count + 10})
+        db.session.commit()
+
+        for url in [
+            f"/{namespace}/activity-stream",
+            f"/{namespace}/activity-stream/type/person",
+            f"/{namespace}/counted/1/activity-stream",
+        ]:
+            assert json.loads(client.get(url).data)["totalItems"] == 11
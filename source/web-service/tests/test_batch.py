@@ -0,0 +1,148 @@
+import gzip
+import json
+import pytest
+
+from datetime import datetime
+
+from flaskapp.models import db
+from flaskapp.models.record import Record
+from flaskapp.utilities import checksum_json
+from flaskapp.storage_utilities.rendering import prerender_records
+
+
+@pytest.fixture
+def batch_records(test_db):
+    for n in range(3):
+        data = {
+            "id": f"batch/{n}",
+            "type": "Object",
+            "part": [{"id": f"batch/{n}/part", "type": "Object"}],
+        }
+        db.session.add(
+            Record(
+                entity_id=data["id"],
+                entity_type="Object",
+                datetime_created=datetime(2020, 1, 1),
+                datetime_updated=datetime(2020, 1, 1),
+                data=data,
+                checksum=checksum_json(data),
+            )
+        )
+    db.session.add(
+        Record(
+            entity_id="batch/deleted",
+            entity_type="Object",
+            datetime_created=datetime(2020, 1, 1),
+            datetime_updated=datetime(2020, 1, 1),
+            datetime_deleted=datetime(2020, 1, 2),
+            data=None,
+        )
+    )
+    db.session.commit()
+
+
+class TestBatchRetrieval:
+    def test_get_in_requested_order(self, batch_records, client, namespace, base_url):
+        response = client.get(f"/{namespace}/records/batch?ids=batch/2,batch/0")
+        assert response.status_code == 200
+        assert response.is_json is True
+
+        docs = response.get_json()
+        assert [doc["id"] for doc in docs] == [
+            f"{base_url}/batch/2",
+            f"{base_url}/batch/0",
+        ]
+        # prefixed as a GET of the record would be
+        assert docs[0]["part"][0]["id"] == f"{base_url}/batch/2/part"
+
+    def test_post_ndjson_with_not_found(self, batch_records, client, namespace):
+        response = client.post(
+            f"/{namespace}/records/batch?relativeid=true",
+            data=json.dumps({"ids": ["batch/1", "batch/missing", "batch/deleted"]}),
+            headers={"Accept": "application/x-ndjson"},
+        )
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+
+        found, missing, deleted = [
+            json.loads(line) for line in response.get_data(as_text=True).splitlines()
+        ]
+        assert found["id"] == "batch/1"
+        assert missing["id"] == "batch/missing"
+        assert missing["errors"][0]["status"] == 404
+        assert deleted["errors"][0]["status"] == 404
+
+    def test_limits(self, current_app, batch_records, client, namespace):
+        response = client.post(f"/{namespace}/records/batch", data="")
+        assert response.status_code == 422
+
+        current_app.config["BATCH_MAX_IDS"] = 1
+        response = client.get(f"/{namespace}/records/batch?ids=batch/1,batch/2")
+        assert response.status_code == 422
+
+
+class TestRevalidation:
+    def revalidate(self, client, namespace, lines, **kwargs):
+        kwargs.setdefault("data", "\n".join(lines))
+        response = client.post(f"/{namespace}/records/revalidate", **kwargs)
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+        return [json.loads(x) for x in response.get_data(as_text=True).splitlines()]
+
+    def test_only_changes_are_returned(
+        self, batch_records, client, namespace, base_url
+    ):
+        current = db.session.query(Record).filter(Record.entity_id == "batch/0").one()
+
+        changes = self.revalidate(
+            client,
+            namespace,
+            [
+                json.dumps({"id": "batch/0", "etag": f'"{current.checksum}"'}),
+                json.dumps({"id": f"{base_url}/batch/1", "etag": "stale"}),
+                json.dumps(["batch/deleted", "stale"]),
+                json.dumps(["batch/never-existed", "stale"]),
+            ],
+        )
+        changed = db.session.query(Record).filter(Record.entity_id == "batch/1").one()
+        assert changes == [
+            {"id": f"{base_url}/batch/1", "etag": changed.checksum},
+            {"id": "batch/deleted", "deleted": True},
+            {"id": "batch/never-existed", "deleted": True},
+        ]
+
+    def test_compressed_etags(self, current_app, batch_records, client, namespace):
+        current_app.config["PRERENDER_FORMATS"] = ["json-ld"]
+        current_app.config["PRECOMPRESS_RENDERINGS"] = True
+        current_app.config["COMPRESS_MIN_SIZE"] = 10
+        record = db.session.query(Record).filter(Record.entity_id == "batch/0").one()
+        prerender_records([record.id])
+
+        response = client.get(
+            f"/{namespace}/batch/0", headers={"Accept-Encoding": "gzip"}
+        )
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.headers["ETag"] == f'"{record.checksum}:gzip"'
+
+        # The etags that mirrors hold for compressed copies are for the same checksum
+        changes = self.revalidate(
+            client,
+            namespace,
+            [
+                json.dumps(["batch/0", response.headers["ETag"]]),
+                json.dumps(["batch/0", f'W/"{record.checksum}:br"']),
+                json.dumps(["batch/1", '"stale:gzip"']),
+            ],
+        )
+        assert [x["id"] for x in changes] == ["batch/1"]
+
+    def test_gzip_body(self, batch_records, client, namespace):
+        body = gzip.compress(json.dumps(["batch/2", "stale"]).encode("utf-8"))
+        changes = self.revalidate(
+            client, namespace, [], headers={"Content-Encoding": "gzip"}, data=body
+        )
+        assert [x["id"] for x in changes] == ["batch/2"]
+
+    def test_bad_line(self, batch_records, client, namespace):
+        changes = self.revalidate(client, namespace, ['["batch/2", "stale"]', "nope"])
+        assert changes[-1]["errors"][0]["source"] == {"line number": 2}
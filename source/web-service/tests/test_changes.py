@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+
+import pytest
+
+from flaskapp.models import db
+from flaskapp.models.record import Record
+from flaskapp.storage_utilities.record import record_create, record_delete
+from flaskapp.activity_watch import get_activity_watcher
+
+
+@pytest.fixture
+def changed_records(test_db):
+    for n in range(3):
+        record_create(
+            {
+                "id": f"changes/{n}",
+                "type": "Object",
+                "part": {"id": f"changes/{n}/part", "type": "Object"},
+            },
+            process_the_activity=True,
+        )
+    record = db.session.query(Record).filter(Record.entity_id == "changes/1").one()
+    record_delete(record, {"id": "changes/1"}, process_the_activity=True)
+    db.session.commit()
+
+
+@pytest.fixture
+def watcher(current_app):
+    watcher = get_activity_watcher()
+    yield watcher
+    watcher.stop()
+
+
+def create_later(app, entity_id, delay=0.2):
+    def create():
+        time.sleep(delay)
+        with app.app_context():
+            record_create(
+                {"id": entity_id, "type": "Object"}, process_the_activity=True
+            )
+            db.session.commit()
+
+    thread = threading.Thread(target=create)
+    thread.start()
+    return thread
+
+
+def read_events(response):
+    events = []
+    for block in response.get_data(as_text=True).split("\n\n"):
+        fields = dict(
+            line.split(": ", 1) for line in block.splitlines() if ": " in line
+        )
+        if "id" in fields:
+            events.append((fields["id"], json.loads(fields["data"])))
+    return events
+
+
+def read_changes(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    return [json.loads(x) for x in response.get_data(as_text=True).splitlines()]
+
+
+class TestChangeFeed:
+    def test_changes_with_records(self, changed_records, client, namespace, base_url):
+        lines = read_changes(client, f"/{namespace}/changes")
+
+        assert [x["activity"]["type"] for x in lines] == [
+            "Create",
+            "Create",
+            "Create",
+            "Delete",
+        ]
+        first = lines[0]
+        assert first["activity"]["object"]["id"] == f"{base_url}/changes/0"
+        # prefixed as entity_record would
+        assert first["record"]["part"]["id"] == f"{base_url}/changes/0/part"
+
+        # changes/1 has since been deleted, so every entry for it is a tombstone
+        assert lines[1]["record"] is None and lines[1]["deleted"] is True
+
+    def test_resume_from_cursor(self, changed_records, client, namespace):
+        first = read_changes(client, f"/{namespace}/changes?limit=2&relativeid=true")
+        assert len(first) == 2
+        assert first[0]["record"]["id"] == "changes/0"
+
+        rest = read_changes(client, f"/{namespace}/changes?since={first[-1]['cursor']}")
+        assert [x["cursor"] for x in rest] == [
+            str(int(first[-1]["cursor"]) + n) for n in (1, 2)
+        ]
+
+        caught_up = read_changes(
+            client, f"/{namespace}/changes?since={rest[-1]['cursor']}"
+        )
+        assert caught_up == []
+
+    def test_bad_since(self, test_db, client, namespace):
+        response = client.get(f"/{namespace}/changes?since=yesterday")
+        assert response.status_code == 400
+
+    def test_long_poll(self, changed_records, watcher, current_app, client, namespace):
+        # Nothing new - the request waits, then returns nothing
+        started = time.monotonic()
+        assert read_changes(client, f"/{namespace}/changes?since=4&wait=1") == []
+        assert time.monotonic() - started >= 1
+
+        # Woken by the commit, rather than waiting out the full time
+        thread = create_later(current_app, "changes/new")
+        started = time.monotonic()
+        lines = read_changes(client, f"/{namespace}/changes?since=4&wait=30")
+        thread.join()
+        assert time.monotonic() - started < 10
+        assert [x["cursor"] for x in lines] == ["5"]
+        assert lines[0]["activity"]["type"] == "Create"
+
+    def test_stream(self, changed_records, watcher, current_app, client, namespace):
+        current_app.config["CHANGES_STREAM_TIMEOUT"] = 1
+        response = client.get(f"/{namespace}/changes/stream?since=0")
+        assert response.status_code == 200
+        assert response.mimetype == "text/event-stream"
+        events = read_events(response)
+        assert [x for x, _ in events] == ["1", "2", "3", "4"]
+        assert events[0][1]["activity"]["type"] == "Create"
+
+        # A reconnecting EventSource carries on from the last event it saw
+        thread = create_later(current_app, "changes/new")
+        response = client.get(
+            f"/{namespace}/changes/stream?since=0", headers={"Last-Event-ID": "4"}
+        )
+        thread.join()
+        assert [x for x, _ in read_events(response)] == ["5"]
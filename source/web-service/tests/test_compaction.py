@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta, timezone
+
+from flaskapp.models import db
+from flaskapp.models.activity import Activity
+from flaskapp.models.record import Record
+from flaskapp.storage_utilities.record import (
+    record_create,
+    record_update,
+    record_delete,
+)
+from flaskapp.storage_utilities.activity_counts import (
+    RECORD,
+    get_activity_count,
+    recount_activities,
+)
+from flaskapp.storage_utilities.compaction import (
+    CHECKPOINT,
+    activities_to_remove,
+    compact_activities,
+    retention_rules,
+)
+from flaskapp.storage_utilities.statistics import load_stats
+
+
+def events(entity_id):
+    return [
+        event
+        for (event,) in db.session.query(Activity.event)
+        .join(Record)
+        .filter(Record.entity_id == entity_id)
+        .order_by(Activity.id)
+    ]
+
+
+def ingest(entity_id, updates=0):
+    record = record_create(
+        {"id": entity_id, "type": "Person"}, process_the_activity=True
+    )
+    db.session.commit()
+    record = db.session.query(Record).filter(Record.entity_id == entity_id).one()
+    for n in range(updates):
+        record_update(
+            record,
+            {"id": entity_id, "type": "Person", "n": n},
+            process_the_activity=True,
+        )
+        db.session.commit()
+    return record
+
+
+class TestCompaction:
+    def test_rules(self, current_app):
+        stream = [(1, "Create"), (2, "Update"), (3, "Update"), (4, "Delete")]
+        stream += [(5, "Create"), (6, "Update"), (7, "Update"), (8, "Update")]
+        rules = retention_rules(keep=0, collapse_updates=True, deleted_days=0)
+        assert activities_to_remove(stream, rules) == [2, 6, 7]
+        rules["keep"] = 3
+        assert activities_to_remove(stream, rules) == [2, 3, 6, 7]
+        assert activities_to_remove(stream, rules, expired=True) == list(range(1, 9))
+
+    def test_compact(self, current_app, test_db):
+        current_app.config["ACTIVITY_COUNTS"] = True
+        ingest("compact/updated", updates=4)
+        ingest("compact/once")
+        gone = ingest("compact/gone", updates=1)
+        record_delete(gone, {"id": "compact/gone"}, process_the_activity=True)
+        db.session.commit()
+        gone.datetime_deleted = datetime.now(timezone.utc) - timedelta(days=40)
+        db.session.commit()
+
+        rules = retention_rules(keep=2, collapse_updates=False, deleted_days=30)
+        progress = list(compact_activities(rules, batch_size=2))
+        # Two batches of records, then done
+        assert len(progress) == 3
+        assert progress[-1]["removed"] == 2 + 3
+        assert load_stats(CHECKPOINT)["complete"] is True
+
+        assert events("compact/updated") == ["Create", "Update", "Update"]
+        assert events("compact/once") == ["Create"]
+        assert events("compact/gone") == []
+        assert get_activity_count(RECORD, "compact/updated") == 3
+        assert get_activity_count(RECORD, "compact/gone") == 0
+
+        counted = get_activity_count(RECORD, "compact/updated")
+        recount_activities()
+        assert get_activity_count(RECORD, "compact/updated") == counted
+        current_app.config["ACTIVITY_COUNTS"] = False
+
+    def test_resume_from_checkpoint(self, current_app, test_db):
+        for n in range(3):
+            ingest(f"compact/{n}", updates=2)
+        rules = retention_rules(keep=0, collapse_updates=True, deleted_days=0)
+
+        run = compact_activities(rules, batch_size=1)
+        next(run)
+        run.close()
+        assert load_stats(CHECKPOINT)["records"] == 1
+
+        # Carries on with the second record
+        progress = list(compact_activities(rules, batch_size=1))
+        assert progress[0]["records"] == 2
+        assert progress[-1]["removed"] == 3
+        assert all(events(f"compact/{n}") == ["Create", "Update"] for n in range(3))
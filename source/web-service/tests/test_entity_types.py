@@ -0,0 +1,68 @@
+from flaskapp.models import db
+from flaskapp.models.entity_type import EntityType
+from flaskapp.models.record import Record
+from flaskapp.storage_utilities.record import (
+    record_create,
+    record_update,
+    record_delete,
+)
+from flaskapp.storage_utilities.entity_types import (
+    entity_type_counts,
+    is_known_entity_type,
+    known_entity_types,
+    recount_entity_types,
+)
+
+
+def registry():
+    return dict(db.session.query(EntityType.entity_type, EntityType.num_records))
+
+
+class TestEntityTypes:
+    def test_maintained_at_ingest(self, current_app, test_db):
+        for n in range(3):
+            record_create({"id": f"typed/{n}", "type": "Person"})
+        record_create({"id": "typed/g", "type": "Group"})
+        db.session.commit()
+        assert registry() == {"Person": 3, "Group": 1}
+        assert entity_type_counts() == [("Person", 3), ("Group", 1)]
+
+        group = db.session.query(Record).filter(Record.entity_id == "typed/g").one()
+        record_delete(group, {"id": "typed/g"})
+        db.session.commit()
+        # Deleting it again makes no difference
+        record_delete(group, {"id": "typed/g"})
+        db.session.commit()
+        assert registry() == {"Person": 3, "Group": 0}
+        assert entity_type_counts() == [("Person", 3)]
+
+        record_update(group, {"id": "typed/g", "type": "Group"})
+        db.session.commit()
+        assert registry()["Group"] == 1
+
+        # Not counted if the ingest is rolled back
+        record_create({"id": "typed/x", "type": "Place"})
+        db.session.rollback()
+        assert "Place" not in registry()
+
+        maintained = registry()
+        recount_entity_types()
+        assert registry() == maintained
+
+    def test_new_types_are_found(self, current_app, test_db, client, namespace):
+        record_create({"id": "typed/1", "type": "Person"}, process_the_activity=True)
+        db.session.commit()
+        assert "person" in known_entity_types()
+        assert not is_known_entity_type("place")
+
+        # A type first ingested after the cache was loaded
+        record_create({"id": "typed/2", "type": "Place"}, process_the_activity=True)
+        db.session.commit()
+        assert is_known_entity_type("place")
+
+        response = client.get(f"/{namespace}/activity-stream/type/place")
+        assert response.status_code == 200
+        assert response.json["totalItems"] == 1
+        assert (
+            client.get(f"/{namespace}/activity-stream/type/nothing").status_code == 404
+        )
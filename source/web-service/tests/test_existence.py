@@ -0,0 +1,121 @@
+import os
+import pytest
+
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.exc import OperationalError
+
+from flaskapp.models import db
+from flaskapp.models.record import Record
+import flaskapp.existence
+from flaskapp.existence import (
+    get_existence_filter,
+    init_existence_filter,
+    reset_existence_filter,
+    might_exist,
+    remember_missing,
+    add_to_existence_filter,
+)
+from flaskapp.storage_utilities.record import record_create
+
+
+@pytest.fixture
+def existence_app(current_app, test_db, tmp_path):
+    current_app.config["EXISTENCE_FILTER"] = True
+    current_app.config["EXISTENCE_FILTER_PATH"] = str(tmp_path / "test.existence")
+    # Only look for new records when a test asks for it
+    current_app.config["EXISTENCE_FILTER_REFRESH"] = 3600
+    reset_existence_filter()
+    yield current_app
+    reset_existence_filter()
+    current_app.config["EXISTENCE_FILTER"] = False
+
+
+def add_record_directly(entity_id, pk=None, created=None):
+    # Bypasses record_create, so the filter is not told about it
+    now = datetime.now(timezone.utc)
+    record = Record(
+        id=pk,
+        entity_id=entity_id,
+        entity_type="Object",
+        datetime_created=created or now,
+        datetime_updated=now,
+        data={"id": entity_id, "type": "Object"},
+    )
+    db.session.add(record)
+    db.session.commit()
+    return record
+
+
+class TestExistenceFilter:
+    def test_built_from_records_table(self, existence_app):
+        add_record_directly("object/exists")
+        init_existence_filter(rebuild=True)
+
+        assert might_exist("object/exists") is True
+        assert might_exist("object/does-not-exist") is False
+
+    def test_ingested_records_are_added(self, existence_app):
+        init_existence_filter(rebuild=True)
+        assert might_exist("object/new") is False
+
+        record_create({"id": "object/new", "type": "Object"})
+        db.session.commit()
+        assert might_exist("object/new") is True
+
+    def test_missing_record_is_not_looked_up(self, existence_app, client, namespace):
+        init_existence_filter(rebuild=True)
+        assert get_existence_filter() is not None
+        add_record_directly("object/unseen")
+
+        # The filter has not refreshed since the record was added
+        response = client.get(f"/{namespace}/object/unseen")
+        assert response.status_code == 404
+
+        existence_app.config["EXISTENCE_FILTER_REFRESH"] = 0
+        response = client.get(f"/{namespace}/object/unseen")
+        assert response.status_code == 200
+
+    def test_negative_cache(self, existence_app):
+        init_existence_filter(rebuild=True)
+        add_to_existence_filter(["object/false-positive"])
+        assert might_exist("object/false-positive") is True
+
+        remember_missing("object/false-positive")
+        assert might_exist("object/false-positive") is False
+
+        # Anything new being added to the filter clears the cached answers
+        additions = get_existence_filter().additions
+        add_to_existence_filter(["object/another"])
+        assert get_existence_filter().additions == additions + 1
+        assert might_exist("object/false-positive") is True
+
+    def test_late_commit_with_a_lower_id(self, existence_app):
+        add_record_directly("object/seen", pk=1000)
+        init_existence_filter(rebuild=True)
+        assert get_existence_filter() is not None
+
+        # Created (and given its id) before the record above, but only committed now
+        created = datetime.now(timezone.utc) - timedelta(seconds=60)
+        add_record_directly("object/late", pk=5, created=created)
+        existence_app.config["EXISTENCE_FILTER_REFRESH"] = 0
+        assert might_exist("object/late") is True
+
+    def test_refresh_leaves_the_ingest_alone(self, existence_app, monkeypatch):
+        path = existence_app.config["EXISTENCE_FILTER_PATH"]
+        # An ingest does not build the filter if this worker has not got it yet...
+        record_create({"id": "object/pending", "type": "Object"})
+        assert not os.path.exists(path)
+
+        # ...and a failed refresh does not roll back what it has done so far
+        def fail(existence_filter):
+            raise OperationalError("SELECT", {}, Exception("connection lost"))
+
+        init_existence_filter(rebuild=True)
+        monkeypatch.setattr(flaskapp.existence, "_refresh", fail)
+        existence_app.config["EXISTENCE_FILTER_REFRESH"] = 0
+        assert get_existence_filter() is None
+        record_create({"id": "object/also-pending", "type": "Object"})
+        db.session.commit()
+
+        assert db.session.query(Record).count() == 2
@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from flaskapp.conneg import reformat_rdf
+from flaskapp.storage_utilities.graph import graph_expand
+from flaskapp.offload import (
+    run_cpu_bound,
+    shutdown_executor,
+    OffloadSaturatedError,
+    OffloadTimeoutError,
+)
+
+
+@pytest.fixture
+def offload_app(current_app):
+    current_app.config["OFFLOAD_RDF_PROCESSING"] = True
+    current_app.config["OFFLOAD_WORKERS"] = 1
+    current_app.config["OFFLOAD_QUEUE_SIZE"] = 2
+    current_app.config["OFFLOAD_TIMEOUT"] = 30
+    yield current_app
+    shutdown_executor()
+
+
+SIMPLE_JSONLD = {
+    "@context": {"rdfs": "http://www.w3.org/2000/01/rdf-schema#"},
+    "@id": "https://example.org/offload/1",
+    "rdfs:label": "Offloaded",
+}
+
+
+class TestOffload:
+    def test_runs_inline_when_disabled(self, current_app):
+        current_app.config["OFFLOAD_RDF_PROCESSING"] = False
+        assert run_cpu_bound(sorted, [3, 1, 2]) == [1, 2, 3]
+
+    def test_reformat_in_process_pool(self, offload_app):
+        nt = run_cpu_bound(
+            reformat_rdf,
+            SIMPLE_JSONLD,
+            shortformat="nt11",
+            use_pyld=False,
+            rdf_docloader=offload_app.config["RDF_DOCLOADER"],
+        )
+        assert "<https://example.org/offload/1>" in nt
+        assert '"Offloaded"' in nt
+
+    def test_graph_expand_in_process_pool(self, offload_app):
+        # As an ingest expands its records
+        offload_app.config["USE_PYLD_REFORMAT"] = True
+        offload_app.config["OFFLOAD_QUEUE_SIZE"] = 0
+        with pytest.raises(OffloadSaturatedError):
+            graph_expand(SIMPLE_JSONLD)
+
+        shutdown_executor()
+        offload_app.config["OFFLOAD_QUEUE_SIZE"] = 2
+        nt = graph_expand(SIMPLE_JSONLD)
+        assert "<https://example.org/offload/1>" in nt
+
+    def test_saturated_queue_raises(self, offload_app):
+        offload_app.config["OFFLOAD_QUEUE_SIZE"] = 0
+        with pytest.raises(OffloadSaturatedError):
+            run_cpu_bound(sorted, [3, 1, 2])
+
+    def test_timed_out_task_holds_its_slot(self, offload_app):
+        offload_app.config["OFFLOAD_QUEUE_SIZE"] = 1
+        offload_app.config["OFFLOAD_TIMEOUT"] = 1
+        # Blocked rather than using CPU, so only the wall-clock limit stops it
+        with pytest.raises(OffloadTimeoutError):
+            run_cpu_bound(time.sleep, 30)
+
+        # The child is still running it (it started after the pool was spawned), so the
+        # queue is still full...
+        with pytest.raises(OffloadSaturatedError):
+            run_cpu_bound(sorted, [3, 1, 2])
+
+        # ...until the child's own time limit stops it
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                assert run_cpu_bound(sorted, [3, 1, 2]) == [1, 2, 3]
+                break
+            except OffloadSaturatedError:
+                assert time.monotonic() < deadline
+                time.sleep(0.1)
+
+    def test_saturated_queue_is_a_503(
+        self, offload_app, client, namespace, sample_rdfrecord_with_context
+    ):
+        record = sample_rdfrecord_with_context()
+        offload_app.config["OFFLOAD_QUEUE_SIZE"] = 0
+
+        response = client.get(
+            f"/{namespace}/{record.entity_id}", headers={"Accept": "text/turtle"}
+        )
+        assert response.status_code == 503
+        assert response.headers.get("Retry-After") == "30"
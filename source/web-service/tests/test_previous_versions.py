@@ -0,0 +1,86 @@
+from flaskapp.models import db
+from flaskapp.models.record import Record, Version
+from flaskapp.storage_utilities.previous_versions import backfill_previous_versions
+from flaskapp.storage_utilities.record import (
+    record_create,
+    record_delete,
+    record_update,
+)
+from flaskapp.storage_utilities.version_retention import prune_versions
+
+
+def make_versions(entity_id, count):
+    record_create({"id": entity_id, "type": "Person"})
+    db.session.commit()
+    record = db.session.query(Record).filter(Record.entity_id == entity_id).one()
+    for n in range(count):
+        record_update(record, {"id": entity_id, "type": "Person", "n": n})
+        db.session.commit()
+    return record, [
+        v.entity_id for v in db.session.query(Version).order_by(Version.id).all()
+    ]
+
+
+def previous_link(response):
+    for link in response.headers.get("Link", "").split(","):
+        if 'rel="previous"' in link:
+            return link.split(">")[0].strip(" <").rsplit("/", 1)[-1]
+    return None
+
+
+class TestPreviousVersions:
+    def test_link_header(self, client, current_app, test_db, namespace, auth_token):
+        current_app.config["LINK_HEADER_PREV_VERSION"] = True
+        try:
+            record, versions = make_versions("prev/1", 3)
+            assert record.previous_version == versions[-1]
+            assert record.is_old_version is False
+
+            response = client.get(f"/{namespace}/prev/1")
+            assert response.status_code == 200
+            assert previous_link(response) == versions[-1]
+
+            # Deleting the latest version points back to the one before it
+            response = client.delete(
+                f"/{namespace}/-VERSION-/{versions[-1]}",
+                headers={"Authorization": "Bearer " + auth_token},
+            )
+            assert response.status_code == 200
+            response = client.get(f"/{namespace}/prev/1")
+            assert previous_link(response) == versions[-2]
+
+            record_create({"id": "prev/2", "type": "Person"})
+            db.session.commit()
+            response = client.get(f"/{namespace}/prev/2")
+            assert response.status_code == 200
+            assert previous_link(response) is None
+        finally:
+            current_app.config["LINK_HEADER_PREV_VERSION"] = False
+
+    def test_delete_and_prune(self, current_app, test_db):
+        record, versions = make_versions("prev/1", 4)
+
+        list(prune_versions({"max_versions": 2, "max_age": 0, "thinning": []}, 10))
+        record = db.session.query(Record).filter(Record.entity_id == "prev/1").one()
+        assert record.previous_version == versions[-1]
+
+        record_delete(record, None, commit=True)
+        assert record.previous_version is None
+
+    def test_backfill(self, current_app, test_db):
+        make_versions("prev/1", 2)
+        _, versions = make_versions("prev/2", 3)
+        db.session.query(Record).update(
+            {"previous_version": None, "is_old_version": None},
+            synchronize_session=False,
+        )
+        db.session.commit()
+
+        assert list(backfill_previous_versions(1)) == [1, 2]
+        db.session.expire_all()
+        records = {
+            r.entity_id: r for r in db.session.query(Record).order_by(Record.id).all()
+        }
+        assert records["prev/2"].previous_version == versions[-1]
+        assert records["prev/1"].previous_version in versions[:2]
+        assert all(r.is_old_version is False for r in records.values())
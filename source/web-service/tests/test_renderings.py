@@ -0,0 +1,174 @@
+import gzip
+import pytest
+
+from flaskapp.models import db
+from flaskapp.utilities import checksum_json
+from flaskapp.models.rendering import Rendering
+from flaskapp import background
+from flaskapp.storage_utilities.rendering import (
+    get_rendering,
+    prerender_records,
+    prune_renderings,
+)
+
+
+@pytest.fixture
+def prerender_app(current_app):
+    current_app.config["PRERENDER_FORMATS"] = ["turtle"]
+    yield current_app
+
+
+@pytest.fixture
+def checksummed_record(sample_rdfrecord_with_context):
+    # The sample records are added directly, without the checksum that ingest would give them
+    record = sample_rdfrecord_with_context()
+    record.checksum = checksum_json(record.data)
+    db.session.commit()
+    return record
+
+
+def wait_for_background_tasks():
+    # The background executor has a single thread, so this runs after anything queued before it
+    background.get_executor().submit(lambda: None).result()
+
+
+class TestRenderings:
+    def test_prerender_stores_current_checksum(self, prerender_app, checksummed_record):
+        record = checksummed_record
+        prerender_records([record.id])
+
+        stored = get_rendering(record.id, record.checksum, "turtle")
+        assert stored is not None
+        assert prerender_app.config["idPrefix"] + "/rdfsample1" in stored.data
+
+    def test_stored_rendering_is_served(
+        self, prerender_app, client, namespace, checksummed_record
+    ):
+        record = checksummed_record
+        prerender_records([record.id])
+
+        db.session.query(Rendering).filter(Rendering.record_id == record.id).update(
+            {"data": "# stored turtle"}
+        )
+        db.session.commit()
+
+        response = client.get(
+            f"/{namespace}/{record.entity_id}", headers={"Accept": "text/turtle"}
+        )
+        assert response.status_code == 200
+        assert response.data == b"# stored turtle"
+
+        # rdflib was asked for explicitly, so this is rendered live
+        response = client.get(
+            f"/{namespace}/{record.entity_id}?rdflib",
+            headers={"Accept": "text/turtle"},
+        )
+        assert response.data != b"# stored turtle"
+
+    def test_miss_is_backfilled(
+        self, prerender_app, client, namespace, checksummed_record
+    ):
+        record = checksummed_record
+        assert get_rendering(record.id, record.checksum, "turtle") is None
+
+        response = client.get(
+            f"/{namespace}/{record.entity_id}", headers={"Accept": "text/turtle"}
+        )
+        assert response.status_code == 200
+        wait_for_background_tasks()
+
+        stored = get_rendering(record.id, record.checksum, "turtle")
+        assert stored.data == response.get_data(as_text=True)
+
+    def test_stale_renderings_are_pruned(self, prerender_app, checksummed_record):
+        record = checksummed_record
+        prerender_records([record.id])
+        old_checksum = record.checksum
+
+        record.checksum = "changed"
+        db.session.commit()
+
+        assert prune_renderings() == 1
+        assert get_rendering(record.id, old_checksum, "turtle") is None
+
+    def test_json_rendering_matches_live_response(
+        self, prerender_app, client, namespace, checksummed_record
+    ):
+        record = checksummed_record
+        live = client.get(f"/{namespace}/{record.entity_id}")
+
+        prerender_app.config["PRERENDER_FORMATS"] = ["json-ld"]
+        prerender_records([record.id])
+
+        stored = get_rendering(record.id, record.checksum, "json-ld")
+        assert stored.data == live.get_data(as_text=True)
+
+        response = client.get(f"/{namespace}/{record.entity_id}")
+        assert response.data == live.data
+        assert response.headers["ETag"] == f'"{record.checksum}"'
+
+    def test_precompressed_rendering_is_served(
+        self, prerender_app, client, namespace, checksummed_record
+    ):
+        record = checksummed_record
+        prerender_app.config["PRECOMPRESS_RENDERINGS"] = True
+        prerender_app.config["COMPRESS_MIN_SIZE"] = 10
+        prerender_records([record.id])
+
+        stored = get_rendering(record.id, record.checksum, "turtle")
+
+        response = client.get(
+            f"/{namespace}/{record.entity_id}",
+            headers={"Accept": "text/turtle", "Accept-Encoding": "gzip"},
+        )
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert gzip.decompress(response.data).decode("utf-8") == stored.data
+
+        # The uncompressed copy depends on Accept-Encoding as well
+        response = client.get(
+            f"/{namespace}/{record.entity_id}", headers={"Accept": "text/turtle"}
+        )
+        assert "Content-Encoding" not in response.headers
+        assert "Accept-Encoding" in response.headers["Vary"]
+
+        # No compressed copy is kept below the threshold
+        prerender_app.config["COMPRESS_MIN_SIZE"] = 100000
+        db.session.query(Rendering).delete()
+        db.session.commit()
+        prerender_records([record.id])
+
+        response = client.get(
+            f"/{namespace}/{record.entity_id}",
+            headers={"Accept": "text/turtle", "Accept-Encoding": "gzip"},
+        )
+        assert "Content-Encoding" not in response.headers
+        assert response.get_data(as_text=True) == stored.data
+
+    def test_precompressed_json_etag(
+        self, prerender_app, client, namespace, checksummed_record
+    ):
+        record = checksummed_record
+        prerender_app.config["PRERENDER_FORMATS"] = ["json-ld"]
+        prerender_app.config["PRECOMPRESS_RENDERINGS"] = True
+        prerender_app.config["COMPRESS_MIN_SIZE"] = 10
+        prerender_records([record.id])
+
+        response = client.get(
+            f"/{namespace}/{record.entity_id}", headers={"Accept-Encoding": "gzip"}
+        )
+        assert response.headers["Content-Encoding"] == "gzip"
+        etag = response.headers["ETag"]
+        assert etag == f'"{record.checksum}:gzip"'
+
+        response = client.get(f"/{namespace}/{record.entity_id}")
+        assert response.headers["ETag"] == f'"{record.checksum}"'
+        assert "Accept-Encoding" in response.headers["Vary"]
+
+        # Either etag revalidates the record
+        response = client.get(
+            f"/{namespace}/{record.entity_id}",
+            headers={"Accept-Encoding": "gzip", "If-None-Match": etag},
+        )
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
@@ -2,14 +2,26 @@ import json
 import uuid
 import re
 
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 from flaskapp.routes.activity import generate_url
 from flaskapp.routes import activity_entity
 from flaskapp.routes import records
-from flaskapp.models.activity import Activity
-
-from flaskapp.utilities import format_datetime, Event
+from flaskapp.models.activity import Activity, ActivityStreamPage, ActivityTypeMark
+from flaskapp import background
+from flaskapp.storage_utilities.activity_pages import (
+    invalidate_activity_pages,
+    store_page,
+)
+from flaskapp.storage_utilities import activity_times
+from flaskapp.storage_utilities.activity_type_index import (
+    extend_type_index,
+    invalidate_type_index,
+    rebuild_type_index,
+)
+from flaskapp.storage_utilities.record import record_create
+
+from flaskapp.utilities import format_datetime, parse_datetime, Event
 
 
 class TestGenerateURL:
@@ -352,6 +364,144 @@ class TestPageRoute:
         assert response.status_code == 404
 
 
+class TestStoredPages:
+    def test_closed_page_stored(
+        self, client, current_app, sample_activity, test_db, namespace
+    ):
+        current_app.config["ITEMS_PER_PAGE"] = 2
+        current_app.config["ACTIVITY_PAGE_CACHE"] = True
+        for n in range(3):
+            sample_activity(n)
+
+        response = client.get(f"/{namespace}/activity-stream/page/1")
+        assert response.status_code == 200
+        assert "immutable" in response.headers["Cache-Control"]
+        etag = response.headers["ETag"]
+        # The background thread runs tasks in turn, so this waits for the page to be stored
+        background.get_executor().submit(lambda: None).result()
+
+        stored = test_db.session.query(ActivityStreamPage).one()
+        assert (stored.first_id, stored.last_id) == (1, 2)
+        assert f'"{stored.etag}"' == etag
+
+        again = client.get(f"/{namespace}/activity-stream/page/1")
+        assert again.get_data() == response.get_data()
+        assert again.headers["ETag"] == etag
+
+        cached = client.get(
+            f"/{namespace}/activity-stream/page/1", headers={"If-None-Match": etag}
+        )
+        assert cached.status_code == 304
+
+        # The last page can still grow, so is never stored
+        last = client.get(f"/{namespace}/activity-stream/page/2")
+        assert last.headers["Cache-Control"] == "no-cache"
+        assert "ETag" not in last.headers
+
+    def test_recent_page_not_stored(
+        self, client, current_app, sample_activity, test_db, namespace
+    ):
+        current_app.config["ITEMS_PER_PAGE"] = 2
+        current_app.config["ACTIVITY_PAGE_CACHE"] = True
+        for n in range(3):
+            sample_activity(n)
+        # An ingest that began before this activity was added could still add to page 1
+        latest = test_db.session.query(Activity).filter(Activity.id == 3).one()
+        latest.datetime_created = datetime.now(timezone.utc) - timedelta(seconds=10)
+        test_db.session.commit()
+
+        response = client.get(f"/{namespace}/activity-stream/page/1")
+        assert response.status_code == 200
+        assert "ETag" not in response.headers
+        assert "immutable" not in response.headers.get("Cache-Control", "")
+        background.get_executor().submit(lambda: None).result()
+        assert test_db.session.query(ActivityStreamPage).count() == 0
+
+        current_app.config["ACTIVITY_PAGE_GRACE"] = 5
+        response = client.get(f"/{namespace}/activity-stream/page/1")
+        assert "immutable" in response.headers["Cache-Control"]
+
+    def test_not_stored_after_removal(self, current_app, sample_activity, test_db):
+        for n in range(3):
+            sample_activity(n)
+        base_url = "http://example.org/activity-stream"
+
+        # Rendered with both activities, but one was removed before it could be stored
+        test_db.session.query(Activity).filter(Activity.id == 2).delete()
+        test_db.session.commit()
+        store_page(base_url, 1, 2, "{}", "etag", 2)
+        assert test_db.session.query(ActivityStreamPage).count() == 0
+
+        store_page(base_url, 1, 2, "{}", "etag", 1)
+        assert test_db.session.query(ActivityStreamPage).count() == 1
+
+    def test_invalidation(self, current_app, test_db):
+        for first_id in (1, 3, 5):
+            test_db.session.add(
+                ActivityStreamPage(
+                    base_url="http://example.org/activity-stream",
+                    first_id=first_id,
+                    last_id=first_id + 1,
+                    etag="etag",
+                    datetime_created=datetime(2020, 1, 1),
+                    data="{}",
+                )
+            )
+        test_db.session.commit()
+
+        assert invalidate_activity_pages([2, 6, 7]) == 2
+        test_db.session.commit()
+        assert [x for (x,) in test_db.session.query(ActivityStreamPage.first_id)] == [3]
+
+
+class TestSkipToDatetime:
+    def test_time_index(
+        self, client, current_app, sample_activity, test_db, namespace, monkeypatch
+    ):
+        monkeypatch.setattr(activity_times, "TIME_SPAN", 3)
+        current_app.config["ITEMS_PER_PAGE"] = 2
+        start = datetime(2020, 1, 1)
+        for n in range(10):
+            activity = sample_activity(1)
+            activity.datetime_created = start + timedelta(days=n)
+        test_db.session.commit()
+
+        def skip_to(day):
+            return client.get(
+                f"/{namespace}/activity-stream/skip-to-datetime",
+                query_string={"datetime": (start + timedelta(days=day)).isoformat()},
+            )
+
+        # Nothing is indexed yet - found by reading the activities, and indexed meanwhile
+        response = skip_to(4)
+        assert response.status_code == 302
+        assert response.location.endswith("/activity-stream/page/3")
+        background.get_executor().submit(lambda: None).result()
+        spans = test_db.session.query(activity_times.ActivityTimeSpan).all()
+        assert [(s.first_id, s.last_id) for s in spans] == [(1, 3), (4, 6), (7, 9)]
+
+        # The last id on a page is on that page
+        assert skip_to(3).location.endswith("/activity-stream/page/2")
+        assert skip_to(0).location.endswith("/activity-stream/page/1")
+        assert skip_to(9).location.endswith("/activity-stream/page/5")
+        assert skip_to(10).status_code == 404
+
+        # Removing activities leaves gaps in the ids, but not in the pages
+        test_db.session.query(Activity).filter(Activity.id.in_([4, 5, 6])).delete()
+        test_db.session.commit()
+        assert skip_to(4).location.endswith("/activity-stream/page/4")
+        assert activity_times.rebuild_time_index() == 2
+
+    def test_parse_datetime(self):
+        expected = datetime(2022, 3, 10, 16, 45, 7, tzinfo=timezone.utc)
+        assert parse_datetime("Thu, 10 Mar 2022 16:45:07 GMT") == expected
+        assert parse_datetime("2022-03-10T16:45:07Z") == expected
+        assert parse_datetime("2022-03-10T18:45:07+02:00") == expected
+        # Free text falls back to dateparser
+        assert parse_datetime("10 March 2022 16:45:07 UTC") == expected
+        assert parse_datetime("not a date at all") is None
+
+
 class TestItemRoute:
     def test_typical_functionality(self, client, sample_data, namespace):
         activity = sample_data["activity"]
@@ -387,6 +537,83 @@ class TestActivityEntity:
             == f"{base_url}/activity-stream/type/someentity/page/11"
         )
 
+    def test_type_pages(self, client, current_app, test_db, namespace):
+        current_app.config["ITEMS_PER_PAGE"] = 2
+        for n in range(5):
+            record_create(
+                {"id": f"typed/{n}", "type": "HumanMadeObject"},
+                process_the_activity=True,
+            )
+            # Other types in between, which are left out of the stream
+            record_create(
+                {"id": f"other/{n}", "type": "Person"}, process_the_activity=True
+            )
+        test_db.session.commit()
+        assert {a.entity_type for a in Activity.query} == {"humanmadeobject", "person"}
+
+        url = f"/{namespace}/activity-stream/type/HumanMadeObject"
+        collection = json.loads(client.get(url).data)
+        assert collection["totalItems"] == 5
+        assert collection["last"]["id"].endswith("/page/3")
+
+        # Every page holds the activities of its own type, in order
+        pages = [
+            json.loads(client.get(f"{url}/page/{n}").data)["orderedItems"]
+            for n in (1, 2, 3)
+        ]
+        assert [[x["object"]["id"].split("/")[-1] for x in p] for p in pages] == [
+            ["0", "1"],
+            ["2", "3"],
+            ["4"],
+        ]
+        assert pages[0][0]["object"]["type"] == "HumanMadeObject"
+
+    def test_type_index(self, client, current_app, test_db, namespace):
+        current_app.config["ITEMS_PER_PAGE"] = 2
+        for n in range(7):
+            record_create(
+                {"id": f"typed/{n}", "type": "HumanMadeObject"},
+                process_the_activity=True,
+            )
+            record_create(
+                {"id": f"other/{n}", "type": "Person"}, process_the_activity=True
+            )
+        test_db.session.commit()
+        url = f"/{namespace}/activity-stream/type/HumanMadeObject"
+
+        def page_ids(n):
+            items = json.loads(client.get(f"{url}/page/{n}").data)["orderedItems"]
+            return [x["object"]["id"].split("/")[-1] for x in items]
+
+        # Nothing is indexed until the activities are ACTIVITY_PAGE_GRACE seconds old
+        assert extend_type_index("humanmadeobject") == 0
+        current_app.config["ACTIVITY_PAGE_GRACE"] = -60
+        assert rebuild_type_index() == 4 + 4
+        marks = test_db.session.query(
+            ActivityTypeMark.position, ActivityTypeMark.activity_id
+        ).filter(ActivityTypeMark.entity_type == "humanmadeobject")
+        starts = dict(marks)
+        assert sorted(starts) == [0, 2, 4, 6]
+        assert [page_ids(n) for n in (1, 2, 3, 4)] == [
+            ["0", "1"],
+            ["2", "3"],
+            ["4", "5"],
+            ["6"],
+        ]
+
+        # The page starts from the first removed activity on are dropped...
+        removed = test_db.session.query(Activity).filter(Activity.id == starts[2] + 2)
+        invalidate_type_index([removed.one().id])
+        removed.delete()
+        test_db.session.commit()
+        assert sorted(dict(marks)) == [0, 2]
+        assert [page_ids(n) for n in (2, 3)] == [["2", "4"], ["5", "6"]]
+
+        # ...and found again
+        background.get_executor().submit(lambda: None).result()
+        assert sorted(dict(marks)) == [0, 2, 4]
+        assert page_ids(3) == ["5", "6"]
+
 
 class TestActivityRecord:
     def test_url_base(self, current_app, base_url):
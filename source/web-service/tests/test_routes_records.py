@@ -1,9 +1,14 @@
 import json
+import random
 
 from flaskapp.models import db
 from flaskapp.models.record import Record
 from flaskapp.utilities import format_datetime, checksum_json
-from flaskapp.utilities import containerRecursiveCallback, idPrefixer
+from flaskapp.utilities import (
+    containerRecursiveCallback,
+    idPrefixer,
+    compile_id_prefixer,
+)
 
 from datetime import datetime, timezone
 from uuid import uuid4
@@ -171,6 +176,77 @@ class TestObtainRecord:
         assert data["rdfs:seeAlso"][0]["@id"] == "dc:description"
         assert data["@context"]["_prefixedlabel"]["@id"] == "rdfs:label"
 
+    def test_compiled_prefixer_matches_recursive_callback(self, current_app):
+        idPrefix = current_app.config["idPrefix"]
+        data = {
+            "@context": [{"@base": "http://example.org/"}, {"rdfs": "http://r/#"}],
+            "id": "object/1",
+            "part": [{"id": "/object/2"}, {"id": "rdfs:label"}, "object/3"],
+            "same": {"id": "https://example.org/already"},
+        }
+        original = json.loads(json.dumps(data))
+
+        expected = containerRecursiveCallback(
+            data=json.loads(json.dumps(data)),
+            attr="id",
+            callback=idPrefixer,
+            prefix=idPrefix,
+            urlprefixes={"rdfs"},
+        )
+        expected["@context"] = {"rdfs": "http://r/#"}
+
+        rewritten = compile_id_prefixer(idPrefix, frozenset({"rdfs"}), True)(data, "id")
+        assert rewritten == expected
+        # the stored data is left alone, and unchanged parts are shared rather than copied
+        assert data == original
+        assert rewritten["same"] is data["same"]
+
+    def test_compiled_prefixer_matches_on_random_documents(self):
+        rng = random.Random(1234)
+        values = [
+            "object/1",
+            "/object/2",
+            "https://example.org/object/3",
+            "urn:uuid:4",
+            "rdfs:label",
+            "aat:300404670",
+            "",
+            "a:b:c",
+        ]
+
+        def document(depth):
+            if depth > 3 or rng.random() < 0.2:
+                return rng.choice(values + [1, 2.5, True, None])
+            if rng.random() < 0.5:
+                return [document(depth + 1) for _ in range(rng.randint(0, 4))]
+            keys = ["id", "@id", "name", "part", "0"]
+            return {
+                key: document(depth + 1)
+                for key in rng.sample(keys, rng.randint(0, len(keys)))
+            }
+
+        for _ in range(300):
+            data = {"id": rng.choice(values), "part": document(0)}
+            if rng.random() < 0.3:
+                data = [data, document(0)]
+            prefix = rng.choice(["http://example.org/ns", "http://example.org/ns/"])
+            attr = rng.choice(["id", "@id", None])
+            recursive = rng.random() < 0.8
+            urlprefixes = rng.choice([set(), {"rdfs"}, {"rdfs", "aat"}])
+            original = json.loads(json.dumps(data))
+
+            expected = containerRecursiveCallback(
+                data=json.loads(json.dumps(data)),
+                attr=attr,
+                callback=idPrefixer,
+                prefix=prefix,
+                urlprefixes=urlprefixes,
+                recursive=recursive,
+            )
+            rewrite = compile_id_prefixer(prefix, frozenset(urlprefixes), recursive)
+            assert rewrite(data, attr, tidy_context=False) == expected
+            assert data == original
+
     def test_prefix_record_ids_none(
         self, sample_data_with_ids, client, namespace, current_app
     ):
@@ -188,6 +264,31 @@ class TestObtainRecord:
         assert "LOD Gateway" in response.headers["Server"]
         assert json.loads(response.data) == data
 
+    def test_relativeid_passes_stored_json_through(self, test_db, client, namespace):
+        data = {"id": "object/123", "nested": [{"id": "object/456"}]}
+        record = Record(
+            entity_id=str(uuid4()),
+            entity_type="Object",
+            datetime_created=datetime(2019, 11, 22, 13, 2, 53, 0),
+            datetime_updated=datetime(2019, 11, 22, 13, 2, 53, 0),
+            data=data,
+            checksum=checksum_json(data),
+        )
+        db.session.add(record)
+        db.session.commit()
+
+        stored = db.session.execute(
+            db.text("SELECT data FROM records WHERE id = :id"), {"id": record.id}
+        ).scalar()
+
+        response = client.get(f"/{namespace}/{record.entity_id}?relativeid=true")
+
+        # the text stored in the DB is sent as-is, without being decoded and re-encoded
+        assert response.status_code == 200
+        assert response.get_data(as_text=True) == stored
+        assert response.headers["ETag"] == f'"{record.checksum}"'
+        assert response.headers["Content-Type"].startswith("application/ld+json")
+
     def test_browse_records_base(self, sample_data, client, namespace):
         response = client.get(f"/{namespace}/*")
         assert response.status_code == 200
@@ -206,3 +307,50 @@ class TestObtainRecord:
         assert "id" in first
         assert "type" in first
         assert "datetime_updated" in first
+
+
+class TestPrefixListing:
+    def add_listing_records(self, count):
+        for n in reversed(range(count)):
+            data = {"id": f"listing/{n:03}", "type": "Object"}
+            db.session.add(
+                Record(
+                    entity_id=data["id"],
+                    entity_type="Object",
+                    datetime_created=datetime(2020, 1, 1),
+                    datetime_updated=datetime(2020, 1, 1),
+                    data=data,
+                )
+            )
+        db.session.commit()
+
+    def test_keyset_pages(self, current_app, test_db, client, namespace):
+        self.add_listing_records(5)
+        current_app.config["BROWSE_PAGE_SIZE"] = 2
+
+        ids = []
+        url = f"/{namespace}/listing/*"
+        while url:
+            doc = client.get(url).get_json()
+            assert doc["total"] == 5
+            ids.extend(item["id"].rsplit("/", 1)[-1] for item in doc["items"])
+            url = doc.get("next", "").replace(current_app.config["BASE_URL"], "")
+
+        # in entity_id order, not the order they were added in
+        assert ids == ["000", "001", "002", "003", "004"]
+
+    def test_numbered_pages_still_work(self, current_app, test_db, client, namespace):
+        self.add_listing_records(5)
+        current_app.config["BROWSE_PAGE_SIZE"] = 2
+
+        doc = client.get(f"/{namespace}/listing/*?page=3").get_json()
+        assert len(doc["items"]) == 1
+        assert doc["prev"].endswith("listing/*?page=2")
+        assert "next" not in doc
+
+        response = client.get(f"/{namespace}/listing/*?page=4")
+        assert response.status_code == 404
+
+    def test_bad_after_token(self, test_db, client, namespace):
+        response = client.get(f"/{namespace}/listing/*?after=%25%25")
+        assert response.status_code == 404
@@ -0,0 +1,115 @@
+import threading
+import pytest
+
+from flaskapp.singleflight import SingleFlight, SingleFlightTimeoutError
+
+
+def run_followers(flights, key, count, results, timeout=5):
+    def follower():
+        try:
+            results.append(flights.do(key, lambda: "not the leader", timeout=timeout))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=follower) for _ in range(count)]
+    for t in threads:
+        t.start()
+    return threads
+
+
+class TestSingleFlight:
+    def test_concurrent_callers_share_the_result(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        started = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        leader_result = []
+        leader = threading.Thread(
+            target=lambda: leader_result.append(flights.do("key", slow))
+        )
+        leader.start()
+        started.wait(5)
+
+        results = []
+        followers = run_followers(flights, "key", 5, results)
+        release.set()
+        for t in [leader] + followers:
+            t.join()
+
+        assert len(calls) == 1
+        assert leader_result == [("result", False)]
+        assert results == [("result", True)] * 5
+
+    def test_errors_are_propagated(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        started = threading.Event()
+
+        def failing():
+            started.set()
+            release.wait(5)
+            raise ValueError("broken")
+
+        leader_error = []
+
+        def leader():
+            try:
+                flights.do("key", failing)
+            except ValueError as e:
+                leader_error.append(e)
+
+        t = threading.Thread(target=leader)
+        t.start()
+        started.wait(5)
+
+        results = []
+        followers = run_followers(flights, "key", 3, results)
+        release.set()
+        for f in [t] + followers:
+            f.join()
+
+        assert len(leader_error) == 1
+        assert all(isinstance(x, ValueError) for x in results)
+
+        # Nothing is left behind for the next caller
+        assert flights.do("key", lambda: "fresh") == ("fresh", False)
+
+    def test_waiting_times_out(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return "late"
+
+        t = threading.Thread(target=lambda: flights.do("key", slow))
+        t.start()
+        started.wait(5)
+
+        with pytest.raises(SingleFlightTimeoutError):
+            flights.do("key", lambda: "not the leader", timeout=0.05)
+        release.set()
+        t.join()
+
+    def test_coalesced_route_response(
+        self, current_app, client, namespace, sample_data
+    ):
+        entity_id = sample_data["record"].entity_id
+        expected = client.get(f"/{namespace}/{entity_id}")
+
+        current_app.config["COALESCE_REQUESTS"] = True
+        response = client.get(f"/{namespace}/{entity_id}")
+        assert response.status_code == 200
+        assert response.data == expected.data
+
+        response = client.get(f"/{namespace}/no/such/record")
+        assert response.status_code == 404
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone
+
+from flaskapp import background
+from flaskapp.models import db
+from flaskapp.models.statistics import Statistics
+from flaskapp.storage_utilities.record import record_create
+from flaskapp.storage_utilities.statistics import (
+    DASHBOARD,
+    compute_dashboard_stats,
+    get_dashboard_stats,
+)
+
+
+def ingest(entity_id, entity_type):
+    record_create({"id": entity_id, "type": entity_type}, process_the_activity=True)
+    db.session.commit()
+
+
+class TestDashboardStatistics:
+    def test_computed(self, current_app, test_db):
+        for n in range(3):
+            ingest(f"stats/{n}", "Person")
+        ingest("stats/g", "Group")
+
+        stats = compute_dashboard_stats()
+        assert stats["num_records"] == 4
+        assert stats["num_changes"] == 4
+        assert stats["last_change"] is not None
+        person, group = stats["entities"]
+        assert person["entity_name"] == "Person"
+        assert person["num_records"] == 3
+        assert person["num_changes"] == 3
+        assert person["most_recent_rec"] == "stats/2"
+        assert person["most_recent_num_changes"] == 1
+        assert group["most_recent_rec"] == "stats/g"
+
+    def test_stored_and_refreshed(self, current_app, test_db):
+        ingest("stats/1", "Person")
+        stats, computed = get_dashboard_stats()
+        assert stats["num_records"] == 1
+
+        # Still fresh - the stored figures are used as they are
+        ingest("stats/2", "Person")
+        assert get_dashboard_stats() == (stats, computed)
+
+        # Out of date - still used, while new ones are computed in the background
+        row = db.session.query(Statistics).filter(Statistics.name == DASHBOARD).one()
+        row.datetime_computed = datetime.now(timezone.utc) - timedelta(days=1)
+        db.session.commit()
+        stale, _ = get_dashboard_stats()
+        assert stale["num_records"] == 1
+        background.get_executor().submit(lambda: None).result()
+        db.session.expire_all()
+
+        fresh, refreshed = get_dashboard_stats()
+        assert fresh["num_records"] == 2
+        assert refreshed > computed
+
+    def test_dashboard_shows_stats_as_of(self, current_app, test_db, client, namespace):
+        ingest("stats/1", "Person")
+        response = client.get(
+            f"/{namespace}/dashboard", headers={"Accept": "text/html"}
+        )
+        assert response.status_code == 200
+        assert b"Stats as of" in response.data
+
+        response = client.get(
+            f"/{namespace}/dashboard", headers={"Accept": "application/json"}
+        )
+        assert response.json["stats"]["num_records"] == 1
+        assert response.json["stats_as_of"] is not None
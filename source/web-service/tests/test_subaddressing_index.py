@@ -0,0 +1,118 @@
+import pytest
+
+from flaskapp.models import db
+from flaskapp.models.record import Record
+from flaskapp.models.subaddress import SubIdentifier
+from flaskapp.routes.records import get_closest_subaddressing_match
+from flaskapp.storage_utilities.record import (
+    record_create,
+    record_update,
+    record_delete,
+)
+from flaskapp.storage_utilities.subaddressing import (
+    find_sub_identifiers,
+    extract_path,
+)
+
+DOCUMENT = {
+    "id": "object/idx1",
+    "type": "HumanMadeObject",
+    "identified_by": [
+        {"id": "http://vocab.getty.edu/aat/300404670", "type": "Type"},
+        {
+            "id": "object/idx1/name",
+            "type": "Name",
+            "content": "Indexed",
+            "part": [{"id": "object/idx1/name/part", "type": "Name"}],
+        },
+    ],
+    "referred_to_by": {
+        "id": "object/idx1/statement",
+        "type": "LinguisticObject",
+        # a deeper reference to a node that also appears nearer the top
+        "about": {"id": "object/idx1/name", "type": "Name"},
+    },
+    # Only "id" is matched by subaddressing, not "@id"
+    "carried_out": {"@id": "object/idx1/carrier", "type": "Activity"},
+}
+
+
+@pytest.fixture
+def index_app(current_app, test_db):
+    current_app.config["SUBADDRESSING"] = True
+    current_app.config["SUBADDRESSING_INDEX"] = True
+    yield current_app
+    current_app.config["SUBADDRESSING_INDEX"] = False
+
+
+def indexed_ids(record_id):
+    return {
+        x
+        for (x,) in db.session.query(SubIdentifier.entity_id).filter(
+            SubIdentifier.record_id == record_id
+        )
+    }
+
+
+class TestSubaddressingIndex:
+    def test_find_sub_identifiers(self):
+        found = find_sub_identifiers(DOCUMENT, "object/idx1")
+
+        assert set(found) == {
+            "object/idx1/name",
+            "object/idx1/name/part",
+            "object/idx1/statement",
+        }
+        assert found["object/idx1/name"] == ["identified_by", 1]
+        assert found["object/idx1/name/part"] == ["identified_by", 1, "part", 0]
+
+        # The same node the unindexed search would pick
+        for value, path in found.items():
+            assert extract_path(DOCUMENT, path) is get_closest_subaddressing_match(
+                DOCUMENT, "id", value
+            )
+
+    def test_maintained_at_ingest(self, index_app):
+        pk = record_create(DOCUMENT)
+        db.session.commit()
+        assert "object/idx1/statement" in indexed_ids(pk)
+
+        record = db.session.get(Record, pk)
+        updated = dict(DOCUMENT)
+        del updated["referred_to_by"]
+        record_update(record, updated)
+        db.session.commit()
+        assert indexed_ids(pk) == {"object/idx1/name", "object/idx1/name/part"}
+
+        record_delete(record, {"id": "object/idx1"})
+        db.session.commit()
+        assert indexed_ids(pk) == set()
+
+    def test_subaddressed_request(self, index_app, client, namespace):
+        record_create(DOCUMENT)
+        db.session.commit()
+
+        response = client.get(f"/{namespace}/object/idx1/name/part?relativeid=true")
+        assert response.status_code == 200
+        assert response.json == {"id": "object/idx1/name/part", "type": "Name"}
+        assert response.headers["Location"].endswith(f"/{namespace}/object/idx1")
+
+        response = client.get(f"/{namespace}/object/idx1/missing")
+        assert response.status_code == 404
+
+    def test_nearest_parent_only(self, index_app, client, namespace):
+        record_create(DOCUMENT)
+        # A nearer parent record, that does not hold the requested id
+        record_create({"id": "object/idx1/name", "type": "Name"})
+        db.session.commit()
+
+        for indexed in (True, False):
+            index_app.config["SUBADDRESSING_INDEX"] = indexed
+            # Not looked for in object/idx1, as the unindexed search does not either
+            response = client.get(f"/{namespace}/object/idx1/name/part")
+            assert response.status_code == 404
+            response = client.get(f"/{namespace}/object/idx1/carrier")
+            assert response.status_code == 404
+            response = client.get(f"/{namespace}/object/idx1/statement?relativeid=true")
+            assert response.status_code == 200
+            assert response.json["id"] == "object/idx1/statement"
@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+
+from flaskapp import background
+from flaskapp.models import db
+from flaskapp.models.record import Record, Version
+from flaskapp.models.timemap import TimeMapPage
+from flaskapp.storage_utilities.record import record_create, record_update
+from flaskapp.storage_utilities.timemaps import record_state, store_timemap
+
+
+def make_versions(entity_id, count):
+    record_create({"id": entity_id, "type": "Person"})
+    db.session.commit()
+    record = db.session.query(Record).filter(Record.entity_id == entity_id).one()
+    for n in range(count):
+        record_update(record, {"id": entity_id, "type": "Person", "n": n})
+        db.session.commit()
+    start = datetime(2020, 1, 1)
+    versions = db.session.query(Version).order_by(Version.id).all()
+    for n, version in enumerate(versions):
+        version.datetime_updated = start + timedelta(days=n)
+    db.session.commit()
+    return [v.entity_id for v in versions]
+
+
+def get_page(client, url):
+    response = client.get(url, headers={"Accept": "application/json"})
+    assert response.status_code == 200
+    return {x["rel"]: x for x in response.get_json() if "memento" not in x["rel"]}, [
+        x for x in response.get_json() if "memento" in x["rel"]
+    ]
+
+
+class TestTimeMapPages:
+    def test_paging(self, client, current_app, test_db, namespace):
+        current_app.config["TIMEMAP_PAGE_SIZE"] = 2
+        versions = make_versions("paged", 5)
+
+        links, mementos = get_page(client, f"/{namespace}/-tm-/paged")
+        assert [m["uri"].rsplit("/", 1)[-1] for m in mementos] == versions[:2:-1]
+        assert mementos[0]["rel"] == "last memento"
+        assert "next" not in links
+        assert links["prev"]["uri"].endswith(f"/-tm-/paged?before={versions[3]}")
+
+        # Back through time to the first memento
+        seen = [m["uri"] for m in mementos]
+        while "prev" in links:
+            links, mementos = get_page(client, links["prev"]["uri"])
+            seen += [m["uri"] for m in mementos]
+            assert "next" in links
+        assert mementos[-1]["rel"] == "first memento"
+        assert links["self"]["from"] == "Wed, 01 Jan 2020 00:00:00 GMT"
+        assert [uri.rsplit("/", 1)[-1] for uri in seen] == versions[::-1]
+
+        # And forward again
+        links, mementos = get_page(client, links["next"]["uri"])
+        assert [m["uri"].rsplit("/", 1)[-1] for m in mementos] == versions[2:0:-1]
+
+        response = client.get(f"/{namespace}/-tm-/paged?before=not-a-version")
+        assert response.status_code == 404
+
+    def test_stored_pages(self, client, current_app, test_db, namespace):
+        current_app.config["TIMEMAP_CACHE"] = True
+        make_versions("cached", 2)
+
+        first = client.get(f"/{namespace}/-tm-/cached")
+        background.get_executor().submit(lambda: None).result()
+        stored = db.session.query(TimeMapPage).one()
+        assert stored.uri.endswith(f"/{namespace}/-tm-/cached")
+        assert client.get(f"/{namespace}/-tm-/cached").data == first.data
+
+        # A new version makes the stored pages out of date
+        record = db.session.query(Record).filter(Record.entity_id == "cached").one()
+        record_update(record, {"id": "cached", "type": "Person", "n": 3})
+        db.session.commit()
+        assert db.session.query(TimeMapPage).count() == 0
+        current_app.config["TIMEMAP_CACHE"] = False
+
+    def test_stored_after_a_change(self, client, current_app, test_db, namespace):
+        current_app.config["TIMEMAP_CACHE"] = True
+        make_versions("raced", 2)
+        record = db.session.query(Record).filter(Record.entity_id == "raced").one()
+        state = record_state(record)
+        stale = client.get(f"/{namespace}/-tm-/raced").data
+        background.get_executor().submit(lambda: None).result()
+        uri, fmt = db.session.query(TimeMapPage.uri, TimeMapPage.format).one()
+
+        record_update(record, {"id": "raced", "type": "Person", "n": 3})
+        db.session.commit()
+        # The page rendered before the update is only stored after it, as the background
+        # thread might have done
+        store_timemap(record.id, state, uri, fmt, stale.decode("utf-8"))
+
+        response = client.get(f"/{namespace}/-tm-/raced")
+        assert response.data != stale
+        assert response.data.count(b'rel="') > stale.count(b'rel="')
+        current_app.config["TIMEMAP_CACHE"] = False
+
+    def test_stored_after_a_version_is_removed(
+        self, client, current_app, test_db, namespace
+    ):
+        current_app.config["TIMEMAP_CACHE"] = True
+        versions = make_versions("pruned", 3)
+        record = db.session.query(Record).filter(Record.entity_id == "pruned").one()
+        state = record_state(record)
+        stale = client.get(f"/{namespace}/-tm-/pruned").data
+        background.get_executor().submit(lambda: None).result()
+        uri, fmt = db.session.query(TimeMapPage.uri, TimeMapPage.format).one()
+
+        # A version other than the latest goes, leaving the record row as it was
+        response = client.delete(
+            f"/{namespace}/-VERSION-/{versions[0]}",
+            headers={"Authorization": "Bearer " + current_app.config["AUTH_TOKEN"]},
+        )
+        assert response.status_code == 200
+        store_timemap(record.id, state, uri, fmt, stale.decode("utf-8"))
+
+        response = client.get(f"/{namespace}/-tm-/pruned")
+        assert versions[0].encode("utf-8") in stale
+        assert versions[0].encode("utf-8") not in response.data
+        current_app.config["TIMEMAP_CACHE"] = False
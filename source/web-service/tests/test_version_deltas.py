@@ -0,0 +1,161 @@
+import json
+import random
+
+import pytest
+
+from flaskapp.models import db
+from flaskapp.models.record import Record, Version
+from flaskapp.storage_utilities.record import record_create, record_update
+from flaskapp.storage_utilities.version_deltas import (
+    apply_patch,
+    convert_versions,
+    make_patch,
+    version_data,
+)
+
+
+def document(n):
+    return {
+        "id": "delta/1",
+        "type": "Person",
+        "_label": f"Person {n}",
+        "flag": n % 2 == 0,
+        "count": n % 2,
+        "names": [{"content": f"Name {x}"} for x in range(n % 4)],
+        "a/b~c": {"nested": [1, 2, n]},
+    }
+
+
+def random_value(rng, depth=0):
+    kind = rng.randrange(6 if depth < 3 else 3)
+    if kind == 0:
+        return rng.randrange(3)
+    if kind == 1:
+        return rng.choice([True, False, None, 1.5])
+    if kind == 2:
+        return rng.choice(["a", "b", "c/d", "e~f"])
+    if kind == 3:
+        return [random_value(rng, depth + 1) for _ in range(rng.randrange(4))]
+    return random_object(rng, depth)
+
+
+def random_object(rng, depth=0):
+    keys = rng.sample(
+        ["id", "type", "_label", "a/b", "c~d", "e", "f"], rng.randrange(6)
+    )
+    return {key: random_value(rng, depth + 1) for key in keys}
+
+
+def random_change(rng, value):
+    """A copy of value with some of its keys and items added, removed, changed or moved"""
+    if isinstance(value, dict):
+        items = [
+            (key, random_change(rng, v))
+            for key, v in value.items()
+            if rng.random() > 0.2
+        ]
+        if rng.random() < 0.3:
+            rng.shuffle(items)
+        for key in ["g", "h", "a/b"]:
+            if rng.random() < 0.2 and key not in value:
+                items.insert(rng.randrange(len(items) + 1), (key, random_value(rng, 2)))
+        return dict(items)
+    if isinstance(value, list):
+        items = [random_change(rng, v) for v in value if rng.random() > 0.2]
+        if rng.random() < 0.3:
+            items.insert(rng.randrange(len(items) + 1), random_value(rng, 2))
+        return items
+    return value if rng.random() < 0.7 else random_value(rng, 2)
+
+
+@pytest.fixture
+def deltas_app(current_app, test_db):
+    current_app.config["VERSION_DELTAS"] = True
+    current_app.config["VERSION_SNAPSHOT_INTERVAL"] = 3
+    yield current_app
+    current_app.config["VERSION_DELTAS"] = False
+
+
+def make_versions(count):
+    record_create(document(0))
+    db.session.commit()
+    record = db.session.query(Record).filter(Record.entity_id == "delta/1").one()
+    for n in range(1, count + 1):
+        record_update(record, document(n))
+        db.session.commit()
+    return record
+
+
+def versions():
+    return db.session.query(Version).order_by(Version.id).all()
+
+
+class TestVersionDeltas:
+    @pytest.mark.parametrize(
+        "src,dst",
+        [
+            (document(1), document(2)),
+            (document(3), document(0)),
+            ({"a": [1, 2, 3, 4]}, {"a": [0, 1, 3, 4, 5]}),
+            ({"a": True}, {"a": 1}),
+            ([1, {"b": 2}], {"b": 2}),
+        ],
+    )
+    def test_patches(self, src, dst):
+        patch = make_patch(src, dst)
+        assert apply_patch(src, patch) == dst
+        # Equal as JSON, not just as Python
+        assert repr(apply_patch(src, patch)) == repr(dst)
+        assert make_patch(dst, dst) == []
+
+    def test_key_order(self):
+        src, dst = {"a": 1, "b": 2}, {"b": 2, "a": 1}
+        assert json.dumps(apply_patch(src, make_patch(src, dst))) == '{"b": 2, "a": 1}'
+
+        rng = random.Random(1)
+        for _ in range(2000):
+            src = random_object(rng)
+            dst = random_change(rng, src)
+            # Serialized the same way as the data it was made from
+            assert json.dumps(apply_patch(src, make_patch(src, dst))) == json.dumps(dst)
+            assert json.dumps(apply_patch(dst, make_patch(dst, src))) == json.dumps(src)
+
+    def test_chain(self, deltas_app, client, namespace, auth_token):
+        make_versions(7)
+        stored = versions()
+        # Every third version is kept in full
+        assert [bool(v.is_delta) for v in stored] == [True, True, False] * 2 + [True]
+        for n, version in enumerate(stored):
+            assert version_data(version) == document(n)
+
+        response = client.get(
+            f"/{namespace}/-VERSION-/{stored[1].entity_id}?relativeid=true",
+            headers={"Authorization": "Bearer " + auth_token},
+        )
+        assert response.status_code == 200
+        assert response.get_json() == document(1)
+
+        # Removing a version leaves the one before it readable
+        response = client.delete(
+            f"/{namespace}/-VERSION-/{stored[5].entity_id}",
+            headers={"Authorization": "Bearer " + auth_token},
+        )
+        assert response.status_code == 200
+        remaining = versions()
+        assert not remaining[4].is_delta
+        assert [version_data(v) for v in remaining] == [
+            document(n) for n in (0, 1, 2, 3, 4, 6)
+        ]
+
+    def test_convert(self, deltas_app):
+        deltas_app.config["VERSION_DELTAS"] = False
+        make_versions(4)
+        assert not any(v.is_delta for v in versions())
+
+        list(convert_versions(10))
+        assert [bool(v.is_delta) for v in versions()] == [True, True, False, True]
+        assert [version_data(v) for v in versions()] == [document(n) for n in range(4)]
+
+        list(convert_versions(10, deltas=False))
+        assert not any(v.is_delta for v in versions())
+        assert [v.data for v in versions()] == [document(n) for n in range(4)]
@@ -0,0 +1,167 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from flaskapp.models import db
+from flaskapp.models.record import Record, Version
+from flaskapp.storage_utilities.record import (
+    record_create,
+    record_delete,
+    record_update,
+)
+from flaskapp.storage_utilities.version_deltas import version_data
+from flaskapp.storage_utilities.version_retention import (
+    parse_thinning,
+    prune_versions,
+    versions_to_prune,
+)
+
+NOW = datetime(2024, 6, 30, 12, tzinfo=timezone.utc)
+
+
+def policy(max_versions=0, max_age=0, thinning=()):
+    return {
+        "max_versions": max_versions,
+        "max_age": max_age,
+        "thinning": list(thinning),
+    }
+
+
+def document(n):
+    return {"id": "pruned/1", "type": "Person", "_label": f"Person {n}"}
+
+
+class TestVersionRetention:
+    def test_parse_thinning(self):
+        assert parse_thinning("90:monthly, 7:Daily") == [(7, "daily"), (90, "monthly")]
+        assert parse_thinning("") == []
+        assert parse_thinning(None) == []
+        for value in ["7:fortnightly", "daily", "x:daily"]:
+            with pytest.raises(ValueError):
+                parse_thinning(value)
+
+    def test_max_versions_and_age(self):
+        versions = [(10 - n, NOW - timedelta(days=n)) for n in range(10)]
+        assert versions_to_prune(versions, policy(), NOW) == []
+        assert versions_to_prune(versions, policy(max_versions=7), NOW) == [3, 2, 1]
+        assert versions_to_prune(versions, policy(max_age=5), NOW) == [4, 3, 2, 1]
+        assert versions_to_prune(versions, policy(max_versions=3, max_age=5), NOW) == [
+            7,
+            6,
+            5,
+            4,
+            3,
+            2,
+            1,
+        ]
+
+    def test_thinning(self):
+        # Every 6 hours over 90 days, newest first
+        versions = [(360 - n, NOW - timedelta(hours=6 * n)) for n in range(360)]
+        removed = set(
+            versions_to_prune(
+                versions, policy(thinning=[(2, "daily"), (30, "monthly")]), NOW
+            )
+        )
+        kept = [
+            updated for version_id, updated in versions if version_id not in removed
+        ]
+        # Everything in the last two days...
+        recent = [x for x in kept if x >= NOW - timedelta(days=2)]
+        assert len(recent) == 9
+        # ...then one a day, the latest of each day...
+        daily = [
+            x for x in kept if NOW - timedelta(days=30) <= x < NOW - timedelta(days=2)
+        ]
+        assert len({x.date() for x in daily}) == len(daily) == 29
+        assert all(x.hour == 18 for x in daily[1:])
+        # ...then one a month
+        monthly = [x for x in kept if x < NOW - timedelta(days=30)]
+        assert [(x.month, x.day, x.hour) for x in monthly] == [(5, 31, 6), (4, 30, 18)]
+
+    def test_prune(self, current_app, test_db):
+        current_app.config["VERSION_DELTAS"] = True
+        current_app.config["VERSION_SNAPSHOT_INTERVAL"] = 3
+        current_app.config["TIMEMAP_CACHE"] = True
+        try:
+            record_create(document(0))
+            db.session.commit()
+            record = (
+                db.session.query(Record).filter(Record.entity_id == "pruned/1").one()
+            )
+            for n in range(1, 9):
+                record_update(record, document(n))
+                db.session.commit()
+            # Version n holds document(n), made n days ago... so that the newest are kept
+            for n, version in enumerate(
+                db.session.query(Version).order_by(Version.id.desc()).all()
+            ):
+                version.datetime_updated = NOW - timedelta(days=n + 1)
+            db.session.commit()
+            stored = db.session.query(Version).order_by(Version.id).all()
+            assert [bool(v.is_delta) for v in stored] == [True, True, False] * 2 + [
+                True,
+                True,
+            ]
+            expected = {v.entity_id: version_data(v) for v in stored}
+
+            progress = list(prune_versions(policy(max_versions=5), batch_size=1))
+            assert progress[-1] == {"records": 1, "removed": 3}
+            db.session.expire_all()
+
+            remaining = db.session.query(Version).order_by(Version.id).all()
+            assert len(remaining) == 5
+            # Each is still read as it was, patches and all
+            for version in remaining:
+                assert version_data(version) == expected[version.entity_id]
+        finally:
+            current_app.config["VERSION_DELTAS"] = False
+            current_app.config["TIMEMAP_CACHE"] = False
+
+    def test_prune_middle(self, current_app, test_db):
+        current_app.config["VERSION_DELTAS"] = True
+        current_app.config["VERSION_SNAPSHOT_INTERVAL"] = 10
+        try:
+            record_create(document(0))
+            db.session.commit()
+            record = (
+                db.session.query(Record).filter(Record.entity_id == "pruned/1").one()
+            )
+            for n in range(1, 6):
+                record_update(record, document(n))
+                db.session.commit()
+            stored = db.session.query(Version).order_by(Version.id).all()
+            assert all(v.is_delta for v in stored)
+            expected = {v.entity_id: version_data(v) for v in stored}
+            # Two versions on the same day, long enough ago to be thinned out
+            noon = datetime.now(timezone.utc).replace(hour=12, minute=0)
+            for version, days in zip(stored, [40, 30, 20, 20, 3]):
+                version.datetime_updated = noon - timedelta(
+                    days=days, minutes=-version.id
+                )
+            db.session.commit()
+
+            list(prune_versions(policy(thinning=[(10, "daily")]), batch_size=10))
+            db.session.expire_all()
+
+            remaining = db.session.query(Version).order_by(Version.id).all()
+            assert len(remaining) == 4
+            # The one before the removed version is no longer a patch against it
+            assert [bool(v.is_delta) for v in remaining] == [True, False, True, True]
+            for version in remaining:
+                assert version_data(version) == expected[version.entity_id]
+        finally:
+            current_app.config["VERSION_DELTAS"] = False
+
+    def test_delete_removes_versions(self, current_app, test_db):
+        record_create(document(0))
+        db.session.commit()
+        record = db.session.query(Record).filter(Record.entity_id == "pruned/1").one()
+        for n in range(1, 4):
+            record_update(record, document(n))
+            db.session.commit()
+        assert len(record.versions) == 3
+
+        record_delete(record, None, commit=True)
+        assert db.session.query(Version).count() == 0
+        assert record.versions == []